@@ -0,0 +1,432 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import contextlib
+import subprocess
+from datetime import datetime
+
+
+# The benchmarks import the modules of the tool, which locate the configuration
+# files relative to the started script.
+tooldir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, tooldir)
+sys.argv[0] = os.path.join(tooldir, "keywordextractor.py")
+
+
+import modules.configuration as conf
+import modules.data_loading as dl
+import modules.data_processing as dp
+import modules.prompt_engineering as pe
+import modules.evaluation as ev
+import modules.commands as commands
+import classes.fake_model as fake_model
+
+
+# The syllables of the synthetic words used for titles and targets.
+syllables = ["ab", "ac", "al", "an", "ar", "ba", "be", "bi", "co", "da", "de",
+             "di", "el", "en", "er", "fa", "ge", "in", "ka", "la", "le", "li",
+             "lo", "ma", "me", "mi", "mo", "na", "ne", "no", "or", "pa", "pe",
+             "po", "ra", "re", "ri", "ro", "sa", "se", "si", "so", "ta", "te",
+             "ti", "to", "un", "va", "ve", "vi"]
+
+
+def build_synthetic_words(rng, num_words):
+    """Build a list of distinct synthetic words.
+
+    :param rng: The random number generator.
+    :param num_words: The number of words.
+    :return words: The list of words.
+    """
+
+    words = {}
+    while len(words) < num_words:
+        word = "".join(rng.choice(syllables)
+                       for _ in range(rng.randint(2, 4)))
+        words[word] = True
+    return list(words)
+
+
+def build_synthetic_dataset(num_documents, num_targets, seed):
+    """Build a synthetic dataset, which resembles the example dataset.
+
+    Every publication has a title and one to three targets as evaluation data.
+    The titles mostly consist of random words, but contain some words of their
+    targets, such that the annotation and the lexical pre-filter see realistic
+    overlaps.
+
+    :param num_documents: The number of publications.
+    :param num_targets: The number of targets.
+    :param seed: The seed of the random number generator.
+    :return publications: The list of publications.
+    :return targets: The list of targets.
+    """
+
+    rng = random.Random(seed)
+    words = build_synthetic_words(rng, max(2000, num_targets))
+
+    targets = {}
+    while len(targets) < num_targets:
+        target = " ".join(rng.choice(words) for _ in range(rng.randint(1, 3)))
+        targets[target.capitalize()] = True
+    targets = list(targets)
+
+    id_index = conf.config["dataset"]["id_index"]
+    document_index = conf.config["dataset"]["document_index"]
+    evaluation_data_index = conf.config["dataset"]["evaluation_data_index"]
+    publications = []
+    for position in range(num_documents):
+        subjects = rng.sample(targets, min(len(targets), rng.randint(1, 3)))
+        title_words = [rng.choice(words) for _ in range(rng.randint(5, 11))]
+        title_words += rng.choice(subjects).lower().split()
+        rng.shuffle(title_words)
+        title = " ".join(title_words).capitalize()
+        publications.append({id_index: position,
+                             document_index: title,
+                             evaluation_data_index: subjects})
+    return publications, targets
+
+
+def measure_stage(stages, name, function, num_items):
+    """Measure the duration of a stage and record it.
+
+    The output of the stage is discarded, as many functions of the tool print
+    progress information.
+
+    :param stages: The map of stage names to their measurements.
+    :param name: The name of the stage.
+    :param function: The function running the stage without arguments.
+    :param num_items: The number of items processed by the stage.
+    :return value: The return value of the function.
+    """
+
+    with open(os.devnull, "w") as devnull:
+        with contextlib.redirect_stdout(devnull):
+            start_time = time.perf_counter()
+            value = function()
+            seconds = time.perf_counter() - start_time
+
+    items_per_second = None
+    if seconds > 0:
+        items_per_second = num_items / seconds
+    stages[name] = {"seconds": seconds,
+                    "items": num_items,
+                    "items_per_second": items_per_second}
+    return value
+
+
+def build_prompt_lists(documents, targets):
+    prompt_lists = []
+    for document in documents:
+        prompt_lists.append(pe.build_query_prompt_lists(document, targets,
+                                                        conf.settings))
+    return prompt_lists
+
+
+def process_prompt_lists(model, prompt_lists, targets_map):
+    annotated_targets_lists = []
+    for document_prompt_lists in prompt_lists:
+        annotated_targets_lists.append(pe.process_query_prompt_lists(
+            model, document_prompt_lists, targets_map, conf.settings))
+    return annotated_targets_lists
+
+
+def build_synthetic_responses(publications, targets, seed):
+    """Build responses of an LLM for all publications. Every response names
+    the evaluation data, a random target and a word, that is no target.
+
+    :param publications: The list of publications.
+    :param targets: The list of targets.
+    :param seed: The seed of the random number generator.
+    :return responses: The list of responses.
+    """
+
+    rng = random.Random(seed)
+    evaluation_data_index = conf.config["dataset"]["evaluation_data_index"]
+    responses = []
+    for publication in publications:
+        response_targets = publication[evaluation_data_index]\
+            + [rng.choice(targets), "Unknown topic"]
+        responses.append(", ".join(response_targets))
+    return responses
+
+
+def parse_responses(responses, targets_map):
+    annotated_targets_lists = []
+    for response in responses:
+        annotated_targets_lists.append(pe.parse_result(response, targets_map,
+                                                       conf.settings))
+    return annotated_targets_lists
+
+
+def write_json(data, filename):
+    with open(filename, "w", encoding="utf-8") as jsonfile:
+        json.dump(data, jsonfile, indent=2)
+
+
+def run_benchmark(num_documents, num_targets, num_sample_documents, seed,
+                  workdir):
+    """Run all stages of the benchmark for one dataset size.
+
+    The stages, that need the LLM, run on a sample of the documents, as they
+    evaluate every document against the whole target list.
+
+    :param num_documents: The number of publications.
+    :param num_targets: The number of targets.
+    :param num_sample_documents: The number of publications annotated by the
+    fake model.
+    :param seed: The seed of the random number generator.
+    :param workdir: The directory for the files of the benchmark.
+    :return run: The map describing the benchmark run and its stages.
+    """
+
+    document_index = conf.config["dataset"]["document_index"]
+    annotation_index = conf.config["dataset"]["annotation_index"]
+    evaluation_data_index = conf.config["dataset"]["evaluation_data_index"]
+    metadata_json = os.path.join(workdir, "metadata.json")
+    sample_json = os.path.join(workdir, "metadata_sample.json")
+    targets_json = os.path.join(workdir, "targets.json")
+    annotated_json = os.path.join(workdir, "annotated_metadata.json")
+    journal_jsonl = os.path.join(workdir, "annotated_metadata.jsonl")
+    for filename in [annotated_json, journal_jsonl]:
+        if os.path.exists(filename):
+            os.remove(filename)
+
+    stages = {}
+    publications, targets = measure_stage(
+        stages, "generate_dataset",
+        lambda: build_synthetic_dataset(num_documents, num_targets, seed),
+        num_documents)
+    sample = publications[:num_sample_documents]
+    write_json(publications, metadata_json)
+    write_json(sample, sample_json)
+    write_json(targets, targets_json)
+    conf.set_option("dataset", "metadata_json", metadata_json)
+    conf.set_option("dataset", "targets_json", targets_json)
+    conf.set_option("dataset", "annotated_json", annotated_json)
+    conf.set_option("dataset", "annotation_journal_jsonl", journal_jsonl)
+
+    del publications
+    publications, targets = measure_stage(stages, "load_data", dl.load_data,
+                                          num_documents)
+    targets_map = dp.build_canonical_targets_map(targets, conf.settings)
+
+    sample_documents = []
+    for publication in sample:
+        sample_documents.append(publication[document_index])
+    prompt_lists = measure_stage(
+        stages, "build_query_prompt_lists",
+        lambda: build_prompt_lists(sample_documents, targets),
+        len(sample_documents))
+
+    model = fake_model.fake_model(conf.settings)
+    measure_stage(stages, "process_query_prompt_lists",
+                  lambda: process_prompt_lists(model, prompt_lists,
+                                               targets_map),
+                  len(sample_documents))
+    del prompt_lists
+
+    conf.set_option("dataset", "metadata_json", sample_json)
+    measure_stage(stages, "annotate", commands.annotate, len(sample))
+    conf.set_option("dataset", "metadata_json", metadata_json)
+    os.remove(annotated_json)
+
+    responses = build_synthetic_responses(publications, targets, seed)
+    annotated_targets_lists = measure_stage(
+        stages, "parse_result",
+        lambda: parse_responses(responses, targets_map),
+        len(responses))
+    del responses
+    for publication, annotated_targets in zip(publications,
+                                              annotated_targets_lists):
+        publication[annotation_index] = annotated_targets
+
+    measure_stage(stages, "write_annotated_json",
+                  lambda: write_json(publications, annotated_json),
+                  num_documents)
+    annotated_json_bytes = os.path.getsize(annotated_json)
+    os.remove(annotated_json)
+
+    measure_stage(stages, "build_targets_count_stats",
+                  lambda: ev.build_targets_count_stats(publications,
+                                                       annotation_index),
+                  num_documents)
+    measure_stage(stages, "build_matching_targets_count_stats",
+                  lambda: ev.build_matching_targets_count_stats(
+                      publications, annotation_index, evaluation_data_index),
+                  num_documents)
+
+    write_json(publications, annotated_json)
+    conf.set_option("dataset", "annotated_json", annotated_json)
+    measure_stage(stages, "build_annotation_statistics",
+                  lambda: ev.build_annotation_statistics(
+                      dl.iter_annotated_metadata(), targets, annotation_index,
+                      evaluation_data_index),
+                  num_documents)
+    os.remove(annotated_json)
+
+    return {"documents": num_documents,
+            "targets": num_targets,
+            "sample_documents": len(sample),
+            "metadata_json_bytes": os.path.getsize(metadata_json),
+            "annotated_json_bytes": annotated_json_bytes,
+            "stages": stages}
+
+
+def run_startup_benchmark(num_runs, seed, workdir):
+    """Measure how long the "evaluate" subcommand takes for a small file,
+    which mostly consists of the start of the interpreter and the imports of
+    the tool.
+
+    The subcommand is run in new processes from a copy of the tool directory,
+    which links the code of the tool and uses the default configuration.
+
+    :param num_runs: The number of runs.
+    :param seed: The seed of the random number generator.
+    :param workdir: The directory for the temporary files.
+    :return startup: A map containing the duration of every run and their
+    minimum and median.
+    """
+
+    startup_dir = os.path.join(workdir, "startup")
+    os.makedirs(os.path.join(startup_dir, "config"))
+    for name in ["keywordextractor.py", "modules", "classes",
+                 os.path.join("config", "config-defaults.ini")]:
+        os.symlink(os.path.join(tooldir, name),
+                   os.path.join(startup_dir, name))
+
+    annotation_index = conf.config["dataset"]["annotation_index"]
+    evaluation_data_index = conf.config["dataset"]["evaluation_data_index"]
+    publications, targets = build_synthetic_dataset(100, 19, seed)
+    for publication in publications:
+        publication[annotation_index] = publication[evaluation_data_index][:1]
+    annotated_json = os.path.join(startup_dir, "annotated.json")
+    targets_json = os.path.join(startup_dir, "targets.json")
+    write_json(publications, annotated_json)
+    write_json(targets, targets_json)
+    with open(os.path.join(startup_dir, "config", "config.ini"), "w",
+              encoding="utf-8") as configfile:
+        configfile.write(f"[dataset]\n"
+                         f"annotated_json = {annotated_json}\n"
+                         f"targets_json = {targets_json}\n")
+
+    seconds_list = []
+    for _ in range(num_runs):
+        start_time = time.perf_counter()
+        process = subprocess.run(
+            [sys.executable, os.path.join(startup_dir, "keywordextractor.py"),
+             "evaluate"], capture_output=True, text=True)
+        seconds_list.append(time.perf_counter() - start_time)
+        if process.returncode != 0:
+            print(process.stdout + process.stderr)
+            sys.exit(1)
+
+    sorted_seconds = sorted(seconds_list)
+    return {"command": "evaluate",
+            "documents": len(publications),
+            "seconds": seconds_list,
+            "min_seconds": sorted_seconds[0],
+            "median_seconds": sorted_seconds[len(sorted_seconds) // 2]}
+
+
+def get_commit():
+    """Get the git commit of the tool.
+
+    :return commit: The commit hash or None, if it cannot be determined.
+    """
+
+    try:
+        process = subprocess.run(["git", "rev-parse", "HEAD"], cwd=tooldir,
+                                 capture_output=True, text=True)
+    except OSError:
+        return None
+    if process.returncode != 0:
+        return None
+    return process.stdout.strip()
+
+
+def parse_number_list(value):
+    return [int(number) for number in value.split(",")]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run the end-to-end benchmarks of the keywordextractor "
+                    "with synthetic datasets and the fake backend.")
+    parser.add_argument("--documents", type=parse_number_list,
+                        default=[10000, 100000],
+                        help="Comma separated numbers of documents.")
+    parser.add_argument("--targets", type=parse_number_list,
+                        default=[19, 2000, 20000],
+                        help="Comma separated numbers of targets.")
+    parser.add_argument("--sample", type=int, default=100,
+                        help="The number of documents annotated by the fake "
+                             "model.")
+    parser.add_argument("--prompt-token-latency-ms", type=float, default=0,
+                        help="The simulated time per prompt token.")
+    parser.add_argument("--token-latency-ms", type=float, default=0,
+                        help="The simulated time per generated token.")
+    parser.add_argument("--startup-runs", type=int, default=5,
+                        help="The number of runs of the startup benchmark.")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output",
+                        help="The JSON file for the results. Defaults to "
+                             "benchmarks/results/<timestamp>.json.")
+    arguments = parser.parse_args()
+
+    # The benchmarks always use the default configuration, such that the
+    # results of different checkouts are comparable.
+    conf.config.clear()
+    conf.config.read(conf.defaultfile)
+    conf.set_option("backend", "backend", "fake")
+    conf.set_option("backend", "fake_prompt_token_latency_ms",
+                    arguments.prompt_token_latency_ms)
+    conf.set_option("backend", "fake_token_latency_ms",
+                    arguments.token_latency_ms)
+
+    output_file = arguments.output
+    if output_file is None:
+        timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        output_file = os.path.join(tooldir, "benchmarks", "results",
+                                   timestamp + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
+
+    results = {"commit": get_commit(),
+               "timestamp": datetime.now().isoformat(),
+               "python": platform.python_version(),
+               "platform": platform.platform(),
+               "settings": {"sample_documents": arguments.sample,
+                            "prompt_token_latency_ms":
+                                arguments.prompt_token_latency_ms,
+                            "token_latency_ms": arguments.token_latency_ms,
+                            "seed": arguments.seed,
+                            "config": conf.get_snapshot()},
+               "runs": []}
+
+    with tempfile.TemporaryDirectory() as workdir:
+        if arguments.startup_runs > 0:
+            print("Running the startup benchmark.")
+            results["startup"] = run_startup_benchmark(arguments.startup_runs,
+                                                       arguments.seed,
+                                                       workdir)
+            print(f"  evaluate: {results['startup']['median_seconds']:.3f} s "
+                  f"(median of {arguments.startup_runs} runs)")
+
+        for num_documents in arguments.documents:
+            for num_targets in arguments.targets:
+                print(f"Running the benchmark with {num_documents} documents "
+                      f"and {num_targets} targets.")
+                run = run_benchmark(num_documents, num_targets,
+                                    min(arguments.sample, num_documents),
+                                    arguments.seed, workdir)
+                for name, stage in run["stages"].items():
+                    print(f"  {name}: {stage['seconds']:.3f} s "
+                          f"({stage['items']} items)")
+                results["runs"].append(run)
+
+    write_json(results, output_file)
+    print(f"Saved the results in {output_file}.")
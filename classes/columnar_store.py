@@ -0,0 +1,140 @@
+import os
+import json
+import collections.abc
+
+
+import numpy as np
+
+
+class columnar_store(collections.abc.Sequence):
+    """Read-only access to publications saved in the columnar format of
+    data_storing.write_columnar_store().
+
+    The store is a directory with a manifest and a few files per field of the
+    publications, which are memory-mapped. A publication is only decoded when
+    it is accessed, and only the fields that are accessed are decoded (see
+    columnar_record). Accordingly, opening a store is fast and its memory
+    usage does not grow with the number of publications.
+    """
+
+    manifest_name = "manifest.json"
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, self.manifest_name), "r",
+                  encoding="utf-8") as jsonfile:
+            manifest = json.load(jsonfile)
+        self.count = manifest["count"]
+        self.targets = manifest["targets"]
+        self.fields = manifest["fields"]
+        self.field_names = [field["name"] for field in self.fields]
+        self.field_indices = {field["name"]: index
+                              for index, field in enumerate(self.fields)}
+
+        self.columns = []
+        for index in range(len(self.fields)):
+            field = self.fields[index]
+            column = {"present": None}
+            if field["optional"]:
+                column["present"] = self.load_array(index, "present")
+            if field["type"] == "integer":
+                column["values"] = self.load_array(index, "values")
+            elif field["type"] == "targets":
+                column["bits"] = self.load_array(index, "bits")
+            else:
+                column["offsets"] = self.load_array(index, "offsets")
+                column["blob"] = self.load_blob(index)
+            self.columns.append(column)
+
+    def get_path(self, index, suffix):
+        return os.path.join(self.directory, f"field_{index}.{suffix}")
+
+    def load_array(self, index, name):
+        return np.load(self.get_path(index, name + ".npy"), mmap_mode="r")
+
+    def load_blob(self, index):
+        path = self.get_path(index, "blob")
+        if os.path.getsize(path) == 0:
+            # Empty files cannot be memory-mapped.
+            return np.zeros(0, dtype=np.uint8)
+        return np.memmap(path, dtype=np.uint8, mode="r")
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self[index]
+                    for index in range(*position.indices(self.count))]
+        if position < 0:
+            position += self.count
+        if position < 0 or position >= self.count:
+            raise IndexError("publication index out of range")
+        return columnar_record(self, position)
+
+    def has_field(self, position, name):
+        """Check whether a publication has a field.
+
+        :param position: The position of the publication.
+        :param name: The name of the field.
+        :return has_field: True if the publication has the field.
+        """
+
+        index = self.field_indices.get(name)
+        if index is None:
+            return False
+        present = self.columns[index]["present"]
+        if present is None:
+            return True
+        return bool(present[position])
+
+    def get_field(self, position, name):
+        """Decode a field of a publication.
+
+        :param position: The position of the publication.
+        :param name: The name of the field.
+        :return value: The value of the field.
+        """
+
+        if not self.has_field(position, name):
+            raise KeyError(name)
+        index = self.field_indices[name]
+        field_type = self.fields[index]["type"]
+        column = self.columns[index]
+
+        if field_type == "integer":
+            return int(column["values"][position])
+        if field_type == "targets":
+            bits = np.unpackbits(column["bits"][position])
+            return [self.targets[target_index]
+                    for target_index in np.flatnonzero(bits)]
+
+        start = int(column["offsets"][position])
+        end = int(column["offsets"][position + 1])
+        text = bytes(column["blob"][start:end]).decode("utf-8")
+        if field_type == "text":
+            return text
+        return json.loads(text)
+
+
+class columnar_record(collections.abc.Mapping):
+    """A publication of a columnar_store, whose fields are decoded when they
+    are accessed. Use dict() to decode all fields at once."""
+
+    def __init__(self, store, position):
+        self.store = store
+        self.position = position
+
+    def __getitem__(self, name):
+        return self.store.get_field(self.position, name)
+
+    def __contains__(self, name):
+        return self.store.has_field(self.position, name)
+
+    def __iter__(self):
+        for name in self.store.field_names:
+            if self.store.has_field(self.position, name):
+                yield name
+
+    def __len__(self):
+        return sum(1 for name in self)
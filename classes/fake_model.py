@@ -0,0 +1,138 @@
+import re
+import time
+import hashlib
+
+
+import modules.prompt_engineering as pe
+import modules.metrics as metrics
+
+
+class fake_model:
+    """Model backend that answers without an LLM.
+
+    The answers are chosen deterministically from the targets presented in
+    the chat, based on a hash of the document. The backend is meant for
+    testing the pipeline and is also served by the "serve-fake-backend"
+    subcommand, which stands in for an OpenAI-compatible server. In order to
+    simulate an LLM, every evaluated prompt list can take a configurable time
+    per prompt token and per generated token.
+    """
+
+    # Extracts the targets of a prompt built by build_targets_prompt().
+    targets_pattern = re.compile(r"targets_list: (.*)\. Please use the exact "
+                                 r"spelling that I provide to you\.$",
+                                 re.DOTALL)
+    # Extracts the document of a prompt built by build_query_prompt().
+    document_pattern = re.compile(r"^Given the following [^:\n]*: (.*)$",
+                                  re.MULTILINE)
+    # Extracts the numbered documents of a batch prompt.
+    numbered_document_pattern = re.compile(r"^(\d+)\. (.*)$", re.MULTILINE)
+
+    def __init__(self, settings, targets_map=None):
+        self.num_targets = settings["prompt"]["num_targets"]
+        self.prompt_token_latency =\
+            settings["backend"]["fake_prompt_token_latency_ms"] / 1000
+        self.token_latency =\
+            settings["backend"]["fake_token_latency_ms"] / 1000
+        self.concurrency = 1
+
+    def get_generation_settings(self):
+        """Return all settings that influence the generated responses.
+
+        :return settings: A map of the setting names to their values.
+        """
+
+        return {"backend": "fake", "num_targets": self.num_targets}
+
+    def take_counters(self):
+        """Return the counters collected since the last call and reset them.
+
+        :return counters: A map of counter names to their values.
+        """
+
+        return {}
+
+    def close(self):
+        """Release the resources of the model, of which this backend has
+        none."""
+
+        pass
+
+    @metrics.timed("final_generate")
+    def eval_prompt_list(self, prompt_list, final_max_tokens=200,
+                         num_lines=1):
+        """Evaluate a list of prompts in one chat.
+
+        :param prompt_list: The list of prompts that should be evaluated.
+        :param final_max_tokens: The maximum number of tokens that are
+        generated in response to the last prompt.
+        :param num_lines: The number of lines expected in response to the
+        last prompt.
+        :return result: The response to the last prompt of the list.
+        """
+
+        messages = [{"role": "user", "content": prompt}
+                    for prompt in prompt_list]
+        response = self.respond(messages, final_max_tokens)
+
+        prompt_tokens = 0
+        for prompt in prompt_list:
+            prompt_tokens += pe.estimate_tokens(prompt)
+        generated_tokens = pe.estimate_tokens(response)
+        metrics.collector.increment("prompt_tokens", prompt_tokens)
+        metrics.collector.increment("generated_tokens", generated_tokens)
+        metrics.collector.observe("prompt_tokens", prompt_tokens)
+        if self.prompt_token_latency > 0 or self.token_latency > 0:
+            time.sleep(prompt_tokens * self.prompt_token_latency
+                       + generated_tokens * self.token_latency)
+        return response
+
+    def choose_targets(self, document, targets):
+        """Choose the targets of a document.
+
+        :param document: The document.
+        :param targets: The targets presented in the chat.
+        :return chosen_targets: The list of chosen targets.
+        """
+
+        digest = hashlib.sha256(document.encode("utf-8")).digest()
+        chosen_targets = []
+        for index in range(self.num_targets):
+            target = targets[digest[index] % len(targets)]
+            if target not in chosen_targets:
+                chosen_targets.append(target)
+        return chosen_targets
+
+    def respond(self, messages, max_tokens):
+        """Generate the response to the last message of a chat.
+
+        :param messages: The list of chat messages.
+        :param max_tokens: The maximum number of tokens to generate, which is
+        applied as four characters per token.
+        :return response: The response.
+        """
+
+        targets = []
+        for message in messages:
+            if message["role"] != "user":
+                continue
+            match = self.targets_pattern.search(message["content"])
+            if match is not None:
+                targets += match.group(1).split(", ")
+
+        prompt = messages[-1]["content"]
+        numbered_documents = self.numbered_document_pattern.findall(prompt)
+        document_match = self.document_pattern.search(prompt)
+        if len(targets) == 0 or (len(numbered_documents) == 0
+                                 and document_match is None):
+            response = "OK."
+        elif len(numbered_documents) > 0:
+            lines = []
+            for number, document in numbered_documents:
+                lines.append(number + ": " + ", ".join(
+                    self.choose_targets(document, targets)))
+            response = "\n".join(lines)
+        else:
+            response = ", ".join(self.choose_targets(document_match.group(1),
+                                                     targets))
+        return response[:max_tokens * 4]
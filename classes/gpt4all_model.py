@@ -4,24 +4,356 @@ import sys
 import gpt4all
 
 
-import modules.configuration as conf
+import modules.metrics as metrics
+import classes.target_trie as target_trie
+
+
+# The model loaded most recently in this process and the settings it was
+# loaded with. A new instance with the same settings reuses the loaded model,
+# e.g. in the runs of a sweep, which are ordered by the model.
+loaded_model = None
+loaded_model_key = None
 
 
 class gpt4all_model:
 
-    def __init__(self):
-        model_name = conf.config["gpt4all"]["model_name"]
-        device = conf.config["gpt4all"]["device"]
-        self.model = gpt4all.GPT4All(model_name, device=device)
+    def __init__(self, settings, targets_map=None):
+        self.debug_mode = settings["general"]["debug"]
+        model_name = settings["gpt4all"]["model_name"]
+        device = settings["gpt4all"]["device"]
+        self.model_name = model_name
+        self.reuse_preamble = settings["gpt4all"]["reuse_preamble"]
+        self.intermediate_max_tokens =\
+            settings["gpt4all"]["intermediate_max_tokens"]
+        self.num_targets = settings["prompt"]["num_targets"]
+        self.constrained_decoding = settings["gpt4all"]["constrained_decoding"]
+        self.constrained_retry = settings["gpt4all"]["constrained_retry"]
+        self.sampling_settings = {
+            "temp": settings["gpt4all"]["temperature"],
+            "top_k": settings["gpt4all"]["top_k"],
+            "top_p": settings["gpt4all"]["top_p"]}
+        n_threads = settings["gpt4all"]["n_threads"]
+        if n_threads == 0:
+            n_threads = None
+        n_ctx = settings["gpt4all"]["n_ctx"]
+        self.model = load_gpt4all(model_name, device, n_threads, n_ctx)
+        # The model runs in this process and annotates one document at a
+        # time.
+        self.concurrency = 1
+
+        # The targets a response may consist of, which are checked while the
+        # response is generated.
+        self.trie = None
+        if self.constrained_decoding == 1 and targets_map is not None:
+            self.trie = target_trie.target_trie(targets_map.keys())
+        self.constrained_aborts = 0
+        self.constrained_retries = 0
+
+        # State of the chat session that is kept open in order to reuse the
+        # evaluated preamble (all prompts of a prompt list except the last
+        # one) for multiple documents.
+        self.session = None
+        self.preamble = None
+        self.preamble_n_past = 0
+        self.preamble_history_length = 0
+
+    def get_generation_settings(self):
+        """Return all settings that influence the generated responses.
+
+        Settings that only influence the speed of the generation, like the
+        device or the number of threads, are not part of the result.
+
+        :return settings: A map of the setting names to their values.
+        """
+
+        settings = {"backend": "gpt4all",
+                    "model_name": self.model_name,
+                    "intermediate_max_tokens": self.intermediate_max_tokens,
+                    "num_targets": self.num_targets,
+                    "constrained_decoding": self.constrained_decoding,
+                    "constrained_retry": self.constrained_retry}
+        settings.update(self.sampling_settings)
+        return settings
+
+    def take_counters(self):
+        """Return the counters collected since the last call and reset them.
+
+        :return counters: A map of counter names to their values.
+        """
+
+        counters = {}
+        if self.trie is not None:
+            counters["constrained_aborts"] = self.constrained_aborts
+            counters["constrained_retries"] = self.constrained_retries
+        self.constrained_aborts = 0
+        self.constrained_retries = 0
+        return counters
+
+    def eval_prompt_list(self, prompt_list, final_max_tokens=200,
+                         num_lines=1):
+        """Evaluate a list of prompts in one chat session.
+
+        All prompts except the last one are intermediate prompts, whose
+        responses are discarded. Only the response to the last prompt is
+        returned.
+
+        :param prompt_list: The list of prompts that should be evaluated.
+        :param final_max_tokens: The maximum number of tokens that are
+        generated in response to the last prompt.
+        :param num_lines: The number of lines expected in response to the
+        last prompt (one per annotated document).
+        :return result: The response to the last prompt of the list.
+        """
+
+        if self.reuse_preamble == 1:
+            return self.eval_prompt_list_from_preamble(prompt_list,
+                                                       final_max_tokens,
+                                                       num_lines)
 
-    def eval_prompt_list(self, prompt_list):
-        debug_mode = int(conf.config["general"]["debug"])
         with self.model.chat_session():
             current_index = 1
             for index in range(len(prompt_list)):
-                if debug_mode == 1:
+                if self.debug_mode == 1:
                     print(f"Running prompt {current_index}/"
                           f"{len(prompt_list)}.")
-                result = self.model.generate(prompt_list[index])
+                if index < len(prompt_list) - 1:
+                    self.generate_intermediate(prompt_list[index])
+                else:
+                    result = self.generate_final(prompt_list[index],
+                                                 final_max_tokens,
+                                                 num_lines)
                 current_index += 1
         return result
+
+    def get_n_past(self):
+        """Return the number of tokens evaluated in the model context."""
+
+        if self.model.model.context is None:
+            return 0
+        return self.model.model.context.n_past
+
+    def generate(self, prompt, max_tokens, callback=None):
+        """Evaluate a prompt and count the prompt tokens and the generated
+        tokens in the metrics collector.
+
+        :param prompt: The prompt that should be evaluated.
+        :param max_tokens: The maximum number of tokens to generate.
+        :param callback: The callback of gpt4all, which is called for every
+        generated token, or None.
+        :return result: The response of the model.
+        """
+
+        generated_tokens = 0
+
+        def counting_callback(token_id, token):
+            nonlocal generated_tokens
+            generated_tokens += 1
+            if callback is None:
+                return True
+            return callback(token_id, token)
+
+        n_past = self.get_n_past()
+        result = self.model.generate(prompt, max_tokens=max_tokens,
+                                     callback=counting_callback,
+                                     **self.sampling_settings)
+        # The context grows by the tokens of the prompt (including the chat
+        # template) and the generated tokens.
+        prompt_tokens = max(0, self.get_n_past() - n_past - generated_tokens)
+        metrics.collector.increment("prompt_tokens", prompt_tokens)
+        metrics.collector.increment("generated_tokens", generated_tokens)
+        metrics.collector.observe("prompt_tokens", prompt_tokens)
+        return result
+
+    @metrics.timed("preamble_ingest")
+    def generate_intermediate(self, prompt):
+        """Evaluate an intermediate prompt, whose response is not used.
+
+        Depending on the configuration, the prompt is only ingested into the
+        model context or a small number of tokens is generated.
+
+        :param prompt: The prompt that should be evaluated.
+        """
+
+        self.generate(prompt, self.intermediate_max_tokens)
+
+    @metrics.timed("final_generate")
+    def generate_final(self, prompt, max_tokens, num_lines=1):
+        """Evaluate the final annotation prompt and return its response.
+
+        The generation stops after max_tokens tokens or at the end of the
+        expected number of lines. If a single line is expected, it also stops
+        as soon as the response contains more separators than needed for the
+        configured number of targets.
+
+        With constrained decoding, a single line response is checked against
+        the known targets while it is generated. The generation stops as soon
+        as the configured number of targets is complete and is aborted as soon
+        as the response can no longer be parsed. An aborted response is
+        generated once more if a retry is configured.
+
+        :param prompt: The prompt that should be evaluated.
+        :param max_tokens: The maximum number of tokens to generate.
+        :param num_lines: The number of lines expected in the response.
+        :return result: The response of the model.
+        """
+
+        if self.trie is None or num_lines != 1:
+            return self.generate_response(prompt, max_tokens, num_lines)[0]
+
+        # The state before the prompt, which is restored for a retry.
+        n_past = self.get_n_past()
+        history_length = len(self.model._history)
+
+        result, aborted = self.generate_response(prompt, max_tokens,
+                                                 num_lines)
+        if aborted:
+            self.constrained_aborts += 1
+            if self.constrained_retry == 1:
+                self.constrained_retries += 1
+                if self.model.model.context is not None:
+                    self.model.model.context.n_past = n_past
+                del self.model._history[history_length:]
+                result, aborted = self.generate_response(prompt, max_tokens,
+                                                         num_lines)
+                if aborted:
+                    self.constrained_aborts += 1
+        return result
+
+    def generate_response(self, prompt, max_tokens, num_lines):
+        """Generate the response to the final annotation prompt (see
+        generate_final()).
+
+        :param prompt: The prompt that should be evaluated.
+        :param max_tokens: The maximum number of tokens to generate.
+        :param num_lines: The number of lines expected in the response.
+        :return result: The response of the model.
+        :return aborted: Whether the generation was aborted, because the
+        response could no longer be parsed into known targets.
+        """
+
+        response = []
+        aborted = False
+
+        def stop_callback(token_id, token):
+            nonlocal aborted
+            response.append(token)
+            text = "".join(response).lstrip()
+            if text.count("\n") >= num_lines:
+                return False
+            if num_lines == 1 and text.count(",") >= self.num_targets:
+                return False
+            if self.trie is not None and num_lines == 1:
+                num_complete, viable = self.trie.check_response(text)
+                if not viable:
+                    aborted = True
+                    return False
+                if num_complete >= self.num_targets:
+                    return False
+            return True
+
+        result = self.generate(prompt, max_tokens, stop_callback)
+        return result, aborted
+
+    def eval_prompt_list_from_preamble(self, prompt_list,
+                                       final_max_tokens=200, num_lines=1):
+        """Evaluate a prompt list by reusing the state of an already evaluated
+        preamble.
+
+        All prompts except the last one form the preamble of the prompt list.
+        If the preamble equals the one evaluated in the open chat session, the
+        model context is rewound to the state right after the preamble and
+        only the last prompt is evaluated. Otherwise, a new chat session is
+        opened and the preamble is evaluated once.
+
+        :param prompt_list: The list of prompts that should be evaluated.
+        :param final_max_tokens: The maximum number of tokens that are
+        generated in response to the last prompt.
+        :param num_lines: The number of lines expected in response to the
+        last prompt.
+        :return result: The response to the last prompt of the list.
+        """
+
+        preamble = prompt_list[:-1]
+        if self.session is None or preamble != self.preamble:
+            self.load_preamble(preamble)
+        else:
+            if self.debug_mode == 1:
+                print(f"Reusing the state of {len(preamble)} preamble "
+                      f"prompts.")
+            self.rewind_to_preamble()
+
+        if self.debug_mode == 1:
+            print(f"Running prompt {len(prompt_list)}/{len(prompt_list)}.")
+        return self.generate_final(prompt_list[-1], final_max_tokens,
+                                   num_lines)
+
+    def load_preamble(self, preamble):
+        """Open a new chat session, evaluate the given preamble prompts in it
+        and remember the resulting model state.
+
+        :param preamble: The list of prompts that form the preamble.
+        """
+
+        self.close_session()
+        self.session = self.model.chat_session()
+        self.session.__enter__()
+        for index in range(len(preamble)):
+            if self.debug_mode == 1:
+                print(f"Running preamble prompt {index + 1}/"
+                      f"{len(preamble)}.")
+            self.generate_intermediate(preamble[index])
+        self.preamble = list(preamble)
+        # gpt4all does not expose the chat state publicly. The number of
+        # evaluated tokens (n_past) marks the end of the preamble in the KV
+        # cache, everything behind it is overwritten by the next prompt.
+        self.preamble_n_past = self.get_n_past()
+        self.preamble_history_length = len(self.model._history)
+
+    def rewind_to_preamble(self):
+        """Reset the open chat session to the state right after the
+        evaluation of its preamble."""
+
+        if self.model.model.context is not None:
+            self.model.model.context.n_past = self.preamble_n_past
+        del self.model._history[self.preamble_history_length:]
+
+    def close_session(self):
+        """Close the chat session that is kept open for preamble reuse."""
+
+        if self.session is not None:
+            self.session.__exit__(None, None, None)
+        self.session = None
+        self.preamble = None
+        self.preamble_n_past = 0
+        self.preamble_history_length = 0
+
+    def close(self):
+        """Close the open chat session, such that the loaded model can be
+        used by another instance."""
+
+        self.close_session()
+
+
+def load_gpt4all(model_name, device, n_threads, n_ctx):
+    """Load a model with gpt4all or return the loaded model if it was loaded
+    with the same settings before. Otherwise, the previously loaded model is
+    released before the new one is loaded.
+
+    :param model_name: The name of the model.
+    :param device: The device the model runs on.
+    :param n_threads: The number of CPU threads or None.
+    :param n_ctx: The size of the context window.
+    :return model: The loaded gpt4all model.
+    """
+
+    global loaded_model
+    global loaded_model_key
+
+    model_key = (model_name, device, n_threads, n_ctx)
+    if loaded_model_key != model_key:
+        loaded_model = None
+        loaded_model_key = None
+        loaded_model = gpt4all.GPT4All(model_name, device=device,
+                                       n_threads=n_threads, n_ctx=n_ctx)
+        loaded_model_key = model_key
+    return loaded_model
@@ -0,0 +1,175 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+
+class inference_cache:
+    """Persistent cache for the responses of a model.
+
+    The cache wraps a model and provides the same eval_prompt_list() method.
+    Responses are stored in an SQLite database and are keyed by a hash of the
+    generation settings of the model and the exact prompt list. If the database
+    grows larger than the configured size, the least recently used responses
+    are removed. The access times of cached responses are written once per
+    block of documents, when the counters are taken. The cache can be used by
+    multiple threads if the wrapped model can.
+    """
+
+    def __init__(self, model, cache_file, settings):
+        self.model = model
+        self.concurrency = model.concurrency
+        self.debug_mode = settings["general"]["debug"]
+        self.max_size = settings["cache"]["max_size_mb"] * 1024 * 1024
+        self.settings = model.get_generation_settings()
+        self.hits = 0
+        self.misses = 0
+        # The access times of cached responses, which are written in one
+        # transaction per block (see write_access_times()) instead of one per
+        # hit.
+        self.access_times = {}
+        self.lock = threading.Lock()
+
+        cache_dir = os.path.dirname(cache_file)
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir, 0o775)
+        self.connection = sqlite3.connect(cache_file, timeout=60,
+                                          check_same_thread=False)
+        # The write-ahead log allows multiple annotation workers to read the
+        # cache while another one writes to it.
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS responses ("
+                                "key TEXT PRIMARY KEY, "
+                                "response TEXT NOT NULL, "
+                                "size INTEGER NOT NULL, "
+                                "last_access REAL NOT NULL)")
+        self.connection.commit()
+        self.size = self.compute_size()
+
+    def compute_size(self):
+        """Compute the size of all cached responses in bytes."""
+
+        row = self.connection.execute("SELECT COALESCE(SUM(size), 0) "
+                                      "FROM responses").fetchone()
+        return row[0]
+
+    def build_key(self, prompt_list, final_max_tokens, num_lines):
+        """Build the cache key of a prompt list.
+
+        :param prompt_list: The list of prompts that should be evaluated.
+        :param final_max_tokens: The maximum number of tokens that are
+        generated in response to the last prompt.
+        :param num_lines: The number of lines expected in response to the
+        last prompt.
+        :return key: The hex digest identifying the request.
+        """
+
+        request = {"settings": self.settings,
+                   "final_max_tokens": final_max_tokens,
+                   "num_lines": num_lines,
+                   "prompt_list": prompt_list}
+        request_string = json.dumps(request, sort_keys=True)
+        return hashlib.sha256(request_string.encode("utf-8")).hexdigest()
+
+    def eval_prompt_list(self, prompt_list, final_max_tokens=200,
+                         num_lines=1):
+        """Return the cached response to a prompt list or evaluate it with
+        the wrapped model and cache the response.
+
+        :param prompt_list: The list of prompts that should be evaluated.
+        :param final_max_tokens: The maximum number of tokens that are
+        generated in response to the last prompt.
+        :param num_lines: The number of lines expected in response to the
+        last prompt.
+        :return result: The response to the last prompt of the list.
+        """
+
+        key = self.build_key(prompt_list, final_max_tokens, num_lines)
+
+        with self.lock:
+            row = self.connection.execute("SELECT response FROM responses "
+                                          "WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                if self.debug_mode == 1:
+                    print("Using the cached response for the prompt list.")
+                self.hits += 1
+                self.access_times[key] = time.time()
+                return row[0]
+            self.misses += 1
+
+        # The model is queried outside of the lock, so other threads can use
+        # the cache in the meantime.
+        result = self.model.eval_prompt_list(prompt_list, final_max_tokens,
+                                             num_lines)
+        size = len(key) + len(result.encode("utf-8"))
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO responses "
+                                    "VALUES (?, ?, ?, ?)",
+                                    (key, result, size, time.time()))
+            self.connection.commit()
+            self.size += size
+            if self.size > self.max_size:
+                self.evict()
+        return result
+
+    def evict(self):
+        """Remove the least recently used responses until the cache is at
+        most 90% of its maximum size."""
+
+        # Other workers may have changed the cache in the meantime.
+        self.write_access_times()
+        self.size = self.compute_size()
+        target_size = self.max_size * 0.9
+        while self.size > target_size:
+            rows = self.connection.execute("SELECT key, size FROM responses "
+                                           "ORDER BY last_access "
+                                           "LIMIT 1000").fetchall()
+            if len(rows) == 0:
+                break
+            removed_keys = []
+            for key, size in rows:
+                if self.size <= target_size:
+                    break
+                removed_keys.append((key,))
+                self.size -= size
+            self.connection.executemany("DELETE FROM responses WHERE key = ?",
+                                        removed_keys)
+            self.connection.commit()
+
+    def write_access_times(self):
+        """Write the collected access times of cached responses to the
+        database. The lock must be held by the caller."""
+
+        if len(self.access_times) == 0:
+            return
+        self.connection.executemany("UPDATE responses SET last_access = ? "
+                                    "WHERE key = ?",
+                                    [(access_time, key) for key, access_time
+                                     in self.access_times.items()])
+        self.connection.commit()
+        self.access_times = {}
+
+    def take_counters(self):
+        """Return the counters collected since the last call and reset them.
+
+        :return counters: A map of counter names to their values.
+        """
+
+        counters = self.model.take_counters()
+        with self.lock:
+            self.write_access_times()
+            counters["cache_hits"] = self.hits
+            counters["cache_misses"] = self.misses
+            self.hits = 0
+            self.misses = 0
+        return counters
+
+    def close(self):
+        """Close the database and the wrapped model."""
+
+        with self.lock:
+            self.write_access_times()
+        self.connection.close()
+        self.model.close()
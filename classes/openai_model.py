@@ -0,0 +1,190 @@
+import sys
+import time
+import threading
+
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+import modules.metrics as metrics
+
+
+class openai_model:
+    """Model backend that sends the prompts to a server with an
+    OpenAI-compatible chat completions endpoint (e.g. the llama.cpp server or
+    vLLM).
+
+    The backend is thread safe. Its concurrency is the number of documents
+    that may be annotated at the same time, which is also the number of
+    pooled connections to the server.
+    """
+
+    def __init__(self, settings, targets_map=None):
+        self.base_url = settings["openai"]["base_url"].rstrip("/")
+        self.model_name = settings["openai"]["model_name"]
+        self.timeout = settings["openai"]["timeout"]
+        self.retries = settings["openai"]["retries"]
+        self.concurrency = settings["openai"]["concurrency"]
+        self.intermediate_max_tokens =\
+            settings["gpt4all"]["intermediate_max_tokens"]
+        self.num_targets = settings["prompt"]["num_targets"]
+        self.sampling_settings = {
+            "temperature": settings["gpt4all"]["temperature"],
+            "top_k": settings["gpt4all"]["top_k"],
+            "top_p": settings["gpt4all"]["top_p"]}
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1,
+                              pool_maxsize=self.concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        api_key = settings["openai"]["api_key"]
+        if api_key != "":
+            self.session.headers["Authorization"] = f"Bearer {api_key}"
+
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.request_retries = 0
+
+    def get_generation_settings(self):
+        """Return all settings that influence the generated responses.
+
+        :return settings: A map of the setting names to their values.
+        """
+
+        settings = {"backend": "openai",
+                    "base_url": self.base_url,
+                    "model_name": self.model_name,
+                    "intermediate_max_tokens": self.intermediate_max_tokens,
+                    "num_targets": self.num_targets}
+        settings.update(self.sampling_settings)
+        return settings
+
+    def take_counters(self):
+        """Return the counters collected since the last call and reset them.
+
+        :return counters: A map of counter names to their values.
+        """
+
+        with self.lock:
+            counters = {"http_requests": self.requests,
+                        "http_retries": self.request_retries}
+            self.requests = 0
+            self.request_retries = 0
+        return counters
+
+    def close(self):
+        """Close the pooled connections to the server."""
+
+        self.session.close()
+
+    def eval_prompt_list(self, prompt_list, final_max_tokens=200,
+                         num_lines=1):
+        """Evaluate a list of prompts in one chat.
+
+        If intermediate prompts should not generate a response, all prompts
+        are sent in a single request with empty responses to the intermediate
+        prompts, which equals the chat history of the gpt4all backend.
+
+        :param prompt_list: The list of prompts that should be evaluated.
+        :param final_max_tokens: The maximum number of tokens that are
+        generated in response to the last prompt.
+        :param num_lines: The number of lines expected in response to the
+        last prompt.
+        :return result: The response to the last prompt of the list.
+        """
+
+        messages = []
+        for prompt in prompt_list[:-1]:
+            messages.append({"role": "user", "content": prompt})
+            response = ""
+            if self.intermediate_max_tokens > 0:
+                with metrics.collector.timer("preamble_ingest"):
+                    response = self.request_completion(
+                        messages,
+                        self.intermediate_max_tokens)
+            messages.append({"role": "assistant", "content": response})
+        messages.append({"role": "user", "content": prompt_list[-1]})
+
+        stop = None
+        if num_lines == 1:
+            stop = ["\n"]
+        with metrics.collector.timer("final_generate"):
+            result = self.request_completion(messages, final_max_tokens,
+                                             stop)
+        return self.truncate_result(result, num_lines)
+
+    def truncate_result(self, result, num_lines):
+        """Cut a response at the points, where the gpt4all backend stops the
+        generation (see gpt4all_model.generate_final()).
+
+        :param result: The response.
+        :param num_lines: The number of lines expected in the response.
+        :return result: The truncated response.
+        """
+
+        lines = result.lstrip().split("\n")
+        if num_lines != 1:
+            return "\n".join(lines[:num_lines])
+        parts = lines[0].split(",")
+        if len(parts) > self.num_targets:
+            return ",".join(parts[:self.num_targets]) + ","
+        return lines[0]
+
+    def count_tokens(self, usage):
+        """Add the token counts of a completion to the metrics collector.
+
+        :param usage: The usage information of the completion.
+        """
+
+        if "prompt_tokens" in usage:
+            metrics.collector.increment("prompt_tokens",
+                                        usage["prompt_tokens"])
+            metrics.collector.observe("prompt_tokens", usage["prompt_tokens"])
+        if "completion_tokens" in usage:
+            metrics.collector.increment("generated_tokens",
+                                        usage["completion_tokens"])
+
+    def request_completion(self, messages, max_tokens, stop=None):
+        """Request a chat completion from the server. Failed requests are
+        retried with an increasing delay. The token counts reported by the
+        server are added to the metrics collector.
+
+        :param messages: The list of chat messages.
+        :param max_tokens: The maximum number of tokens to generate.
+        :param stop: A list of stop sequences or None.
+        :return response: The generated response.
+        """
+
+        request = {"model": self.model_name,
+                   "messages": messages,
+                   "max_tokens": max_tokens}
+        request.update(self.sampling_settings)
+        if stop is not None:
+            request["stop"] = stop
+
+        url = self.base_url + "/chat/completions"
+        for attempt in range(self.retries + 1):
+            with self.lock:
+                self.requests += 1
+                if attempt > 0:
+                    self.request_retries += 1
+            try:
+                response = self.session.post(url, json=request,
+                                             timeout=self.timeout)
+                if response.status_code == 200:
+                    response_data = response.json()
+                    content = response_data["choices"][0]["message"]
+                    self.count_tokens(response_data.get("usage") or {})
+                    return content.get("content") or ""
+                print(f"The request to {url} failed with the HTTP status "
+                      f"code {response.status_code}.")
+            except (requests.exceptions.RequestException, ValueError,
+                    KeyError, IndexError) as error:
+                print(f"The request to {url} failed: {error}")
+            if attempt < self.retries:
+                time.sleep(2 ** attempt)
+        print(f"Error: The request to {url} failed {self.retries + 1} times. "
+              f"Exiting!")
+        sys.exit(1)
@@ -0,0 +1,79 @@
+import json
+import hashlib
+
+
+class prompt_plan:
+    """Immutable plan of the prompts of one chat session, which presents a
+    list of targets to the LLM and asks for the annotation of documents.
+
+    The preamble prompts (the prompts that present the targets) are the same
+    for every document and are built once. The final prompt is kept as a
+    template, the document (or the numbered documents of a batch) is only
+    inserted between its head and its tail. The plan id is a hash of all
+    prompt texts, such that it identifies the plan across runs and processes.
+    Plans are built and memoized by prompt_engineering.get_prompt_plan().
+    """
+
+    __slots__ = ("targets", "preamble", "query_head", "query_tail",
+                 "batch_head", "batch_tail", "plan_id")
+
+    def __init__(self, targets, preamble, query_template, batch_template):
+        """Build a plan from the prompt texts.
+
+        :param targets: The targets presented in the chat session.
+        :param preamble: The list of preamble prompts.
+        :param query_template: The head and tail of the final prompt of a
+        single document.
+        :param batch_template: The head and tail of the final prompt of a
+        batch of documents. The head follows the number of documents.
+        """
+
+        plan_string = json.dumps([preamble, query_template, batch_template])
+        plan_id = hashlib.sha256(plan_string.encode("utf-8")).hexdigest()
+        object.__setattr__(self, "targets", tuple(targets))
+        object.__setattr__(self, "preamble", tuple(preamble))
+        object.__setattr__(self, "query_head", query_template[0])
+        object.__setattr__(self, "query_tail", query_template[1])
+        object.__setattr__(self, "batch_head", batch_template[0])
+        object.__setattr__(self, "batch_tail", batch_template[1])
+        object.__setattr__(self, "plan_id", plan_id[:16])
+
+    def __setattr__(self, name, value):
+        raise AttributeError("A prompt plan cannot be changed.")
+
+    def build_query_prompt(self, document):
+        """Fill the document into the final prompt.
+
+        :param document: The document that should be annotated.
+        :return prompt: The final prompt.
+        """
+
+        return self.query_head + document + self.query_tail
+
+    def build_query_prompt_list(self, document):
+        """Build the prompt list of a single document.
+
+        :param document: The document that should be annotated.
+        :return prompt_list: The preamble prompts and the final prompt.
+        """
+
+        prompt_list = list(self.preamble)
+        prompt_list.append(self.query_head + document + self.query_tail)
+        return prompt_list
+
+    def build_batch_query_prompt_list(self, documents):
+        """Build the prompt list of a batch of documents, in which the
+        documents are numbered.
+
+        :param documents: The list of documents that should be annotated.
+        :return prompt_list: The preamble prompts and the final prompt.
+        """
+
+        numbered_documents = "".join(str(index + 1) + ". " + document + "\n"
+                                     for index, document
+                                     in enumerate(documents))
+        prompt_list = list(self.preamble)
+        prompt_list.append("We now want to annotate " + str(len(documents))
+                           + self.batch_head + numbered_documents
+                           + self.batch_tail)
+        return prompt_list
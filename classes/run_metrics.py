@@ -0,0 +1,223 @@
+import math
+import time
+import threading
+import contextlib
+
+
+# The number of histogram buckets per doubling of the observed value. The
+# upper bounds of the buckets grow by a factor of 2 ** (1 / 16), such that the
+# quantiles of a histogram are estimated with a relative error below 4.4 %.
+BUCKETS_PER_DOUBLING = 16
+
+
+class run_metrics:
+    """Timers, counters and histograms collected during a run of the tool.
+
+    Timers sum up the time spent in a phase (e.g. the parsing of responses)
+    and the number of times the phase was run. Nested timers of the same
+    phase in one thread are only counted once. Histograms count the observed
+    values (e.g. the latency of every document) in fixed, logarithmically
+    spaced buckets, such that their memory does not grow with the number of
+    values and their quantiles can be estimated at any time. The object can
+    be used by multiple threads.
+    Metrics collected in other processes are transferred as snapshots (see
+    take_snapshot() and merge()).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active_timers = threading.local()
+        self.timers = {}
+        self.counters = {}
+        self.histograms = {}
+
+    def add_time(self, phase, seconds, count=1):
+        """Add the duration of a phase.
+
+        :param phase: The name of the phase.
+        :param seconds: The duration in seconds.
+        :param count: The number of times the phase was run.
+        """
+
+        with self.lock:
+            timer = self.timers.setdefault(phase, [0, 0.0])
+            timer[0] += count
+            timer[1] += seconds
+
+    @contextlib.contextmanager
+    def timer(self, phase):
+        """Measure the duration of the enclosed code as part of a phase.
+
+        :param phase: The name of the phase.
+        """
+
+        active_phases = getattr(self.active_timers, "phases", None)
+        if active_phases is None:
+            active_phases = set()
+            self.active_timers.phases = active_phases
+        if phase in active_phases:
+            yield
+            return
+
+        active_phases.add(phase)
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(phase, time.perf_counter() - start_time)
+            active_phases.discard(phase)
+
+    def increment(self, name, value=1):
+        """Increase a counter.
+
+        :param name: The name of the counter.
+        :param value: The value that is added to the counter.
+        """
+
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, value):
+        """Add a value to a histogram.
+
+        :param name: The name of the histogram.
+        :param value: The observed value.
+        """
+
+        if value > 0:
+            bucket = math.ceil(math.log2(value) * BUCKETS_PER_DOUBLING)
+        else:
+            bucket = None
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = {"count": 0, "sum": 0, "min": value,
+                             "max": value, "buckets": {}}
+                self.histograms[name] = histogram
+            histogram["count"] += 1
+            histogram["sum"] += value
+            histogram["min"] = min(histogram["min"], value)
+            histogram["max"] = max(histogram["max"], value)
+            histogram["buckets"][bucket] =\
+                histogram["buckets"].get(bucket, 0) + 1
+
+    def take_snapshot(self):
+        """Return all metrics collected since the last call and reset them.
+
+        :return snapshot: A map containing the timers, counters and
+        histograms.
+        """
+
+        with self.lock:
+            snapshot = {"timers": self.timers,
+                        "counters": self.counters,
+                        "histograms": self.histograms}
+            self.timers = {}
+            self.counters = {}
+            self.histograms = {}
+        return snapshot
+
+    def merge(self, snapshot):
+        """Add the metrics of a snapshot created by take_snapshot().
+
+        :param snapshot: The map containing the timers, counters and
+        histograms.
+        """
+
+        for phase, (count, seconds) in snapshot["timers"].items():
+            self.add_time(phase, seconds, count)
+        for name, value in snapshot["counters"].items():
+            self.increment(name, value)
+        with self.lock:
+            for name, other in snapshot["histograms"].items():
+                histogram = self.histograms.get(name)
+                if histogram is None:
+                    self.histograms[name] = {
+                        "count": other["count"], "sum": other["sum"],
+                        "min": other["min"], "max": other["max"],
+                        "buckets": dict(other["buckets"])}
+                    continue
+                histogram["count"] += other["count"]
+                histogram["sum"] += other["sum"]
+                histogram["min"] = min(histogram["min"], other["min"])
+                histogram["max"] = max(histogram["max"], other["max"])
+                for bucket, count in other["buckets"].items():
+                    histogram["buckets"][bucket] =\
+                        histogram["buckets"].get(bucket, 0) + count
+
+    def build_report(self):
+        """Summarize the collected metrics.
+
+        Besides the timers, counters and the quantiles of the histograms, the
+        report contains the token throughput of the model, if the backend
+        counts tokens.
+
+        :return report: A map containing the summary.
+        """
+
+        with self.lock:
+            timers = {phase: list(timer)
+                      for phase, timer in self.timers.items()}
+            counters = dict(self.counters)
+            histograms = {name: dict(histogram,
+                                     buckets=dict(histogram["buckets"]))
+                          for name, histogram in self.histograms.items()}
+
+        report = {"timers": {}, "counters": counters, "histograms": {}}
+        for phase, (count, seconds) in sorted(timers.items()):
+            report["timers"][phase] = {"count": count, "seconds": seconds}
+        for name, histogram in sorted(histograms.items()):
+            report["histograms"][name] =\
+                self.build_histogram_summary(histogram)
+
+        generate_seconds = timers.get("final_generate", [0, 0.0])[1]
+        ingest_seconds = timers.get("preamble_ingest", [0, 0.0])[1]
+        generated_tokens = counters.get("generated_tokens", 0)
+        prompt_tokens = counters.get("prompt_tokens", 0)
+        if generate_seconds > 0 and generated_tokens > 0:
+            report["generated_tokens_per_second"] =\
+                generated_tokens / generate_seconds
+        if generate_seconds + ingest_seconds > 0 and prompt_tokens > 0:
+            report["tokens_per_second"] = (prompt_tokens + generated_tokens)\
+                / (generate_seconds + ingest_seconds)
+        return report
+
+    def build_histogram_summary(self, histogram):
+        """Summarize a histogram.
+
+        The percentiles are estimated by the upper bound of the bucket that
+        contains the value of the nearest rank, limited to the minimum and
+        the maximum of the values.
+
+        :param histogram: The map containing the number, the sum, the
+        minimum, the maximum and the bucket counts of the values.
+        :return summary: A map containing the number, the sum, the minimum,
+        the maximum and the 50th, 95th and 99th percentile of the values.
+        """
+
+        count = histogram["count"]
+        summary = {"count": count, "sum": histogram["sum"]}
+        if count == 0:
+            return summary
+        summary["min"] = histogram["min"]
+        summary["max"] = histogram["max"]
+        # Values that are not positive are counted in the bucket None, which
+        # precedes all other buckets.
+        buckets = sorted(histogram["buckets"].items(),
+                         key=lambda item: (item[0] is not None,
+                                           item[0] or 0))
+        for percentile in [50, 95, 99]:
+            # Nearest-rank percentile.
+            rank = max(1, -(-percentile * count // 100))
+            seen = 0
+            for bucket, bucket_count in buckets:
+                seen += bucket_count
+                if seen >= rank:
+                    break
+            if bucket is None:
+                value = 0
+            else:
+                value = 2 ** (bucket / BUCKETS_PER_DOUBLING)
+            summary[f"p{percentile}"] = min(max(value, histogram["min"]),
+                                            histogram["max"])
+        return summary
@@ -0,0 +1,76 @@
+import modules.data_processing as dp
+
+
+class target_trie:
+    """Prefix tree over the canonical forms of the targets.
+
+    The tree is used to check a response of the LLM while it is generated.
+    A response is a list of targets separated by comma. As long as every
+    finished target is known and the unfinished one is the prefix of a known
+    target, the response can still be parsed.
+    """
+
+    # Marks a node, at which a target ends. Targets never contain an empty
+    # character, so the key cannot collide with a child node.
+    end_marker = ""
+
+    def __init__(self, targets):
+        self.root = {}
+        for target in targets:
+            self.add(target)
+
+    def add(self, target):
+        """Add a target to the tree.
+
+        :param target: The target in canonical form.
+        """
+
+        node = self.root
+        for character in target:
+            node = node.setdefault(character, {})
+        node[self.end_marker] = True
+
+    def find(self, prefix):
+        """Find the node of a prefix.
+
+        :param prefix: The prefix.
+        :return node: The node or None if no target starts with the prefix.
+        """
+
+        node = self.root
+        for character in prefix:
+            node = node.get(character)
+            if node is None:
+                return None
+        return node
+
+    def check_response(self, response):
+        """Check a (partially generated) response.
+
+        :param response: The first line of the response generated so far.
+        :return num_complete: The number of targets in the response that are
+        certainly complete.
+        :return viable: False if the response can no longer be parsed into
+        known targets.
+        """
+
+        segments = response.split(",")
+        num_complete = 0
+        for segment in segments[:-1]:
+            node = self.find(dp.build_canonical_target_form(segment))
+            if node is None or self.end_marker not in node:
+                return num_complete, False
+            num_complete += 1
+
+        # Trailing whitespace may still be followed by the rest of a target.
+        last_segment = segments[-1].lstrip().lower()
+        node = self.find(last_segment)
+        if node is None:
+            node = self.find(last_segment.rstrip())
+            if node is None or self.end_marker not in node:
+                return num_complete, False
+            return num_complete, True
+        if len(node) == 1 and self.end_marker in node:
+            # No longer target starts with this one.
+            num_complete += 1
+        return num_complete, True
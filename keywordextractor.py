@@ -1,20 +1,94 @@
 import sys
+import cProfile
 
 
+import modules.configuration as conf
+import modules.data_loading as dl
 import modules.commands as commands
 
 
+# The command line options of all subcommands and of the single subcommands.
+# Options with a value overwrite the given configuration option, flags set it
+# to 1.
+general_options = {"--quiet": ("general", "quiet", False),
+                   "--profile": ("general", "profile_file", True)}
+command_options = {
+    "annotate": {"--workers": ("annotation", "workers", True),
+                 "--resume": ("annotation", "resume", False)},
+    "evaluate-compare": {"--files": ("evaluation", "compare_files", True)},
+    "convert-metadata": {"--input": ("conversion", "input_path", True),
+                         "--output": ("conversion", "output_path", True)},
+    "sweep": {"--grid": ("sweep", "grid", True),
+              "--output": ("sweep", "output_directory", True)},
+    "serve-fake-backend": {"--port": ("backend", "fake_server_port", True)},
+}
+
+
+def parse_options(command, arguments):
+    """Apply the command line options of a subcommand to the configuration.
+
+    :param command: The name of the subcommand.
+    :param arguments: The list of command line arguments after the subcommand.
+    """
+
+    options = dict(general_options)
+    options.update(command_options.get(command, {}))
+    index = 0
+    while index < len(arguments):
+        argument = arguments[index]
+        if argument not in options:
+            print(f"Error: Unknown option {argument} for the command "
+                  f"{command}. Exiting!")
+            sys.exit(1)
+        section_index, option_index, has_value = options[argument]
+        if has_value:
+            if index + 1 >= len(arguments):
+                print(f"Error: The option {argument} needs a value. "
+                      f"Exiting!")
+                sys.exit(1)
+            conf.set_option(section_index, option_index, arguments[index + 1])
+            index += 2
+        else:
+            conf.set_option(section_index, option_index, "1")
+            index += 1
+
+
 if __name__ == "__main__":
     if len(sys.argv) < 2:
         print("Error: No command specified. Exiting!")
         sys.exit(1)
     command = sys.argv[1]
-    if command == "download-example-dataset":
-        commands.download_example_dataset()
-    elif command == "annotate":
-        commands.annotate()
-    elif command == "evaluate":
-        commands.evaluate()
-    else:
-        print("Error: Specified command was not found. Exiting!")
-        sys.exit(1)
+    parse_options(command, sys.argv[2:])
+
+    profile_file = conf.config["general"]["profile_file"]
+    profiler = None
+    if profile_file != "":
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    try:
+        if command == "download-example-dataset":
+            commands.download_example_dataset()
+        elif command == "build-gzip-index":
+            commands.build_gzip_index()
+        elif command == "annotate":
+            commands.annotate()
+        elif command == "evaluate":
+            commands.evaluate()
+        elif command == "evaluate-compare":
+            commands.evaluate_compare()
+        elif command == "sweep":
+            commands.sweep()
+        elif command == "convert-metadata":
+            commands.convert_metadata()
+        elif command == "serve-fake-backend":
+            commands.serve_fake_backend()
+        else:
+            print("Error: Specified command was not found. Exiting!")
+            sys.exit(1)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profile_file = dl.get_abspath(profile_file)
+            profiler.dump_stats(profile_file)
+            print(f"Saved the profile of the command in {profile_file}.")
@@ -0,0 +1,457 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+import modules.configuration as conf
+import modules.data_loading as dl
+import modules.data_processing as dp
+import modules.prompt_engineering as pe
+import modules.metrics as metrics
+
+
+# The state of an annotation worker process, which is set up once per process
+# by init_worker().
+worker_model = None
+worker_settings = None
+worker_targets = None
+worker_targets_map = None
+worker_target_tree = None
+
+
+def load_model(targets_map, settings):
+    """Load the model of the configured backend and wrap it in the inference
+    cache if the cache is enabled.
+
+    Every backend provides eval_prompt_list(), get_generation_settings(),
+    take_counters() and close() as well as its concurrency, which is the
+    number of documents that may be annotated by concurrent threads. Only the
+    module of the configured backend is imported, such that e.g. the native
+    library of gpt4all is not loaded for the other backends.
+
+    :param targets_map: The map of canonical targets to their original form,
+    which is used to constrain the responses of the model.
+    :param settings: The settings built by configuration.build_settings().
+    :return model: The model used for the annotation.
+    """
+
+    backend = settings["backend"]["backend"]
+    use_cache = settings["cache"]["use_cache"]
+
+    with metrics.collector.timer("model_load"):
+        if backend == "openai":
+            import classes.openai_model as openai_model
+            model = openai_model.openai_model(settings, targets_map)
+        elif backend == "fake":
+            import classes.fake_model as fake_model
+            model = fake_model.fake_model(settings, targets_map)
+        else:
+            import classes.gpt4all_model as gpt4all_model
+            model = gpt4all_model.gpt4all_model(settings, targets_map)
+        if use_cache == 1:
+            import classes.inference_cache as inference_cache
+            cache_file = dl.get_abspath(settings["cache"]["cache_sqlite"])
+            model = inference_cache.inference_cache(model, cache_file,
+                                                    settings)
+    return model
+
+
+def get_model_key(settings):
+    """Return the settings, with which the model of the configured backend is
+    loaded. Annotation runs with the same key can share the loaded model.
+
+    :param settings: The settings built by configuration.build_settings().
+    :return model_key: A tuple of the backend and its loading settings.
+    """
+
+    backend = settings["backend"]["backend"]
+    if backend == "openai":
+        return (backend, settings["openai"]["base_url"],
+                settings["openai"]["model_name"])
+    if backend == "fake":
+        return (backend,)
+    return (backend, settings["gpt4all"]["model_name"],
+            settings["gpt4all"]["device"], settings["gpt4all"]["n_threads"],
+            settings["gpt4all"]["n_ctx"])
+
+
+def build_constraint_map(targets_map, target_tree=None):
+    """Build the map of all strings the model may answer with, which are the
+    targets and the labels of the groups of the target tree.
+
+    :param targets_map: The map of canonical targets to their original form.
+    :param target_tree: The root node of the target tree or None.
+    :return constraint_map: The map of canonical strings to their original
+    form.
+    """
+
+    if target_tree is None:
+        return targets_map
+    constraint_map = dict(targets_map)
+    for label in dp.collect_tree_labels(target_tree):
+        constraint_map[dp.build_canonical_target_form(label)] = label
+    return constraint_map
+
+
+def run_concurrently(function, arguments_list, concurrency):
+    """Call a function for every element of a list of arguments, with up to
+    the given number of calls running concurrently in threads.
+
+    :param function: The function.
+    :param arguments_list: The list of argument tuples.
+    :param concurrency: The maximum number of concurrent calls.
+    :return results: The list of results in the order of the arguments.
+    """
+
+    if concurrency <= 1 or len(arguments_list) <= 1:
+        return [function(*arguments) for arguments in arguments_list]
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(lambda arguments: function(*arguments),
+                                 arguments_list))
+
+
+def refine_annotated_targets(model, document, annotated_targets, targets_map,
+                             settings):
+    """Query the LLM again with the already annotated targets until no more
+    than the configured number of targets is left.
+
+    :param model: The model that is used to evaluate the prompt lists.
+    :param document: The document that is annotated.
+    :param annotated_targets: The targets annotated in the previous round.
+    :param targets_map: The map of canonical targets to their original form.
+    :param settings: The settings built by configuration.build_settings().
+    :return annotated_targets: The refined list of annotated targets.
+    """
+
+    debug_mode = settings["general"]["debug"]
+    num_targets = settings["prompt"]["num_targets"]
+    max_rounds = settings["annotation"]["max_rounds"]
+
+    num_rounds = 0
+    while len(annotated_targets) > num_targets:
+        if max_rounds > 0 and num_rounds >= max_rounds:
+            if debug_mode == 1:
+                print("The maximum number of rounds is reached.")
+            return annotated_targets[:num_targets]
+        if debug_mode == 1:
+            print("The document needs another iteration of prompts.")
+
+        prompt_lists = pe.build_query_prompt_lists(document,
+                                                   annotated_targets,
+                                                   settings)
+
+        if debug_mode == 1:
+            print("Using the following prompt lists:")
+            print(prompt_lists)
+
+        refined_targets = pe.process_query_prompt_lists(model,
+                                                        prompt_lists,
+                                                        targets_map,
+                                                        settings)
+        num_rounds += 1
+        if len(refined_targets) >= len(annotated_targets):
+            # Another round would most likely not reduce the targets either.
+            return refined_targets[:num_targets]
+        annotated_targets = refined_targets
+
+    return annotated_targets
+
+
+def annotate_document(model, document, targets, targets_map, settings):
+    """Annotate a single document with the given targets.
+
+    :param model: The model that is used to evaluate the prompt lists.
+    :param document: The document that should be annotated.
+    :param targets: The list of possible targets.
+    :param targets_map: The map of canonical targets to their original form.
+    :param settings: The settings built by configuration.build_settings().
+    :return annotated_targets: The list of annotated targets.
+    """
+
+    debug_mode = settings["general"]["debug"]
+    start_time = time.perf_counter()
+
+    prompt_lists = pe.build_query_prompt_lists(document, targets, settings)
+
+    if debug_mode == 1:
+        print("Using the following prompt lists:")
+        print(prompt_lists)
+
+    annotated_targets = pe.process_query_prompt_lists(model,
+                                                      prompt_lists,
+                                                      targets_map,
+                                                      settings)
+
+    annotated_targets = refine_annotated_targets(model, document,
+                                                 annotated_targets,
+                                                 targets_map, settings)
+    metrics.collector.observe("document_seconds",
+                              time.perf_counter() - start_time)
+    return annotated_targets
+
+
+def annotate_document_hierarchically(model, document, target_tree, settings):
+    """Annotate a single document by descending the target tree.
+
+    Every round presents the labels of the current nodes to the LLM. Chosen
+    groups are replaced by their children and chosen targets are kept, until
+    at most the configured number of targets is left. As every group has a
+    bounded number of children, the number of rounds grows with the depth of
+    the tree instead of the number of targets. The rounds and LLM calls can be
+    limited, in which case the targets chosen so far (and the targets that
+    represent chosen groups) are used.
+
+    :param model: The model that is used to evaluate the prompt lists.
+    :param document: The document that should be annotated.
+    :param target_tree: The root node of the target tree.
+    :param settings: The settings built by configuration.build_settings().
+    :return annotated_targets: The list of annotated targets.
+    :return cost: A map containing the number of rounds and LLM calls.
+    """
+
+    debug_mode = settings["general"]["debug"]
+    num_targets = settings["prompt"]["num_targets"]
+    max_rounds = settings["annotation"]["max_rounds"]
+    max_calls = settings["annotation"]["max_calls"]
+    start_time = time.perf_counter()
+
+    nodes = dp.deduplicate_tree_nodes(target_tree["children"])
+    num_rounds = 0
+    num_calls = 0
+    while len(nodes) > 0:
+        only_targets = all(node["children"] is None for node in nodes)
+        if only_targets and len(nodes) <= num_targets:
+            break
+
+        if max_rounds > 0 and num_rounds >= max_rounds:
+            if debug_mode == 1:
+                print("The maximum number of rounds is reached.")
+            break
+        labels = [node["label"] for node in nodes]
+        prompt_lists = pe.build_query_prompt_lists(document, labels, settings)
+        if max_calls > 0 and num_calls + len(prompt_lists) > max_calls:
+            if debug_mode == 1:
+                print("The maximum number of LLM calls is reached.")
+            break
+
+        if debug_mode == 1:
+            print(f"Running round {num_rounds + 1} with {len(nodes)} "
+                  f"candidates.")
+        # The labels of the nodes are unique in canonical form (see
+        # data_processing.deduplicate_tree_nodes()).
+        labels_map = {dp.build_canonical_target_form(label): label
+                      for label in labels}
+        chosen_labels = pe.process_query_prompt_lists(model, prompt_lists,
+                                                      labels_map, settings)
+        num_rounds += 1
+        num_calls += len(prompt_lists)
+
+        nodes_by_label = {node["label"]: node for node in nodes}
+        chosen_nodes = [nodes_by_label[label] for label in chosen_labels]
+        if only_targets and len(chosen_nodes) >= len(nodes):
+            # The LLM kept all targets, so another round would not help.
+            nodes = chosen_nodes
+            break
+
+        # Groups of a taxonomy may share children, which are only presented
+        # once.
+        nodes = []
+        for node in chosen_nodes:
+            if node["children"] is None:
+                nodes.append(node)
+            else:
+                nodes += node["children"]
+        nodes = dp.deduplicate_tree_nodes(nodes)
+
+    annotated_targets = []
+    for node in nodes:
+        if node["target"] is not None:
+            annotated_targets.append(node["target"])
+    annotated_targets = list(dict.fromkeys(annotated_targets))[:num_targets]
+    metrics.collector.observe("document_seconds",
+                              time.perf_counter() - start_time)
+
+    return annotated_targets, {"rounds": num_rounds, "calls": num_calls}
+
+
+def annotate_documents(model, documents, targets, targets_map, settings,
+                       shortlists=None):
+    """Annotate a block of documents with the given targets.
+
+    If the model reuses the state of evaluated preambles or multiple documents
+    are annotated with one prompt, the first round of prompts is run chat by
+    chat for all documents of the block. By that, the preamble of every chat
+    is only evaluated once per block (or once per batch of documents) instead
+    of once per document. Otherwise, the documents are annotated one after
+    another.
+
+    If shortlists of the lexical pre-filter are given, every document is
+    annotated on its own with the targets of its shortlist.
+
+    If the backend of the model supports concurrency, multiple documents (or
+    batches of documents) are annotated at the same time.
+
+    The latency of every document is added to the metrics collector. If the
+    documents are annotated chat by chat, every document is assigned an equal
+    share of the time of the block.
+
+    :param model: The model that is used to evaluate the prompt lists.
+    :param documents: The list of documents that should be annotated.
+    :param targets: The list of possible targets.
+    :param targets_map: The map of canonical targets to their original form.
+    :param settings: The settings built by configuration.build_settings().
+    :param shortlists: The list of candidate targets for every document or
+    None if all targets are candidates.
+    :return annotated_targets_lists: The list of annotated targets for every
+    document in the order of the given documents.
+    """
+
+    debug_mode = settings["general"]["debug"]
+    reuse_preamble = settings["gpt4all"]["reuse_preamble"]
+    documents_per_prompt = settings["prompt"]["documents_per_prompt"]
+
+    if shortlists is not None:
+        return run_concurrently(annotate_document,
+                                [(model, document, shortlist, targets_map,
+                                  settings)
+                                 for document, shortlist
+                                 in zip(documents, shortlists)],
+                                model.concurrency)
+
+    if reuse_preamble != 1 and documents_per_prompt == 1:
+        return run_concurrently(annotate_document,
+                                [(model, document, targets, targets_map,
+                                  settings)
+                                 for document in documents],
+                                model.concurrency)
+
+    start_time = time.perf_counter()
+    annotated_targets_lists = [[] for document in documents]
+    targets_per_chat_list = pe.split_targets_per_chat(targets, documents,
+                                                      settings)
+    batches = pe.build_document_batches(documents, targets, targets_map,
+                                        settings)
+    for i in range(len(targets_per_chat_list)):
+        if debug_mode == 1:
+            print(f"Running chat {i+1}/{len(targets_per_chat_list)} for "
+                  f"{len(documents)} documents in {len(batches)} batches.")
+        batches_targets_lists = run_concurrently(
+            pe.process_batch_query_prompt_list,
+            [(model, [documents[index] for index in batch],
+              targets_per_chat_list[i], targets_map, settings)
+             for batch in batches],
+            model.concurrency)
+        for batch, batch_targets_lists in zip(batches, batches_targets_lists):
+            for index, annotated_targets in zip(batch, batch_targets_lists):
+                annotated_targets_lists[index] += annotated_targets
+
+    for index in range(len(documents)):
+        annotated_targets = annotated_targets_lists[index]
+        annotated_targets = list(dict.fromkeys(annotated_targets))
+        annotated_targets_lists[index] = refine_annotated_targets(
+            model,
+            documents[index],
+            annotated_targets,
+            targets_map,
+            settings)
+
+    document_seconds = (time.perf_counter() - start_time)\
+        / max(1, len(documents))
+    for document in documents:
+        metrics.collector.observe("document_seconds", document_seconds)
+
+    return annotated_targets_lists
+
+
+def annotate_block(model, documents, targets, targets_map, settings,
+                   shortlists=None, target_tree=None):
+    """Annotate a block of documents and collect the metrics of this block,
+    including the counters of the model (e.g. cache hits).
+
+    :param model: The model that is used to evaluate the prompt lists.
+    :param documents: The list of documents that should be annotated.
+    :param targets: The list of possible targets.
+    :param targets_map: The map of canonical targets to their original form.
+    :param settings: The settings built by configuration.build_settings().
+    :param shortlists: The list of candidate targets for every document or
+    None if all targets are candidates.
+    :param target_tree: The root node of the target tree if the documents
+    should be annotated hierarchically or None.
+    :return annotated_targets_lists: The list of annotated targets for every
+    document in the order of the given documents.
+    :return costs: The number of rounds and LLM calls for every document
+    (None if they are not recorded).
+    :return block_metrics: The snapshot of the metrics collector of this
+    process (see run_metrics.take_snapshot()).
+    """
+
+    if target_tree is not None:
+        results = run_concurrently(annotate_document_hierarchically,
+                                   [(model, document, target_tree, settings)
+                                    for document in documents],
+                                   model.concurrency)
+        annotated_targets_lists = [result[0] for result in results]
+        costs = [result[1] for result in results]
+    else:
+        annotated_targets_lists = annotate_documents(model, documents,
+                                                     targets, targets_map,
+                                                     settings, shortlists)
+        costs = [None] * len(documents)
+
+    for counter_name, value in model.take_counters().items():
+        metrics.collector.increment(counter_name, value)
+    return annotated_targets_lists, costs, metrics.collector.take_snapshot()
+
+
+def init_worker(config_snapshot, workers, targets, targets_map,
+                target_tree=None):
+    """Set up an annotation worker process.
+
+    Every worker loads its own instance of the model. If the number of threads
+    is not configured, the available CPU cores are divided between the
+    workers.
+
+    :param config_snapshot: The configuration of the main process.
+    :param workers: The total number of worker processes.
+    :param targets: The list of possible targets.
+    :param targets_map: The map of canonical targets to their original form.
+    :param target_tree: The root node of the target tree or None.
+    """
+
+    global worker_model
+    global worker_settings
+    global worker_targets
+    global worker_targets_map
+    global worker_target_tree
+
+    conf.load_snapshot(config_snapshot)
+    if conf.settings["gpt4all"]["n_threads"] == 0:
+        n_threads = max(1, os.cpu_count() // workers)
+        conf.set_option("gpt4all", "n_threads", n_threads)
+
+    worker_settings = conf.settings
+    worker_model = load_model(build_constraint_map(targets_map, target_tree),
+                              worker_settings)
+    worker_targets = targets
+    worker_targets_map = targets_map
+    worker_target_tree = target_tree
+
+
+def annotate_block_in_worker(block):
+    """Annotate a block of documents in a worker process set up by
+    init_worker().
+
+    :param block: A tuple of the list of documents that should be annotated
+    and their shortlists (or None).
+    :return annotated_targets_lists: The list of annotated targets for every
+    document in the order of the given documents.
+    :return costs: The number of rounds and LLM calls for every document.
+    :return block_metrics: The snapshot of the metrics collector of this
+    worker process.
+    """
+
+    documents, shortlists = block
+    return annotate_block(worker_model, documents, worker_targets,
+                          worker_targets_map, worker_settings, shortlists,
+                          worker_target_tree)
@@ -1,20 +1,18 @@
 import sys
 import os
-import random
 import json
+import time
+import multiprocessing
 from datetime import datetime
 
 
-import requests
-from tqdm import tqdm
-
 import modules.configuration as conf
-import modules.data_fetching as df
 import modules.data_loading as dl
-import modules.data_processing as dp
-import modules.prompt_engineering as pe
-import modules.evaluation as ev
-import classes.gpt4all_model as gpt4all_model
+import modules.metrics as metrics
+import classes.run_metrics as run_metrics
+# The modules that load large libraries (e.g. numpy, requests or the native
+# library of gpt4all) are imported by the subcommands that need them, such
+# that every subcommand starts quickly.
 
 
 def download_example_dataset():
@@ -30,10 +28,23 @@ def download_example_dataset():
     mentioned resources.
     """
 
+    from tqdm import tqdm
+
+    import modules.data_fetching as df
+    import modules.data_processing as dp
+    import modules.data_storing as ds
+
     creation_mode = conf.config["example_dataset"]["creation_mode"]
     num_random_publications =\
         int(conf.config["example_dataset"]["num_random_publications"])
     id_list_json = conf.config["example_dataset"]["id_list_json"]
+    random_seed = int(conf.config["example_dataset"]["random_seed"])
+    keep_uncompressed_jsonl =\
+        int(conf.config["example_dataset"]["keep_uncompressed_jsonl"])
+    parse_processes = int(conf.config["example_dataset"]["parse_processes"])
+    if parse_processes == 0:
+        parse_processes = os.cpu_count()
+    columnar_store = int(conf.config["example_dataset"]["columnar_store"])
 
     data_dir = os.path.join(conf.tooldir, "data")
     if os.path.exists(data_dir) and not os.path.isdir(data_dir):
@@ -54,27 +65,31 @@ def download_example_dataset():
         sys.exit(1)
     os.mkdir(example_data_dir, 0o775)
 
-    print("Downloading the papers part of the D3 dataset.")
-    d3_papers_dataset_url = "https://zenodo.org/records/7071698/files/"\
-                            + "2022-11-30-papers.jsonl.gz?download=1"
+    download_dir = dl.get_abspath(
+        conf.config["example_dataset"]["download_dir"])
+    if not os.path.isdir(download_dir):
+        os.makedirs(download_dir, 0o775)
+
+    d3_papers_dataset_url = conf.config["example_dataset"]["d3_papers_url"]
+    d3_papers_md5 = conf.config["example_dataset"]["d3_papers_md5"]
+    download_retries = int(conf.config["example_dataset"]["download_retries"])
+    if df.get_local_source_path(d3_papers_dataset_url) is not None:
+        d3_papers_dataset_url = dl.get_abspath(
+            df.get_local_source_path(d3_papers_dataset_url))
     d3_papers_path = os.path.join(example_data_dir, "d3_papers.jsonl")
-    response = requests.get(d3_papers_dataset_url, stream=True)
-    total_filesize = int(response.headers.get('content-length', 0))
-    block_size_in_kb = 1024
-    progress_bar = tqdm(total=total_filesize, unit='iB', unit_scale=True)
-    d3_papers_gz_path = os.path.join(example_data_dir, "d3_papers.jsonl.gz")
-    with open(d3_papers_gz_path, "wb") as gz_file:
-        for data in response.iter_content(block_size_in_kb):
-            progress_bar.update(len(data))
-            gz_file.write(data)
-    progress_bar.close()
-
-    print("Extracting the downloaded papers part of the D3 dataset from the "
-          ".gz file.")
-    thread_count = os.cpu_count() - 1
-    with open(d3_papers_path, "wb") as jsonlfile:
-        jsonlfile.write(df.extract_gzip(d3_papers_gz_path,
-                                        threads=thread_count))
+    d3_papers_gz_path = os.path.join(download_dir, "d3_papers.jsonl.gz")
+    d3_papers_index_path = d3_papers_gz_path + ".gzidx"
+
+    if os.path.isfile(d3_papers_gz_path)\
+            and not df.verify_cached_download(d3_papers_gz_path,
+                                              d3_papers_md5):
+        print(f"The MD5 checksum of the previously downloaded archive "
+              f"{d3_papers_gz_path} does not match the configured checksum. "
+              f"Downloading it again.")
+        for path in [d3_papers_gz_path, d3_papers_index_path,
+                     d3_papers_gz_path + ".md5"]:
+            if os.path.isfile(path):
+                os.remove(path)
 
     subjects = ["artificial intelligence",
                 "computer aided design",
@@ -96,58 +111,99 @@ def download_example_dataset():
                 "theoretical computer science",
                 "bioinformatics"]
 
-    print("Extracting the relevant publication metadata from the D3 dataset.")
-    publications = []
-    with open(d3_papers_path, "r") as jsonlfile:
-        line_sum = sum(1 for line in jsonlfile)
-    with open(d3_papers_path, "r") as jsonlfile:
-        for line in tqdm(jsonlfile, total=line_sum):
-            line_data = json.loads(line)
-
-            line_corpusid = None
-            line_title = None
-            line_abstract = None
-            line_cso_concepts_set = set()
-
-            if "corpusid" in line_data.keys():
-                line_corpusid = line_data["corpusid"]
-            if "title" in line_data.keys():
-                line_title = line_data["title"]
-            if "abstract" in line_data.keys():
-                line_abstract = line_data["abstract"]
-            if "syntactic" in line_data.keys():
-                for cso_concept in line_data["syntactic"]:
-                    line_cso_concepts_set.add(cso_concept)
-            if "semantic" in line_data.keys():
-                for cso_concept in line_data["semantic"]:
-                    line_cso_concepts_set.add(cso_concept)
-            if "union" in line_data.keys():
-                for cso_concept in line_data["union"]:
-                    line_cso_concepts_set.add(cso_concept)
-            if "enhanced" in line_data.keys():
-                for cso_concept in line_data["enhanced"]:
-                    line_cso_concepts_set.add(cso_concept)
-            line_subjects = []
-            for subject in subjects:
-                if subject in line_cso_concepts_set:
-                    line_subjects.append(subject)
-
-            if len(line_subjects) > 0 and line_title is not None\
-                    and line_abstract is not None\
-                    and line_corpusid is not None:
-                publication_metadata = {"D3 ID": line_corpusid,
-                                        "title": line_title,
-                                        "abstract": line_abstract,
-                                        "subjects": line_subjects}
-                publications.append(publication_metadata)
+    filter_id_set = None
+    if creation_mode == "ids":
+        print(f"Extracting publications based on the given corpus id list.")
+        with open(id_list_json, "r") as jsonfile:
+            filter_id_set = set(json.load(jsonfile))
+
+    use_gzip_index = os.path.isfile(d3_papers_gz_path)\
+        and os.path.isfile(d3_papers_index_path)
+    if use_gzip_index and not df.indexed_gzip_available():
+        print("The seek point index of the papers part of the D3 dataset "
+              "exists, but the indexed_gzip module is not installed. Parsing "
+              "the dataset without the index.")
+        use_gzip_index = False
+
+    progress_bar = None
+    if use_gzip_index:
+        # The index allows to decompress independent ranges of the archive,
+        # which are parsed in parallel.
+        print(f"Parsing the papers part of the D3 dataset with "
+              f"{parse_processes} processes using its seek point index.")
+        d3_papers_size = df.get_indexed_gzip_size(d3_papers_gz_path,
+                                                  d3_papers_index_path)
+        ranges_arguments = []
+        for start, end in df.split_range(d3_papers_size, parse_processes * 4):
+            ranges_arguments.append((d3_papers_gz_path, d3_papers_index_path,
+                                     start, end))
+        selected_publications = dp.select_d3_publications_parallel(
+            df.iter_indexed_gzip_range_lines,
+            ranges_arguments,
+            subjects,
+            filter_id_set,
+            parse_processes)
+    else:
+        if os.path.isfile(d3_papers_gz_path):
+            print("Extracting and parsing the previously downloaded papers "
+                  "part of the D3 dataset.")
+            total_filesize = os.path.getsize(d3_papers_gz_path)
+            gz_chunks = df.iter_file_chunks(d3_papers_gz_path)
+        else:
+            print("Downloading, extracting and parsing the papers part of the "
+                  "D3 dataset.")
+            total_filesize, gz_chunks = df.open_resumable_download(
+                d3_papers_dataset_url,
+                d3_papers_gz_path,
+                d3_papers_md5,
+                download_retries)
+        progress_bar = tqdm(total=total_filesize, unit='iB', unit_scale=True)
+
+        if keep_uncompressed_jsonl == 1:
+            # The decompressed file is split into line-aligned byte ranges,
+            # which are parsed in parallel.
+            df.write_gzip_lines_to_file(gz_chunks, d3_papers_path,
+                                        progress_bar=progress_bar)
+            progress_bar.close()
+            print(f"Parsing the decompressed papers part of the D3 dataset "
+                  f"with {parse_processes} processes.")
+            ranges_arguments = []
+            for start, end in df.split_file_ranges(d3_papers_path,
+                                                   parse_processes * 4):
+                ranges_arguments.append((d3_papers_path, start, end))
+            selected_publications = dp.select_d3_publications_parallel(
+                df.iter_file_range_lines,
+                ranges_arguments,
+                subjects,
+                filter_id_set,
+                parse_processes)
+        else:
+            # The archive is decompressed and parsed while it is downloaded,
+            # so neither the whole archive nor its decompressed content have
+            # to be kept in memory. The progress is based on the compressed
+            # bytes. The publications are selected while the lines are
+            # parsed, such that only the selected publications are kept in
+            # memory.
+            d3_lines = df.iter_gzip_lines(gz_chunks,
+                                          progress_bar=progress_bar)
+            selected_publications = (
+                dp.select_d3_publication(line, subjects, filter_id_set)
+                for line in d3_lines)
+            selected_publications = (publication for publication in
+                                     selected_publications
+                                     if publication is not None)
 
     if creation_mode == "random":
-        if num_random_publications < len(publications):
-            print(f"Extracting {num_random_publications} publications from "
+        publications, num_valid_publications = dp.reservoir_sample(
+            selected_publications,
+            num_random_publications,
+            random_seed)
+        if progress_bar is not None:
+            progress_bar.close()
+        if num_random_publications < num_valid_publications:
+            print(f"Extracted {num_random_publications} publications from "
                   f"the D3 dataset at random.")
-            random.shuffle(publications)
-            publications = publications[:num_random_publications]
-        elif num_random_publications == len(publications):
+        elif num_random_publications == num_valid_publications:
             print("The number of wanted publications is equal to the number "
                   "of valid publications in the D3 dataset, using all "
                   "available publications instead.")
@@ -155,16 +211,10 @@ def download_example_dataset():
             print("The number of wanted publications exceeds the number of "
                   "valid publications in the D3 dataset, using all available "
                   "publications instead.")
-    elif creation_mode == "ids":
-        print(f"Extracting publications based on the given corpus id list.")
-        with open(id_list_json, "r") as jsonfile:
-            filter_id_set = set(json.load(jsonfile))
-        filtered_publications = []
-        for publication in publications:
-            if publication["D3 ID"] in filter_id_set:
-                filtered_publications.append(publication)
-        publications = filtered_publications
-        del filtered_publications
+    else:
+        publications = list(selected_publications)
+        if progress_bar is not None:
+            progress_bar.close()
 
     print("Sorting the publications based on their D3 ID.")
     publications = sorted(publications, key=lambda x: x["D3 ID"])
@@ -188,25 +238,96 @@ def download_example_dataset():
     with open(example_data_id_list_path, "w", encoding="utf-8") as jsonfile:
         json.dump(publications_id_list, jsonfile, indent=2)
 
+    if columnar_store == 1:
+        print("Saving the publication metadata as columnar store.")
+        example_data_store_path = os.path.join(example_data_dir,
+                                               "metadata.kxstore")
+        ds.write_columnar_store(lambda: iter(publications), subjects,
+                                example_data_store_path)
+
+
+def build_gzip_index():
+    """Build the seek point index of the downloaded D3 dataset.
+
+    This function builds an index of the .gz archive of the papers part of the
+    D3 dataset, which was downloaded by the download_example_dataset()
+    function. The index is stored next to the archive and allows later runs
+    of download_example_dataset() to decompress and parse independent ranges
+    of the archive in parallel.
+    """
+
+    import modules.data_fetching as df
 
-def annotate():
+    download_dir = dl.get_abspath(
+        conf.config["example_dataset"]["download_dir"])
+    gzip_index_spacing_mb =\
+        int(conf.config["example_dataset"]["gzip_index_spacing_mb"])
+    d3_papers_gz_path = os.path.join(download_dir, "d3_papers.jsonl.gz")
+    d3_papers_index_path = d3_papers_gz_path + ".gzidx"
+
+    if not df.indexed_gzip_available():
+        print("Error: Building the index needs the indexed_gzip module, which "
+              "is not installed. Exiting!")
+        sys.exit(1)
+    if not os.path.isfile(d3_papers_gz_path):
+        print(f"Error: The archive {d3_papers_gz_path} does not exist. Please "
+              f"run the \"download-example-dataset\" command first. Exiting!")
+        sys.exit(1)
+
+    df.build_gzip_index(d3_papers_gz_path, d3_papers_index_path,
+                        gzip_index_spacing_mb)
+
+
+def annotate(data=None):
     """Annotates the configured dataset with the given target values.
 
     This function reads in the given dataset and tries to annotate it with
     the given target values by using an LLM. The list of annotated targets is
     only allowed to contain the provided targets. Any output from the LLM that
-    does not match a provided target string is discarded. The annotated dataset
-    is the saved in the configured path.
+    does not match a provided target string is discarded. The annotation of
+    every publication is appended to a journal as soon as it is finished, such
+    that an interrupted run can be resumed. In the end, the annotated dataset
+    is built from the journal and saved in the configured path. The metrics of
+    the run are saved periodically and at the end, if a metrics file is
+    configured.
+
+    :param data: The publications and targets of the configured dataset, if
+    they are loaded already (e.g. by the sweep command), or None.
+    :return annotation_metrics: The metrics of the run.
     """
 
+    import modules.data_processing as dp
+    import modules.data_storing as ds
+    import modules.annotation as an
+    import modules.evaluation as ev
+
     debug_mode = int(conf.config["general"]["debug"])
+    quiet = int(conf.config["general"]["quiet"])
     annotated_file = dl.get_abspath(conf.config["dataset"]["annotated_json"])
+    journal_file = dl.get_abspath(
+        conf.config["dataset"]["annotation_journal_jsonl"])
+    publication_id_index = conf.config["dataset"]["id_index"]
     publication_document_index = conf.config["dataset"]["document_index"]
     publication_annotation_index = conf.config["dataset"]["annotation_index"]
+    publication_annotation_cost_index =\
+        conf.config["dataset"]["annotation_cost_index"]
     has_evaluation_data = int(conf.config["dataset"]["has_evaluation_data"])
     publication_evaluation_data_index =\
         conf.config["dataset"]["evaluation_data_index"]
-    num_targets = int(conf.config["prompt"]["num_targets"])
+    block_size = int(conf.config["annotation"]["block_size"])
+    workers = int(conf.config["annotation"]["workers"])
+    resume = int(conf.config["annotation"]["resume"])
+    journal_flush_interval =\
+        int(conf.config["annotation"]["journal_flush_interval"])
+    shortlist_size = int(conf.config["annotation"]["shortlist_size"])
+    hierarchical = int(conf.config["annotation"]["hierarchical"])
+    taxonomy_json = conf.config["annotation"]["taxonomy_json"]
+    group_size = int(conf.config["annotation"]["group_size"])
+    deduplication = conf.config["annotation"]["deduplication"]
+    metrics_file = conf.config["metrics"]["metrics_file"]
+    metrics_interval = int(conf.config["metrics"]["metrics_interval"])
+    if metrics_file != "":
+        metrics_file = dl.get_abspath(metrics_file)
 
     if os.path.exists(annotated_file):
         print(f"The file {annotated_file} exists, which would be user for the "
@@ -214,68 +335,267 @@ def annotate():
               f"create a new annotation. Exiting!")
         sys.exit(1)
 
-    model = gpt4all_model.gpt4all_model()
+    if os.path.exists(journal_file) and resume != 1:
+        print(f"The journal file {journal_file} of an earlier annotation run "
+              f"exists. Please use the \"--resume\" option in order to "
+              f"continue this run or move the file in order to create a new "
+              f"annotation. Exiting!")
+        sys.exit(1)
+
+    settings = conf.settings
+    annotation_metrics = run_metrics.run_metrics()
+    with annotation_metrics.timer("data_load"):
+        if data is None:
+            data = dl.load_data()
+        publications, targets = data
 
-    publications, targets = dl.load_data()
+    targets_map = dp.build_canonical_targets_map(targets, settings)
 
-    targets_map = dp.build_canonical_targets_map(targets)
+    target_tree = None
+    if hierarchical == 1:
+        with annotation_metrics.timer("target_tree"):
+            if taxonomy_json != "":
+                print("Building the target tree from the taxonomy.")
+                target_tree = dp.build_taxonomy_tree(dl.load_taxonomy(),
+                                                     targets)
+            else:
+                print(f"Building the target tree with groups of up to "
+                      f"{group_size} similar targets.")
+                target_tree = dp.build_target_tree(targets, group_size)
 
-    start_time = datetime.now()
+    journal = {}
+    if resume == 1 and os.path.exists(journal_file):
+        dl.remove_incomplete_journal_entry(journal_file)
+        journal = dl.load_annotation_journal(journal_file)
+        print(f"Resuming the annotation with {len(journal)} already "
+              f"annotated publications from the journal.")
+
+    pending_publications = []
+    for position in range(len(publications)):
+        publication_id = dl.get_publication_id(publications[position],
+                                               position, publication_id_index)
+        if publication_id not in journal:
+            pending_publications.append((publication_id,
+                                         publications[position]))
 
     num_publications = len(publications)
-    current_publication = 1
-    for publication in publications:
-        print(f"Processing publication {current_publication}/"
-              f"{num_publications}:")
+    num_done_publications = num_publications - len(pending_publications)
+    pending_documents = []
+    for publication_id, publication in pending_publications:
+        pending_documents.append(publication[publication_document_index])
+
+    # Every group of pending publications is annotated once with the document
+    # of its first publication. Without deduplication, every publication forms
+    # a group of its own.
+    groups = [[index] for index in range(len(pending_publications))]
+    if deduplication != "none":
+        with annotation_metrics.timer("deduplication"):
+            representatives = dp.group_duplicate_documents(
+                pending_documents,
+                deduplication == "near",
+                settings["annotation"]["near_duplicate_threshold"],
+                settings["annotation"]["shingle_size"],
+                settings["annotation"]["minhash_permutations"],
+                settings["annotation"]["minhash_bands"])
+            members = {}
+            for index in range(len(representatives)):
+                members.setdefault(representatives[index], []).append(index)
+            groups = list(members.values())
+        print(f"Annotating {len(groups)} distinct documents of "
+              f"{len(pending_publications)} publications.")
+        pending_documents = [pending_documents[group[0]] for group in groups]
 
-        document = publication[publication_document_index]
-        prompt_lists = pe.build_query_prompt_lists(document, targets)
+    shortlists = None
+    if shortlist_size > 0 and target_tree is None:
+        # The index is built over all documents, such that a resumed run
+        # selects the same targets.
+        print(f"Selecting {shortlist_size} candidate targets per document "
+              f"with the lexical pre-filter.")
+        all_documents = []
+        for publication in publications:
+            all_documents.append(publication[publication_document_index])
+        with annotation_metrics.timer("shortlist"):
+            target_index = dp.build_target_index(targets, all_documents)
+            shortlists = dp.shortlist_targets(target_index,
+                                              pending_documents,
+                                              shortlist_size)
+        if has_evaluation_data == 1:
+            found_count, total_count = ev.build_shortlist_recall(
+                [pending_publications[group[0]][1] for group in groups],
+                shortlists,
+                publication_evaluation_data_index)
+            if total_count > 0:
+                print(f"The candidate targets contain {found_count} of the "
+                      f"{total_count} targets of the evaluation data (recall "
+                      f"{found_count / total_count:.3f}).")
 
-        if debug_mode == 1:
-            print("Using the following prompt lists:")
-            print(prompt_lists)
+    document_blocks = []
+    for block_start in range(0, len(groups), block_size):
+        block_shortlists = None
+        if shortlists is not None:
+            block_shortlists = shortlists[block_start:block_start
+                                          + block_size]
+        document_blocks.append((pending_documents[block_start:block_start
+                                                  + block_size],
+                                block_shortlists))
 
-        annotated_targets = pe.process_query_prompt_lists(model,
-                                                          prompt_lists,
-                                                          targets_map)
+    model = None
+    pool = None
+    if len(document_blocks) == 0:
+        annotated_blocks = []
+    elif workers == 1:
+        model = an.load_model(an.build_constraint_map(targets_map,
+                                                      target_tree),
+                              settings)
+        annotated_blocks = (an.annotate_block(model, documents, targets,
+                                              targets_map, settings,
+                                              block_shortlists, target_tree)
+                            for documents, block_shortlists
+                            in document_blocks)
+    else:
+        print(f"Starting {workers} annotation worker processes.")
+        pool = multiprocessing.Pool(workers,
+                                    initializer=an.init_worker,
+                                    initargs=(conf.get_snapshot(), workers,
+                                              targets, targets_map,
+                                              target_tree))
+        # imap hands out the blocks one by one to idle workers and returns
+        # the results in the original order of the blocks.
+        annotated_blocks = pool.imap(an.annotate_block_in_worker,
+                                     document_blocks)
 
-        while len(annotated_targets) > num_targets:
-            if debug_mode == 1:
-                print("The document needs another iteration of prompts.")
+    start_time = datetime.now()
 
-            prompt_lists = pe.build_query_prompt_lists(document,
-                                                       annotated_targets)
+    block_start = 0
+    num_processed_publications = num_done_publications
+    unflushed_publications = 0
+    last_metrics_time = time.monotonic()
+    with open(journal_file, "a", encoding="utf-8") as journalfile:
+        for annotated_targets_lists, costs, block_metrics in\
+                annotated_blocks:
+            annotation_metrics.merge(block_metrics)
+            block = groups[block_start:block_start
+                           + len(annotated_targets_lists)]
+            block_end = block_start + len(block)
+            block_publications = sum(len(group) for group in block)
+            if quiet != 1 and block_publications == 1:
+                print(f"Processed publication "
+                      f"{num_processed_publications + 1}/"
+                      f"{num_publications}:")
+            elif quiet != 1:
+                print(f"Processed publications "
+                      f"{num_processed_publications + 1}-"
+                      f"{num_processed_publications + block_publications}/"
+                      f"{num_publications}:")
+            num_processed_publications += block_publications
 
-            if debug_mode == 1:
-                print("Using the following prompt lists:")
-                print(prompt_lists)
+            for group, annotated_targets, cost in\
+                    zip(block, annotated_targets_lists, costs):
+                if debug_mode == 1:
+                    print("Extracted the following targets:")
+                    print(annotated_targets)
+                if cost is not None and quiet != 1:
+                    print(f"The annotation took {cost['rounds']} rounds "
+                          f"with {cost['calls']} LLM calls.")
 
-            annotated_targets = pe.process_query_prompt_lists(model,
-                                                              prompt_lists,
-                                                              targets_map)
+                # The annotation of the representative is copied to all
+                # members of its group.
+                for index in group:
+                    publication_id, publication = pending_publications[index]
+                    journal_entry = {"id": publication_id,
+                                     "annotation": annotated_targets}
+                    if cost is not None:
+                        journal_entry["cost"] = cost
+                    with annotation_metrics.timer("write"):
+                        journalfile.write(json.dumps(journal_entry) + "\n")
+                    unflushed_publications += 1
 
-        if debug_mode == 1:
-            print("Extracted the following targets:")
-            print(annotated_targets)
+                    if has_evaluation_data == 1 and quiet != 1:
+                        matching_targets = 0
+                        for target in annotated_targets:
+                            if target in publication[
+                                    publication_evaluation_data_index]:
+                                matching_targets += 1
+                        print(f"{matching_targets} of these could be found "
+                              f"in the evaluation data.")
 
-        publication[publication_annotation_index] = annotated_targets
+            if unflushed_publications >= journal_flush_interval:
+                with annotation_metrics.timer("write"):
+                    journalfile.flush()
+                    os.fsync(journalfile.fileno())
+                unflushed_publications = 0
 
-        if has_evaluation_data == 1:
-            matching_targets = 0
-            for target in publication[publication_annotation_index]:
-                if target in publication[publication_evaluation_data_index]:
-                    matching_targets += 1
-            print(f"{matching_targets} of these could be found in the "
-                  f"evaluation data.")
+            if metrics_file != "" and metrics_interval > 0 and\
+                    time.monotonic() - last_metrics_time >= metrics_interval:
+                metrics.write_metrics(annotation_metrics, metrics_file)
+                last_metrics_time = time.monotonic()
 
-        current_publication += 1
+            block_start = block_end
+
+    if model is not None:
+        model.close()
+    if pool is not None:
+        pool.close()
+        pool.join()
 
     end_time = datetime.now()
     duration = end_time - start_time
     print(f"The annotation of all documents took {duration} time")
+    counters = annotation_metrics.counters
+    if "constrained_aborts" in counters:
+        print(f"Constrained decoding aborted "
+              f"{counters['constrained_aborts']} responses that matched no "
+              f"known target and retried {counters['constrained_retries']} "
+              f"of them.")
+    if "http_requests" in counters:
+        print(f"The backend sent {counters['http_requests']} requests to the "
+              f"server ({counters['http_retries']} retries).")
+    if "cache_hits" in counters:
+        print(f"The inference cache answered {counters['cache_hits']} of "
+              f"{counters['cache_hits'] + counters['cache_misses']} prompt "
+              f"lists ({counters['cache_misses']} misses).")
+    if deduplication != "none" and len(groups) > 0:
+        # The calls saved are estimated with the average number of calls of
+        # the annotated documents.
+        num_duplicates = len(pending_publications) - len(groups)
+        saved_prompt_lists = round(counters.get("prompt_lists", 0)
+                                   * num_duplicates / len(groups))
+        annotation_metrics.increment("duplicate_publications",
+                                     num_duplicates)
+        annotation_metrics.increment("saved_prompt_lists",
+                                     saved_prompt_lists)
+        print(f"The deduplication copied the annotation of {len(groups)} "
+              f"documents to {num_duplicates} duplicates (dedup ratio "
+              f"{num_duplicates / len(pending_publications):.3f}), which "
+              f"saved about {saved_prompt_lists} LLM calls.")
 
-    with open(annotated_file, "w", encoding="utf-8") as jsonfile:
-        json.dump(publications, jsonfile, indent=2)
+    def build_annotated_publications(journal):
+        # The publications are copied one at a time, such that publications
+        # of a columnar store are never decoded all at once.
+        for position in range(len(publications)):
+            publication = dict(publications[position])
+            journal_entry = journal[dl.get_publication_id(
+                publication, position, publication_id_index)]
+            publication[publication_annotation_index] =\
+                journal_entry["annotation"]
+            if "cost" in journal_entry:
+                publication[publication_annotation_cost_index] =\
+                    journal_entry["cost"]
+            yield publication
+
+    with annotation_metrics.timer("write"):
+        journal = dl.load_annotation_journal(journal_file)
+        ds.write_publications_json(build_annotated_publications(journal),
+                                   annotated_file)
+
+    # All annotations are contained in the annotated dataset now.
+    os.remove(journal_file)
+
+    metrics.print_summary(annotation_metrics)
+    if metrics_file != "":
+        metrics.write_metrics(annotation_metrics, metrics_file)
+        print(f"Saved the metrics of the annotation in {metrics_file}.")
+    return annotation_metrics
 
 
 def evaluate():
@@ -283,42 +603,432 @@ def evaluate():
 
     This function reads the configured annotated dataset created by the
     annotate() function and generates evaluation data by matching the
-    generated targets with the given evaluation targets in the dataset.
+    generated targets with the given evaluation targets in the dataset. The
+    dataset is read as a stream in a single pass (see
+    evaluation.build_annotation_statistics()).
     """
 
+    import modules.evaluation as ev
+
     debug_mode = int(conf.config["general"]["debug"])
     has_evaluation_data = int(conf.config["dataset"]["has_evaluation_data"])
     publication_annotation_index = conf.config["dataset"]["annotation_index"]
     publication_evaluation_data_index =\
         conf.config["dataset"]["evaluation_data_index"]
+    targets_json = dl.get_abspath(conf.config["dataset"]["targets_json"])
+    chunk_size = int(conf.config["evaluation"]["chunk_size"])
+    num_confusions = int(conf.config["evaluation"]["num_confusions"])
+    evaluation_json = conf.config["evaluation"]["evaluation_json"]
 
     if has_evaluation_data != 1:
         print(f"The configuration implies that no evaluation data exists in "
               f"the dataset. Evaluation is not possible. Exiting!")
         sys.exit(1)
 
-    annotated_metadata = dl.load_annotated_metadata()
-    publication_count = len(annotated_metadata)
+    # The targets file only fixes the order of the targets in the results.
+    targets = []
+    if os.path.isfile(targets_json):
+        targets = dl.load_targets()
+
+    statistics = ev.build_annotation_statistics(
+        dl.iter_annotated_metadata(),
+        targets,
+        publication_annotation_index,
+        publication_evaluation_data_index,
+        chunk_size)
+    publication_count = statistics["documents"]
     if publication_count == 0:
         print(f"There is no metadata in the provided annotated json file. "
               f"Exiting!")
         sys.exit(1)
     print(f"Evaluating data for {publication_count} documents.")
 
-    avg_value, min_value,  max_value = ev.build_targets_count_stats(
-        annotated_metadata,
-        publication_annotation_index)
+    value_sum, min_value, max_value = statistics["targets_count"]
     print(f"Evaluation of the number of found targets:")
-    print(f"Avg: {avg_value}")
+    print(f"Avg: {value_sum / publication_count}")
     print(f"Min: {min_value}")
     print(f"Max: {max_value}")
 
-    avg_value, min_value,  max_value = ev.build_matching_targets_count_stats(
-        annotated_metadata,
-        publication_annotation_index,
-        publication_evaluation_data_index)
+    value_sum, min_value, max_value = statistics["matching_targets_count"]
     print(f"Evaluation of the number of correct targets according to the "
           f"provided evaluation data:")
-    print(f"Avg: {avg_value}")
+    print(f"Avg: {value_sum / publication_count}")
     print(f"Min: {min_value}")
     print(f"Max: {max_value}")
+
+    scores = ev.build_precision_recall(statistics)
+    for average in ["micro", "macro"]:
+        print(f"The {average} average of the annotated targets has a "
+              f"precision of {scores[average]['precision']:.4f}, a recall of "
+              f"{scores[average]['recall']:.4f} and an F1 score of "
+              f"{scores[average]['f1']:.4f}.")
+
+    confusions = ev.find_top_confusions(statistics, num_confusions)
+    if len(confusions) > 0:
+        print(f"The most frequent confusions of the evaluation data with the "
+              f"annotated targets:")
+    for missed_target, wrong_target, count in confusions:
+        print(f"{missed_target} -> {wrong_target}: {count}")
+
+    if evaluation_json != "":
+        evaluation_json = dl.get_abspath(evaluation_json)
+        targets = list(statistics["target_indices"])
+        target_results = []
+        for index in range(len(targets)):
+            target_results.append({
+                "target": targets[index],
+                "true_positives": int(statistics["true_positives"][index]),
+                "false_positives": int(statistics["false_positives"][index]),
+                "false_negatives": int(statistics["false_negatives"][index]),
+                "precision": float(scores["precision"][index]),
+                "recall": float(scores["recall"][index]),
+                "f1": float(scores["f1"][index])})
+        confusion_matrix = statistics["confusion_matrix"].tocoo()
+        confusion_entries = []
+        for row, column, count in zip(confusion_matrix.row,
+                                      confusion_matrix.col,
+                                      confusion_matrix.data):
+            confusion_entries.append([targets[row], targets[column],
+                                      int(count)])
+        with open(evaluation_json, "w", encoding="utf-8") as jsonfile:
+            json.dump({"documents": publication_count,
+                       "micro": scores["micro"],
+                       "macro": scores["macro"],
+                       "targets": target_results,
+                       "confusion_matrix": confusion_entries},
+                      jsonfile, indent=2)
+        print(f"Saved the evaluation results in {evaluation_json}.")
+
+
+def evaluate_compare():
+    """Comparison function for multiple annotated datasets.
+
+    This function reads the configured annotated datasets, aligns their
+    publications by id and compares the accuracy (the share of publications
+    with a correctly annotated target) and the F1 score of every dataset with
+    the first one. The differences are given with bootstrap confidence
+    intervals and the p-values of a paired permutation test.
+    """
+
+    import numpy as np
+
+    import modules.evaluation as ev
+
+    has_evaluation_data = int(conf.config["dataset"]["has_evaluation_data"])
+    publication_id_index = conf.config["dataset"]["id_index"]
+    publication_annotation_index = conf.config["dataset"]["annotation_index"]
+    publication_evaluation_data_index =\
+        conf.config["dataset"]["evaluation_data_index"]
+    chunk_size = int(conf.config["evaluation"]["chunk_size"])
+    compare_files = conf.config["evaluation"]["compare_files"]
+    bootstrap_replicates =\
+        int(conf.config["evaluation"]["bootstrap_replicates"])
+    permutations = int(conf.config["evaluation"]["permutations"])
+    confidence_level = float(conf.config["evaluation"]["confidence_level"])
+    random_seed = int(conf.config["evaluation"]["random_seed"])
+
+    if has_evaluation_data != 1:
+        print(f"The configuration implies that no evaluation data exists in "
+              f"the dataset. Evaluation is not possible. Exiting!")
+        sys.exit(1)
+
+    compare_files = [filename.strip() for filename in compare_files.split(",")
+                     if filename.strip() != ""]
+    if len(compare_files) < 2:
+        print(f"At least two annotated files are needed for a comparison. "
+              f"Please specify them with the \"--files\" option. Exiting!")
+        sys.exit(1)
+
+    runs = []
+    for filename in compare_files:
+        print(f"Reading the annotated file {filename}.")
+        runs.append(ev.build_document_counts(
+            dl.iter_annotated_metadata(filename),
+            publication_annotation_index,
+            publication_evaluation_data_index,
+            publication_id_index,
+            chunk_size))
+
+    ids, counts = ev.align_document_counts(runs)
+    if len(ids) == 0:
+        print(f"The annotated files have no publications in common. "
+              f"Exiting!")
+        sys.exit(1)
+    for filename, (run_ids, run_counts) in zip(compare_files, runs):
+        if len(run_ids) != len(ids):
+            print(f"Ignoring {len(run_ids) - len(ids)} publications of "
+                  f"{filename}, which are missing in other files.")
+    print(f"Comparing the annotation of {len(ids)} documents.")
+
+    statistics = ev.build_run_statistics(counts)
+    accuracy, f1 = ev.compute_run_scores(statistics.sum(axis=0), len(ids))
+    rng = np.random.default_rng(random_seed)
+    accuracy_differences, f1_differences = ev.bootstrap_score_differences(
+        statistics, bootstrap_replicates, rng)
+    accuracy_p_values, f1_p_values = ev.permutation_test(statistics,
+                                                         permutations, rng)
+    quantiles = [(1 - confidence_level) / 2, (1 + confidence_level) / 2]
+    accuracy_intervals = np.quantile(accuracy_differences, quantiles, axis=0)
+    f1_intervals = np.quantile(f1_differences, quantiles, axis=0)
+
+    for index in range(len(compare_files)):
+        print(f"{compare_files[index]}: Accuracy {accuracy[index]:.4f}, F1 "
+              f"score {f1[index]:.4f}")
+
+    confidence_percent = f"{confidence_level * 100:g}%"
+    for index in range(1, len(compare_files)):
+        print(f"Difference of {compare_files[index]} to "
+              f"{compare_files[0]}:")
+        for name, scores, intervals, p_values in [
+                ("Accuracy", accuracy, accuracy_intervals,
+                 accuracy_p_values),
+                ("F1 score", f1, f1_intervals, f1_p_values)]:
+            print(f"{name}: {scores[index] - scores[0]:+.4f} "
+                  f"({confidence_percent} CI [{intervals[0][index]:+.4f}, "
+                  f"{intervals[1][index]:+.4f}], p = "
+                  f"{p_values[index]:.4f})")
+
+
+def sweep():
+    """Annotate and evaluate the configured dataset with every combination of
+    the settings in the configured grid.
+
+    The runs are ordered by their model, such that a model is only loaded
+    once for all of its runs (see classes/gpt4all_model.py), and every
+    dataset is only loaded once for all runs. Every run saves its settings,
+    its annotated dataset and its journal in a directory of its own. Runs
+    whose annotated dataset exists are not repeated and interrupted runs are
+    resumed from their journal, such that an interrupted sweep is continued
+    by running it again. In the end, the evaluation results of all runs are
+    printed as a table and saved in the output directory.
+    """
+
+    import itertools
+
+    import modules.annotation as an
+    import modules.evaluation as ev
+
+    output_directory = dl.get_abspath(
+        conf.config["sweep"]["output_directory"])
+    grid = conf.parse_sweep_grid(conf.config["sweep"]["grid"])
+    if len(grid) == 0:
+        print("Error: The grid of the sweep is empty. Please configure it in "
+              "the [sweep] section or with the \"--grid\" option. Exiting!")
+        sys.exit(1)
+
+    # The configuration of every run is built and checked before the first
+    # run starts.
+    base_snapshot = conf.get_snapshot()
+    runs = []
+    for values in itertools.product(*[option_values for section_index,
+                                      option_index, option_values in grid]):
+        name = f"run_{len(runs) + 1:03d}"
+        run_directory = os.path.join(output_directory, name)
+        snapshot = {section_index: dict(options)
+                    for section_index, options in base_snapshot.items()}
+        options = {}
+        for (section_index, option_index, option_values), value in\
+                zip(grid, values):
+            snapshot[section_index][option_index] = value
+            options[f"{section_index}.{option_index}"] = value
+        snapshot["dataset"]["annotated_json"] = os.path.join(
+            run_directory, "annotated_metadata.json")
+        snapshot["dataset"]["annotation_journal_jsonl"] = os.path.join(
+            run_directory, "annotated_metadata.jsonl")
+        snapshot["annotation"]["resume"] = "1"
+        metrics_file = snapshot["metrics"]["metrics_file"]
+        if metrics_file != "":
+            snapshot["metrics"]["metrics_file"] = os.path.join(
+                run_directory, os.path.basename(metrics_file))
+        conf.load_snapshot(snapshot)
+        runs.append({"name": name,
+                     "directory": run_directory,
+                     "options": options,
+                     "snapshot": snapshot,
+                     "model_key": an.get_model_key(conf.settings)})
+
+    model_order = {}
+    for run in runs:
+        model_order.setdefault(run["model_key"], len(model_order))
+    if len(model_order) == 1:
+        print(f"Running {len(runs)} annotation runs with 1 model.")
+    else:
+        print(f"Running {len(runs)} annotation runs with {len(model_order)} "
+              f"models.")
+
+    datasets = {}
+    for run in sorted(runs, key=lambda run: model_order[run["model_key"]]):
+        conf.load_snapshot(run["snapshot"])
+        annotated_file = conf.config["dataset"]["annotated_json"]
+        run_file = os.path.join(run["directory"], "run.json")
+        options_string = ", ".join(f"{option} = {value}" for option, value
+                                   in run["options"].items())
+        if os.path.isfile(run_file):
+            with open(run_file, "r", encoding="utf-8") as jsonfile:
+                if json.load(jsonfile)["options"] != run["options"]:
+                    print(f"The directory {run['directory']} contains a run "
+                          f"with other settings than {options_string}. "
+                          f"Please use another output directory. Exiting!")
+                    sys.exit(1)
+        if os.path.exists(annotated_file):
+            print(f"Skipping {run['name']} ({options_string}), whose "
+                  f"annotated dataset exists.")
+            continue
+        print(f"Starting {run['name']} with {options_string}.")
+        if not os.path.isdir(run["directory"]):
+            os.makedirs(run["directory"], 0o775)
+        with open(run_file, "w", encoding="utf-8") as jsonfile:
+            json.dump({"options": run["options"]}, jsonfile, indent=2)
+
+        # Runs, which only differ in other settings than the dataset files,
+        # share the loaded dataset.
+        dataset_key = (dl.get_abspath(conf.config["dataset"]["metadata_json"]),
+                       dl.get_abspath(conf.config["dataset"]["targets_json"]))
+        if dataset_key not in datasets:
+            datasets[dataset_key] = dl.load_data()
+        start_time = time.monotonic()
+        report = annotate(datasets[dataset_key]).build_report()
+        run_seconds = time.monotonic() - start_time
+
+        with open(run_file, "w", encoding="utf-8") as jsonfile:
+            json.dump({"options": run["options"],
+                       "seconds": run_seconds,
+                       "model_load_seconds": report["timers"].get(
+                           "model_load", {"seconds": 0.0})["seconds"],
+                       "prompt_lists": report["counters"].get("prompt_lists",
+                                                              0)},
+                      jsonfile, indent=2)
+
+    results = []
+    for run in runs:
+        conf.load_snapshot(run["snapshot"])
+        has_evaluation_data = int(
+            conf.config["dataset"]["has_evaluation_data"])
+        targets_json = dl.get_abspath(conf.config["dataset"]["targets_json"])
+        run_file = os.path.join(run["directory"], "run.json")
+        result = {"run": run["name"], "options": run["options"]}
+        if os.path.isfile(run_file):
+            with open(run_file, "r", encoding="utf-8") as jsonfile:
+                result.update(json.load(jsonfile))
+        annotated_file = conf.config["dataset"]["annotated_json"]
+        if has_evaluation_data == 1 and os.path.exists(annotated_file):
+            # The targets file only fixes the order of the targets.
+            targets = []
+            if os.path.isfile(targets_json):
+                targets = dl.load_targets()
+            statistics = ev.build_annotation_statistics(
+                dl.iter_annotated_metadata(annotated_file),
+                targets,
+                conf.config["dataset"]["annotation_index"],
+                conf.config["dataset"]["evaluation_data_index"],
+                int(conf.config["evaluation"]["chunk_size"]))
+            publication_count = max(1, statistics["documents"])
+            scores = ev.build_precision_recall(statistics)
+            result["documents"] = statistics["documents"]
+            result["found_targets"] = statistics["targets_count"][0]\
+                / publication_count
+            result["correct_targets"] =\
+                statistics["matching_targets_count"][0] / publication_count
+            result["micro"] = scores["micro"]
+            result["macro"] = scores["macro"]
+        results.append(result)
+    conf.load_snapshot(base_snapshot)
+
+    header = ["Run"] + [option for section_index, option, option_values
+                        in grid]
+    header += ["Documents", "Found", "Correct", "Micro F1", "Macro F1",
+               "Seconds"]
+    rows = [header]
+    for result in results:
+        row = [result["run"]] + list(result["options"].values())
+        if "documents" in result:
+            row += [str(result["documents"]),
+                    f"{result['found_targets']:.4f}",
+                    f"{result['correct_targets']:.4f}",
+                    f"{result['micro']['f1']:.4f}",
+                    f"{result['macro']['f1']:.4f}"]
+        else:
+            row += ["-"] * 5
+        if "seconds" in result:
+            row.append(f"{result['seconds']:.1f}")
+        else:
+            row.append("-")
+        rows.append(row)
+    widths = [max(len(row[index]) for row in rows)
+              for index in range(len(header))]
+    for row in rows:
+        print("  ".join(row[index].ljust(widths[index])
+                        for index in range(len(row))).rstrip())
+
+    results_file = os.path.join(output_directory, "sweep_results.json")
+    with open(results_file, "w", encoding="utf-8") as jsonfile:
+        json.dump(results, jsonfile, indent=2)
+    print(f"Saved the results of the sweep in {results_file}.")
+
+
+def convert_metadata():
+    """Convert publication metadata between .json files and columnar stores.
+
+    If the configured input path is the directory of a columnar store, the
+    store is saved as .json file. Otherwise, the .json (or .jsonl) file is
+    saved as columnar store, in which the lists of the configured targets are
+    saved as bitsets. The input is read twice instead of being loaded into
+    memory.
+    """
+
+    import modules.data_storing as ds
+
+    input_path = conf.config["conversion"]["input_path"]
+    output_path = conf.config["conversion"]["output_path"]
+    if input_path == "":
+        input_path = conf.config["dataset"]["metadata_json"]
+    input_path = dl.get_abspath(input_path)
+    if output_path == "":
+        print("Error: No output path for the converted metadata is given. "
+              "Please use the \"--output\" option. Exiting!")
+        sys.exit(1)
+    output_path = dl.get_abspath(output_path)
+
+    if os.path.exists(output_path):
+        print(f"The path {output_path} exists, which would be used for the "
+              f"converted metadata. Please move it in order to convert the "
+              f"metadata. Exiting!")
+        sys.exit(1)
+
+    start_time = datetime.now()
+    if os.path.isdir(input_path):
+        print(f"Converting the columnar store {input_path} into the file "
+              f"{output_path}.")
+        publications = dl.open_columnar_store(input_path)
+        ds.write_publications_json(publications, output_path)
+        num_publications = len(publications)
+    else:
+        targets = []
+        targets_json = dl.get_abspath(conf.config["dataset"]["targets_json"])
+        if os.path.isfile(targets_json):
+            targets = dl.load_targets()
+        else:
+            print(f"The targets file {targets_json} does not exist, lists of "
+                  f"targets are saved as JSON texts.")
+        print(f"Converting the file {input_path} into the columnar store "
+              f"{output_path}.")
+        ds.write_columnar_store(
+            lambda: dl.iter_annotated_metadata(input_path), targets,
+            output_path)
+        num_publications = len(dl.open_columnar_store(output_path))
+
+    duration = datetime.now() - start_time
+    print(f"Converted {num_publications} publications in {duration} time.")
+
+
+def serve_fake_backend():
+    """Serve the fake backend as an OpenAI-compatible server.
+
+    The server answers chat completion requests like the fake backend, so the
+    openai backend and the whole pipeline can be tested without a model.
+    """
+
+    import modules.fake_server as fake_server
+
+    port = int(conf.config["backend"]["fake_server_port"])
+    fake_server.serve(port, conf.settings)
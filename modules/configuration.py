@@ -1,4 +1,5 @@
 import sys
+import types
 import configparser
 import os
 
@@ -13,6 +14,8 @@ def check_fixed_value(section_index, option_index, possible_values):
     """
 
     global config
+    if all(possible_value.isdigit() for possible_value in possible_values):
+        option_types[(section_index, option_index)] = int
     if config[section_index][option_index] not in possible_values:
         possible_values_string = ""
         for possible_value in possible_values:
@@ -32,6 +35,7 @@ def check_positive_integer(section_index, option_index):
     :param option_index: The name of the configuration option.
     """
     global config
+    option_types[(section_index, option_index)] = int
     error_message = f"Configuration error: The value of section \""\
                     + f"{section_index}\" and option \"{option_index}\" is "\
                     + f"not valid. Possible values are: An integer > 0"
@@ -45,8 +49,308 @@ def check_positive_integer(section_index, option_index):
         sys.exit(1)
 
 
+def check_non_negative_integer(section_index, option_index):
+    """ Check if a configuration option is a non-negative integer (>= 0).
+    Error out if this is not the case.
+
+    :param section_index: The name of the configuration section.
+    :param option_index: The name of the configuration option.
+    """
+    global config
+    option_types[(section_index, option_index)] = int
+    error_message = f"Configuration error: The value of section \""\
+                    + f"{section_index}\" and option \"{option_index}\" is "\
+                    + f"not valid. Possible values are: An integer >= 0"
+    try:
+        value = int(config[section_index][option_index])
+        if value < 0:
+            print(error_message)
+            sys.exit(1)
+    except ValueError:
+        print(error_message)
+        sys.exit(1)
+
+
+def check_non_negative_float(section_index, option_index):
+    """ Check if a configuration option is a non-negative number (>= 0).
+    Error out if this is not the case.
+
+    :param section_index: The name of the configuration section.
+    :param option_index: The name of the configuration option.
+    """
+    global config
+    option_types[(section_index, option_index)] = float
+    error_message = f"Configuration error: The value of section \""\
+                    + f"{section_index}\" and option \"{option_index}\" is "\
+                    + f"not valid. Possible values are: A number >= 0"
+    try:
+        value = float(config[section_index][option_index])
+        if value < 0:
+            print(error_message)
+            sys.exit(1)
+    except ValueError:
+        print(error_message)
+        sys.exit(1)
+
+
+def check_fraction(section_index, option_index):
+    """ Check if a configuration option is a number between 0 and 1. Error
+    out if this is not the case.
+
+    :param section_index: The name of the configuration section.
+    :param option_index: The name of the configuration option.
+    """
+    global config
+    option_types[(section_index, option_index)] = float
+    error_message = f"Configuration error: The value of section \""\
+                    + f"{section_index}\" and option \"{option_index}\" is "\
+                    + f"not valid. Possible values are: A number >= 0 and <= 1"
+    try:
+        value = float(config[section_index][option_index])
+        if value < 0 or value > 1:
+            print(error_message)
+            sys.exit(1)
+    except ValueError:
+        print(error_message)
+        sys.exit(1)
+
+
+def parse_sweep_grid(grid_string):
+    """ Parse the grid of settings of the sweep command. Every line (or every
+    part separated by a semicolon) names a configuration option as
+    section.option, followed by "=" and the comma separated values of the
+    option. A line without "=" continues the values of the previous line.
+    Error out if a part is invalid or names an option that is set by
+    the sweep command itself.
+
+    :param grid_string: The configured grid.
+    :return grid: A list of tuples of the section, the option and the list
+    of values.
+    """
+
+    global config
+    grid = []
+    for part in grid_string.replace(";", "\n").splitlines():
+        if part.strip() == "":
+            continue
+        option_string, separator, values_string = part.partition("=")
+        if separator == "" and len(grid) > 0:
+            grid[-1][2].extend(value.strip() for value in part.split(",")
+                               if value.strip() != "")
+            continue
+        section_index, dot, option_index = option_string.strip().partition(
+            ".")
+        values = [value.strip() for value in values_string.split(",")
+                  if value.strip() != ""]
+        if separator == "" or dot == "" or len(values) == 0:
+            print(f"Configuration error: The grid of section \"sweep\" "
+                  f"contains the invalid line \"{part.strip()}\". Possible "
+                  f"values are: section.option = value, value, ...")
+            sys.exit(1)
+        if section_index not in config\
+                or option_index not in config[section_index]:
+            print(f"Configuration error: The grid of section \"sweep\" "
+                  f"contains the unknown option \"{option_index}\" of "
+                  f"section \"{section_index}\".")
+            sys.exit(1)
+        if section_index == "sweep" or (section_index, option_index) in [
+                ("dataset", "annotated_json"),
+                ("dataset", "annotation_journal_jsonl"),
+                ("annotation", "resume")]:
+            print(f"Configuration error: The grid of section \"sweep\" "
+                  f"contains the option \"{option_index}\" of section "
+                  f"\"{section_index}\", which is set by the sweep "
+                  f"command.")
+            sys.exit(1)
+        grid.append((section_index, option_index, values))
+    return grid
+
+
+def check_config():
+    """ Check all configuration options and error out if one of them has an
+    invalid value."""
+
+    # Checking the configuration options for the [general] section.
+    check_fixed_value("general", "debug", ["0", "1"])
+    check_fixed_value("general", "quiet", ["0", "1"])
+
+    # Checking the configuration options for the [example_dataset] section.
+    check_fixed_value("example_dataset",
+                      "creation_mode",
+                      ["all", "random", "ids"])
+    check_positive_integer("example_dataset", "num_random_publications")
+    check_non_negative_integer("example_dataset", "random_seed")
+    check_fixed_value("example_dataset", "keep_uncompressed_jsonl",
+                      ["0", "1"])
+    check_non_negative_integer("example_dataset", "parse_processes")
+    check_positive_integer("example_dataset", "gzip_index_spacing_mb")
+    check_non_negative_integer("example_dataset", "download_retries")
+    check_fixed_value("example_dataset", "columnar_store", ["0", "1"])
+
+    # Checking the configuration options for the [dataset] section.
+    check_fixed_value("dataset", "has_evaluation_data", ["0", "1"])
+
+    # Checking the configuration options for the [backend] section.
+    check_fixed_value("backend", "backend", ["gpt4all", "openai", "fake"])
+    check_positive_integer("backend", "fake_server_port")
+    check_non_negative_float("backend", "fake_prompt_token_latency_ms")
+    check_non_negative_float("backend", "fake_token_latency_ms")
+
+    # Checking the configuration options for the [gpt4all] section.
+    check_fixed_value("gpt4all", "device", ["cpu", "gpu"])
+    if config["gpt4all"]["model_name"] == "":
+        print("Configuration error: The value of section \"gpt4all\" and "
+              "option \"model_name\" is not valid. Possible values are: The "
+              "name of a model")
+        sys.exit(1)
+    check_fixed_value("gpt4all", "reuse_preamble", ["0", "1"])
+    check_non_negative_integer("gpt4all", "intermediate_max_tokens")
+    check_non_negative_integer("gpt4all", "final_max_tokens")
+    check_non_negative_float("gpt4all", "temperature")
+    check_positive_integer("gpt4all", "top_k")
+    check_non_negative_float("gpt4all", "top_p")
+    check_non_negative_integer("gpt4all", "n_threads")
+    check_positive_integer("gpt4all", "n_ctx")
+    check_fixed_value("gpt4all", "constrained_decoding", ["0", "1"])
+    check_fixed_value("gpt4all", "constrained_retry", ["0", "1"])
+
+    # Checking the configuration options for the [openai] section.
+    check_positive_integer("openai", "concurrency")
+    check_positive_integer("openai", "timeout")
+    check_non_negative_integer("openai", "retries")
+
+    # Checking the configuration options for the [prompt] section.
+    check_positive_integer("prompt", "num_targets")
+    check_positive_integer("prompt", "targets_per_prompt")
+    check_positive_integer("prompt", "prompts_per_chat")
+    check_non_negative_integer("prompt", "documents_per_prompt")
+    check_fraction("prompt", "context_fraction")
+
+    # Checking the configuration options for the [annotation] section.
+    check_positive_integer("annotation", "block_size")
+    check_positive_integer("annotation", "workers")
+    check_fixed_value("annotation", "resume", ["0", "1"])
+    check_positive_integer("annotation", "journal_flush_interval")
+    check_non_negative_integer("annotation", "shortlist_size")
+    check_fixed_value("annotation", "hierarchical", ["0", "1"])
+    check_positive_integer("annotation", "group_size")
+    if int(config["annotation"]["group_size"]) < 2:
+        print("Configuration error: The value of section \"annotation\" and "
+              "option \"group_size\" is not valid. Possible values are: An "
+              "integer > 1")
+        sys.exit(1)
+    check_non_negative_integer("annotation", "max_rounds")
+    check_non_negative_integer("annotation", "max_calls")
+    check_fixed_value("annotation", "deduplication",
+                      ["none", "exact", "near"])
+    check_fraction("annotation", "near_duplicate_threshold")
+    check_positive_integer("annotation", "shingle_size")
+    check_positive_integer("annotation", "minhash_permutations")
+    check_positive_integer("annotation", "minhash_bands")
+    if int(config["annotation"]["minhash_permutations"])\
+            % int(config["annotation"]["minhash_bands"]) != 0:
+        print("Configuration error: The value of section \"annotation\" and "
+              "option \"minhash_bands\" is not valid. Possible values are: "
+              "A divisor of minhash_permutations")
+        sys.exit(1)
+
+    # Checking the configuration options for the [evaluation] section.
+    check_positive_integer("evaluation", "chunk_size")
+    check_non_negative_integer("evaluation", "num_confusions")
+    check_positive_integer("evaluation", "bootstrap_replicates")
+    check_positive_integer("evaluation", "permutations")
+    check_fraction("evaluation", "confidence_level")
+    if float(config["evaluation"]["confidence_level"]) in [0, 1]:
+        print("Configuration error: The value of section \"evaluation\" and "
+              "option \"confidence_level\" is not valid. Possible values "
+              "are: A number > 0 and < 1")
+        sys.exit(1)
+    check_non_negative_integer("evaluation", "random_seed")
+
+    # Checking the configuration options for the [cache] section.
+    check_fixed_value("cache", "use_cache", ["0", "1"])
+    check_positive_integer("cache", "max_size_mb")
+
+    # Checking the configuration options for the [metrics] section.
+    check_fixed_value("metrics", "metrics_format", ["json", "prometheus"])
+    check_non_negative_integer("metrics", "metrics_interval")
+
+    # Checking the configuration options for the [sweep] section.
+    parse_sweep_grid(config["sweep"]["grid"])
+
+    global settings
+    settings = build_settings()
+
+
+def build_settings():
+    """ Build an immutable copy of the configuration, in which the options
+    checked as numbers or flags are converted into int or float values. It is
+    passed to the functions that run for every document, such that they do
+    not need to look up and convert the options on every call.
+
+    :return settings: A read-only map of sections to read-only maps of
+    options.
+    """
+
+    global config
+    sections = {}
+    for section_index in config.sections():
+        options = {}
+        for option_index, value in config[section_index].items():
+            option_type = option_types.get((section_index, option_index), str)
+            options[option_index] = option_type(value)
+        sections[section_index] = types.MappingProxyType(options)
+    return types.MappingProxyType(sections)
+
+
+def set_option(section_index, option_index, value):
+    """ Overwrite a configuration option, e.g. with a value given on the
+    command line, and check the resulting configuration.
+
+    :param section_index: The name of the configuration section.
+    :param option_index: The name of the configuration option.
+    :param value: The new value of the option.
+    """
+
+    global config
+    config[section_index][option_index] = str(value)
+    check_config()
+
+
+def get_snapshot():
+    """ Return the current configuration as a map of sections to maps of
+    options, e.g. to hand it to worker processes.
+
+    :return snapshot: The map containing the configuration.
+    """
+
+    global config
+    snapshot = {}
+    for section_index in config.sections():
+        snapshot[section_index] = dict(config[section_index])
+    return snapshot
+
+
+def load_snapshot(snapshot):
+    """ Overwrite the current configuration with a snapshot created by
+    get_snapshot().
+
+    :param snapshot: The map containing the configuration.
+    """
+
+    global config
+    config.read_dict(snapshot)
+    check_config()
+
+
+# The types of the options that are checked as numbers or flags, which are
+# registered by the check functions and used by build_settings().
+option_types = {}
+
 # Loading the default configuration file and overwriting it with the user
-# configuration file.
+# configuration file. The settings are rebuilt whenever the configuration is
+# checked.
+settings = None
 config = configparser.ConfigParser()
 tooldir = os.path.abspath(os.path.dirname(sys.argv[0]))
 defaultfile = tooldir + "/config/config-defaults.ini"
@@ -55,27 +359,4 @@ config.read(defaultfile)
 if os.path.isfile(configfile):
     config.read(configfile)
 
-# Checking the configuration options for the [general] section.
-check_fixed_value("general", "debug", ["0", "1"])
-
-# Checking the configuration options for the [example_dataset] section.
-check_fixed_value("example_dataset", "creation_mode", ["all", "random", "ids"])
-check_positive_integer("example_dataset", "num_random_publications")
-
-# Checking the configuration options for the [dataset] section.
-check_fixed_value("dataset", "has_evaluation_data", ["0", "1"])
-
-# Checking the configuration options for the [gpt4all] section.
-check_fixed_value("gpt4all", "device", ["cpu", "gpu"])
-check_fixed_value("gpt4all",
-                  "model_name",
-                  ["Meta-Llama-3-8B-Instruct.Q4_0.gguf",
-                   "Nous-Hermes-2-Mistral-7B-DPO.Q4_0.gguf",
-                   "Phi-3-mini-4k-instruct.Q4_0.gguf",
-                   "orca-mini-3b-gguf2-q4_0.gguf",
-                   "gpt4all-13b-snoozy-q4_0.gguf"])
-
-# Checking the configuration options for the [prompt] section.
-check_positive_integer("prompt", "num_targets")
-check_positive_integer("prompt", "targets_per_prompt")
-check_positive_integer("prompt", "prompts_per_chat")
+check_config()
@@ -1,10 +1,18 @@
 import os
+import sys
+import mmap
+import time
+import hashlib
 from datetime import datetime
+from urllib.parse import urlparse
+from urllib.request import url2pathname
 from typing import Union
 # import gzip
 
+import requests
 import isal
 from isal import igzip_threaded
+from isal import isal_zlib
 # from pgzip import pgzip
 # import zlib_ng
 # from zlib_ng import gzip_ng_threaded#
@@ -42,3 +50,459 @@ def extract_gzip(gzip_filename: str, read_mode='rb',
     print(f"Extraction finished (end time: {end_time}).")
     print(f"Duration of the extraction: {duration}.")
     return extracted_file
+
+
+def get_local_source_path(source):
+    """
+    Get the local path of a download source, which is a local path or a
+    `file://` URL.
+
+    :param source: The URL or path of the file
+    :return: The local path or None if the source is a remote URL
+    """
+    parsed_source = urlparse(source)
+    if parsed_source.scheme == "file":
+        return url2pathname(parsed_source.path)
+    if parsed_source.scheme in ["http", "https"]:
+        return None
+    return source
+
+
+def request_download_range(url, offset, retries):
+    """
+    Request the content of a file starting at a byte offset. Failed requests
+    are retried with an increasing delay.
+
+    :param url: The URL of the file
+    :param offset: The byte offset the content should start at
+    :param retries: The number of retries
+    :return: The streamed response (None if there is no content left), the
+    number of bytes at the start of the response content that must be skipped
+    (if the server does not support ranges) and the size of the file in bytes
+    (0 if the server does not provide it)
+    """
+    for attempt in range(retries + 1):
+        try:
+            headers = {}
+            if offset > 0:
+                headers["Range"] = f"bytes={offset}-"
+            response = requests.get(url, stream=True, headers=headers,
+                                    timeout=60)
+            if response.status_code == 206:
+                # The Content-Range header has the form "bytes a-b/size".
+                content_range = response.headers.get("content-range", "")
+                total_filesize = int(content_range.split("/")[-1])
+                return response, 0, total_filesize
+            if response.status_code == 200:
+                total_filesize =\
+                    int(response.headers.get("content-length", 0))
+                return response, offset, total_filesize
+            if response.status_code == 416 and offset > 0:
+                # The requested range starts at the end of the file.
+                return None, 0, offset
+            print(f"The download of {url} failed with the HTTP status code "
+                  f"{response.status_code}.")
+        except requests.exceptions.RequestException as error:
+            print(f"The download of {url} failed: {error}")
+        if attempt < retries:
+            delay = 2 ** attempt
+            print(f"Retrying in {delay} seconds.")
+            time.sleep(delay)
+    print(f"Error: The download of {url} failed {retries + 1} times. "
+          f"Exiting!")
+    sys.exit(1)
+
+
+def compute_file_md5(filename, chunk_size=1024 * 1024):
+    """
+    Compute the MD5 checksum of a file.
+
+    :param filename: The file
+    :param chunk_size: The size of the chunks the file is read in
+    :return: The hex digest of the checksum
+    """
+    md5 = hashlib.md5()
+    for chunk in iter_file_chunks(filename, chunk_size):
+        md5.update(chunk)
+    return md5.hexdigest()
+
+
+def verify_cached_download(filename, expected_md5):
+    """
+    Check whether a previously downloaded file matches the expected MD5
+    checksum. The checksum of the file is stored in `<filename>.md5` when
+    it is downloaded, so the file does not need to be read again.
+
+    :param filename: The downloaded file
+    :param expected_md5: The expected checksum or an empty string if the
+    checksum should not be checked
+    :return: True if the file can be used
+    """
+    if expected_md5 == "":
+        return True
+    md5_filename = filename + ".md5"
+    if os.path.isfile(md5_filename):
+        with open(md5_filename, "r") as md5_file:
+            file_md5 = md5_file.read().strip()
+    else:
+        file_md5 = compute_file_md5(filename)
+        with open(md5_filename, "w") as md5_file:
+            md5_file.write(file_md5 + "\n")
+    return file_md5 == expected_md5.lower()
+
+
+def open_resumable_download(source, filename, expected_md5="", retries=5,
+                            chunk_size=1024 * 1024):
+    """
+    Start or resume the download of a file into a local cache.
+
+    The source can be an HTTP(S) URL, a `file://` URL or a local path, e.g. of
+    a local mirror. The content is written to `<filename>.part`. If this file
+    exists from an interrupted download, only the missing part is requested
+    with an HTTP range request. Once the download is complete, its size and
+    (if given) MD5 checksum are verified and the file is renamed to the given
+    file name.
+
+    :param source: The URL or path of the file
+    :param filename: The file the downloaded content is written to
+    :param expected_md5: The expected MD5 checksum or an empty string if the
+    checksum should not be checked
+    :param retries: The number of retries for failed requests
+    :param chunk_size: The size of the chunks in bytes
+    :return: The size of the file in bytes (0 if unknown) and a generator of
+    all chunks of the file, starting with the already downloaded ones
+    """
+    partial_filename = filename + ".part"
+    offset = 0
+    if os.path.isfile(partial_filename):
+        offset = os.path.getsize(partial_filename)
+
+    local_path = get_local_source_path(source)
+    response = None
+    skip = 0
+    if local_path is not None:
+        if not os.path.isfile(local_path):
+            print(f"Error: The file {local_path} does not exist. Exiting!")
+            sys.exit(1)
+        total_filesize = os.path.getsize(local_path)
+    else:
+        response, skip, total_filesize = request_download_range(source,
+                                                                offset,
+                                                                retries)
+    if offset > 0:
+        print(f"Resuming the download at byte {offset}.")
+
+    chunks = iter_resumable_download_chunks(source, local_path, response,
+                                            skip, offset, total_filesize,
+                                            filename, expected_md5, retries,
+                                            chunk_size)
+    return total_filesize, chunks
+
+
+def iter_resumable_download_chunks(source, local_path, response, skip,
+                                   offset, total_filesize, filename,
+                                   expected_md5, retries, chunk_size):
+    """
+    Yield all chunks of a file downloaded by open_resumable_download(). If
+    the connection breaks, the download is resumed at the current position.
+
+    See open_resumable_download() for the description of the parameters.
+    """
+    partial_filename = filename + ".part"
+    md5 = hashlib.md5()
+
+    # The consumer gets the whole file, so the already downloaded part is
+    # read from the disk first.
+    if offset > 0:
+        for chunk in iter_file_chunks(partial_filename, chunk_size):
+            md5.update(chunk)
+            yield chunk
+
+    position = offset
+    with open(partial_filename, "ab") as download_file:
+        if local_path is not None:
+            with open(local_path, "rb") as source_file:
+                source_file.seek(position)
+                while True:
+                    chunk = source_file.read(chunk_size)
+                    if len(chunk) == 0:
+                        break
+                    download_file.write(chunk)
+                    md5.update(chunk)
+                    position += len(chunk)
+                    yield chunk
+
+        attempt = 0
+        while response is not None:
+            try:
+                for chunk in response.iter_content(chunk_size):
+                    if skip > 0:
+                        # The server sent the already downloaded part again.
+                        if len(chunk) <= skip:
+                            skip -= len(chunk)
+                            continue
+                        chunk = chunk[skip:]
+                        skip = 0
+                    download_file.write(chunk)
+                    md5.update(chunk)
+                    position += len(chunk)
+                    yield chunk
+                response = None
+            except requests.exceptions.RequestException as error:
+                if attempt >= retries:
+                    print(f"Error: The download of {source} failed: {error}. "
+                          f"Run the tool again to resume it. Exiting!")
+                    sys.exit(1)
+                attempt += 1
+                print(f"The download of {source} was interrupted: {error}. "
+                      f"Resuming it at byte {position}.")
+                download_file.flush()
+                time.sleep(2 ** attempt)
+                response, skip, total_filesize = request_download_range(
+                    source,
+                    position,
+                    retries)
+
+    if total_filesize > 0 and position != total_filesize:
+        print(f"Error: The downloaded file has {position} bytes, but "
+              f"{total_filesize} bytes were expected. Run the tool again to "
+              f"resume the download. Exiting!")
+        if position > total_filesize:
+            os.remove(partial_filename)
+        sys.exit(1)
+    file_md5 = md5.hexdigest()
+    if expected_md5 != "" and file_md5 != expected_md5.lower():
+        print(f"Error: The MD5 checksum {file_md5} of the downloaded file "
+              f"does not match the expected checksum {expected_md5}. The "
+              f"file was removed. Exiting!")
+        os.remove(partial_filename)
+        sys.exit(1)
+
+    # The file only gets its final name once it is complete and verified.
+    os.replace(partial_filename, filename)
+    with open(filename + ".md5", "w") as md5_file:
+        md5_file.write(file_md5 + "\n")
+
+
+def iter_file_chunks(filename, chunk_size=1024 * 1024):
+    """
+    Yield the content of a file chunk by chunk.
+
+    :param filename: The file that should be read
+    :param chunk_size: The size of the chunks in bytes
+    :return: Generator of the chunks
+    """
+    with open(filename, "rb") as chunks_file:
+        while True:
+            chunk = chunks_file.read(chunk_size)
+            if len(chunk) == 0:
+                break
+            yield chunk
+
+
+def iter_gzip_lines(chunks, progress_bar=None):
+    """
+    Decompress a stream of gzip compressed chunks and yield the contained
+    lines without keeping the whole decompressed content in memory.
+
+    :param chunks: Iterable of chunks of a `.gz` file (or multiple
+    concatenated gzip members)
+    :param progress_bar: Optional tqdm progress bar, which is updated with the
+    number of compressed bytes consumed
+    :return: Generator of the non-empty lines (as bytes, without the line
+    break)
+    """
+    decompressor = isal_zlib.decompressobj(wbits=31)
+    remainder = b""
+    for chunk in chunks:
+        if progress_bar is not None:
+            progress_bar.update(len(chunk))
+        while len(chunk) > 0:
+            data = decompressor.decompress(chunk)
+            chunk = b""
+            if decompressor.eof:
+                # Start decompressing the next gzip member, if there is one.
+                chunk = decompressor.unused_data
+                decompressor = isal_zlib.decompressobj(wbits=31)
+            lines = (remainder + data).split(b"\n")
+            remainder = lines.pop()
+            for line in lines:
+                if len(line) > 0:
+                    yield line
+    remainder += decompressor.flush()
+    for line in remainder.split(b"\n"):
+        if len(line) > 0:
+            yield line
+
+
+def write_gzip_lines_to_file(chunks, filename, progress_bar=None):
+    """
+    Decompress a stream of gzip compressed chunks into a file of lines.
+
+    :param chunks: Iterable of chunks of a `.gz` file
+    :param filename: The file the decompressed lines are written to
+    :param progress_bar: Optional tqdm progress bar, which is updated with the
+    number of compressed bytes consumed
+    """
+    with open(filename, "wb") as lines_file:
+        for line in iter_gzip_lines(chunks, progress_bar=progress_bar):
+            lines_file.write(line + b"\n")
+
+
+def split_file_ranges(filename, num_ranges):
+    """
+    Split a file into byte ranges of about the same size, which start and end
+    at line boundaries.
+
+    :param filename: The file that should be split
+    :param num_ranges: The wanted number of ranges
+    :return: List of (start, end) tuples; fewer than num_ranges ranges are
+    returned if the file has not enough lines
+    """
+    filesize = os.path.getsize(filename)
+    if filesize == 0:
+        return []
+    boundaries = [0]
+    with open(filename, "rb") as lines_file:
+        for index in range(1, num_ranges):
+            position = filesize * index // num_ranges
+            if position <= boundaries[-1]:
+                continue
+            lines_file.seek(position - 1)
+            # Move the boundary to the start of the next line.
+            lines_file.readline()
+            position = lines_file.tell()
+            if position >= filesize:
+                break
+            if position > boundaries[-1]:
+                boundaries.append(position)
+    boundaries.append(filesize)
+    return [(boundaries[i], boundaries[i + 1])
+            for i in range(len(boundaries) - 1)]
+
+
+def iter_file_range_lines(filename, start, end):
+    """
+    Yield the lines in a byte range of a file by memory-mapping the file.
+
+    :param filename: The file containing the lines
+    :param start: The start of the range (the start of a line)
+    :param end: The end of the range (the start of a line or the file end)
+    :return: Generator of the non-empty lines (as bytes, without the line
+    break)
+    """
+    with open(filename, "rb") as lines_file:
+        with mmap.mmap(lines_file.fileno(), 0,
+                       access=mmap.ACCESS_READ) as mapped_file:
+            position = start
+            while position < end:
+                line_end = mapped_file.find(b"\n", position, end)
+                if line_end == -1:
+                    line_end = end
+                if line_end > position:
+                    yield mapped_file[position:line_end]
+                position = line_end + 1
+
+
+def indexed_gzip_available():
+    """
+    Check whether the optional indexed_gzip module, which provides random
+    access to `.gz` files, is installed.
+
+    :return: True if the module can be used
+    """
+    try:
+        import indexed_gzip
+    except ImportError:
+        return False
+    return True
+
+
+def build_gzip_index(gzip_filename, index_filename, spacing_mb):
+    """
+    Build a seek point index for a `.gz` file and store it in a file.
+
+    The index contains a checkpoint of the decompressor state every
+    spacing_mb megabytes of decompressed data. With it, the file can be
+    decompressed starting at any of these checkpoints instead of its start.
+
+    :param gzip_filename: Filename of the `.gz` archive
+    :param index_filename: Filename of the index that is created
+    :param spacing_mb: The distance between the checkpoints in megabytes
+    """
+    import indexed_gzip
+
+    start_time = datetime.now()
+    print(f"Building the seek point index of the .gz archive (start time: "
+          f"{start_time}).")
+    with indexed_gzip.IndexedGzipFile(gzip_filename,
+                                      spacing=spacing_mb * 1024 * 1024)\
+            as gz_file:
+        gz_file.build_full_index()
+        partial_index_filename = index_filename + ".part"
+        gz_file.export_index(partial_index_filename)
+    os.replace(partial_index_filename, index_filename)
+    end_time = datetime.now()
+    print(f"Building the index finished (end time: {end_time}).")
+    print(f"Duration of building the index: {end_time - start_time}.")
+
+
+def get_indexed_gzip_size(gzip_filename, index_filename):
+    """
+    Get the decompressed size of an indexed `.gz` file.
+
+    :param gzip_filename: Filename of the `.gz` archive
+    :param index_filename: Filename of the index of the archive
+    :return: The size of the decompressed content in bytes
+    """
+    import indexed_gzip
+
+    with indexed_gzip.IndexedGzipFile(gzip_filename,
+                                      index_file=index_filename) as gz_file:
+        return gz_file.seek(0, os.SEEK_END)
+
+
+def split_range(size, num_ranges):
+    """
+    Split the byte range [0, size) into ranges of about the same size.
+
+    :param size: The total size in bytes
+    :param num_ranges: The wanted number of ranges
+    :return: List of (start, end) tuples
+    """
+    boundaries = sorted(set(size * index // num_ranges
+                            for index in range(num_ranges + 1)))
+    return [(boundaries[i], boundaries[i + 1])
+            for i in range(len(boundaries) - 1)]
+
+
+def iter_indexed_gzip_range_lines(gzip_filename, index_filename, start, end):
+    """
+    Yield the lines of an indexed `.gz` file, which start in a byte range of
+    the decompressed content. Only the part of the archive between the
+    checkpoint before the range and the end of the range is decompressed.
+
+    :param gzip_filename: Filename of the `.gz` archive
+    :param index_filename: Filename of the index of the archive
+    :param start: The start of the range in the decompressed content
+    :param end: The end of the range in the decompressed content
+    :return: Generator of the non-empty lines (as bytes, without the line
+    break)
+    """
+    import indexed_gzip
+
+    with indexed_gzip.IndexedGzipFile(gzip_filename,
+                                      index_file=index_filename) as gz_file:
+        if start > 0:
+            # A line that started before the range belongs to the previous
+            # range.
+            gz_file.seek(start - 1)
+            gz_file.readline()
+        while gz_file.tell() < end:
+            line = gz_file.readline()
+            if len(line) == 0:
+                break
+            line = line.rstrip(b"\n")
+            if len(line) > 0:
+                yield line
+
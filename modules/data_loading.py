@@ -26,12 +26,16 @@ def load_publications():
     """Load the configured publication metadata.
 
     This function takes metadata file path from the configuration, loads the
-    data and return it.
+    data and return it. If the path is a columnar store directory (see
+    data_storing.write_columnar_store()), the store is memory-mapped and its
+    publications are decoded when they are accessed.
     """
 
     metadata_json = conf.config["dataset"]["metadata_json"]
     metadata_json = get_abspath(metadata_json)
 
+    if os.path.isdir(metadata_json):
+        return open_columnar_store(metadata_json)
     if not os.path.isfile(metadata_json):
         print("Metadata file does not exists. Exiting!")
         sys.exit(1)
@@ -41,6 +45,23 @@ def load_publications():
     return publications
 
 
+def open_columnar_store(directory):
+    """Open a columnar store of publications.
+
+    :param directory: The path of the store directory.
+    :return publications: The columnar_store object.
+    """
+
+    # The store needs numpy, which is only imported if a store is used.
+    import classes.columnar_store as columnar_store
+
+    manifest_name = columnar_store.columnar_store.manifest_name
+    if not os.path.isfile(os.path.join(directory, manifest_name)):
+        print(f"The directory {directory} is no columnar store. Exiting!")
+        sys.exit(1)
+    return columnar_store.columnar_store(directory)
+
+
 def load_targets():
     """Load the configured targets file.
 
@@ -68,6 +89,25 @@ def load_data():
     return publications, targets
 
 
+def load_taxonomy():
+    """Load the configured taxonomy file used by the hierarchical annotation.
+
+    The taxonomy is a map of group names to the list of their children, which
+    are targets or the names of other groups.
+    """
+
+    taxonomy_json = conf.config["annotation"]["taxonomy_json"]
+    taxonomy_json = get_abspath(taxonomy_json)
+
+    if not os.path.isfile(taxonomy_json):
+        print("Taxonomy file does not exists. Exiting!")
+        sys.exit(1)
+
+    with open(taxonomy_json, "r") as jsonfile:
+        taxonomy = json.load(jsonfile)
+    return taxonomy
+
+
 def load_annotated_metadata():
     """Load the configured annotated metadata file.
 
@@ -85,3 +125,141 @@ def load_annotated_metadata():
     with open(annotated_metadata_json, "r") as jsonfile:
         annotated_metadata = json.load(jsonfile)
     return annotated_metadata
+
+
+def iter_annotated_metadata(annotated_metadata_json=None,
+                            chunk_size=1024 * 1024):
+    """Read an annotated metadata file publication by publication.
+
+    The file may contain a JSON array of publications (as written by the
+    annotation) or one publication per line (JSONL). It is read in chunks, such
+    that only the current publication is kept in memory. Columnar store
+    directories are read publication by publication as well.
+
+    :param annotated_metadata_json: The path of the file or None for the
+    configured annotated metadata file.
+    :param chunk_size: The number of characters read at once.
+    :return publications: An iterator over the publications.
+    """
+
+    if annotated_metadata_json is None:
+        annotated_metadata_json = conf.config["dataset"]["annotated_json"]
+    annotated_metadata_json = get_abspath(annotated_metadata_json)
+
+    if os.path.isdir(annotated_metadata_json):
+        for publication in open_columnar_store(annotated_metadata_json):
+            yield dict(publication)
+        return
+    if not os.path.isfile(annotated_metadata_json):
+        print(f"Annotated metadata file {annotated_metadata_json} does not "
+              f"exists. Exiting!")
+        sys.exit(1)
+
+    decoder = json.JSONDecoder()
+    with open(annotated_metadata_json, "r", encoding="utf-8") as jsonfile:
+        buffer = jsonfile.read(chunk_size)
+        position = 0
+        end_of_file = len(buffer) == 0
+        in_array = None
+        while True:
+            # Skip the whitespace and separators between the publications.
+            while True:
+                while position < len(buffer) and\
+                        buffer[position] in " \t\r\n,":
+                    position += 1
+                if position < len(buffer) or end_of_file:
+                    break
+                buffer = jsonfile.read(chunk_size)
+                position = 0
+                end_of_file = len(buffer) == 0
+
+            if position >= len(buffer):
+                break
+            if in_array is None:
+                in_array = buffer[position] == "["
+                if in_array:
+                    position += 1
+                continue
+            if in_array and buffer[position] == "]":
+                break
+
+            try:
+                publication, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if end_of_file:
+                    print(f"The annotated metadata file "
+                          f"{annotated_metadata_json} is corrupted. Exiting!")
+                    sys.exit(1)
+                # The publication continues in the next chunk.
+                chunk = jsonfile.read(chunk_size)
+                buffer = buffer[position:] + chunk
+                position = 0
+                end_of_file = len(chunk) == 0
+                continue
+            yield publication
+            position = end
+
+
+def get_publication_id(publication, position, id_index):
+    """Get a stable id of a publication.
+
+    The id is taken from the configured id field of the publication. If the
+    publication has no such field, its position in the metadata is used.
+
+    :param publication: The map representing the publication.
+    :param position: The position of the publication in the metadata.
+    :param id_index: The index name of the id in the publications.
+    :return publication_id: The id of the publication.
+    """
+
+    if id_index in publication:
+        return publication[id_index]
+    return position
+
+
+def load_annotation_journal(journal_jsonl):
+    """Load the journal of an annotation run.
+
+    The journal is a .jsonl file with one entry per annotated publication,
+    which contains the publication id, its annotation and optionally the cost
+    of the annotation. If the run was
+    interrupted while writing an entry, the incomplete last line is ignored
+    (see also remove_incomplete_journal_entry()).
+
+    :param journal_jsonl: The path of the journal file.
+    :return journal: The map of publication ids to their journal entry.
+    """
+
+    journal = {}
+    with open(journal_jsonl, "r", encoding="utf-8") as jsonlfile:
+        lines = jsonlfile.readlines()
+
+    for index in range(len(lines)):
+        try:
+            journal_entry = json.loads(lines[index])
+        except json.JSONDecodeError:
+            if index == len(lines) - 1:
+                break
+            print(f"The line {index + 1} of the journal file {journal_jsonl} "
+                  f"is corrupted. Exiting!")
+            sys.exit(1)
+        journal[journal_entry["id"]] = journal_entry
+
+    return journal
+
+
+def remove_incomplete_journal_entry(journal_jsonl):
+    """Remove an incomplete last line from the journal of an annotation run.
+
+    If a run was interrupted while writing an entry, the journal ends with an
+    incomplete line. This line is removed, such that new entries can be
+    appended to the journal.
+
+    :param journal_jsonl: The path of the journal file.
+    """
+
+    with open(journal_jsonl, "rb+") as jsonlfile:
+        content = jsonlfile.read()
+        if len(content) == 0 or content.endswith(b"\n"):
+            return
+        jsonlfile.truncate(content.rfind(b"\n") + 1)
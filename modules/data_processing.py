@@ -1,7 +1,13 @@
 import sys
+import re
+import json
+import random
+import multiprocessing
 
 
-import modules.configuration as conf
+import numpy as np
+import scipy.sparse
+
 import modules.data_processing as dp
 
 
@@ -17,15 +23,16 @@ def build_canonical_target_form(string):
     return string
 
 
-def build_canonical_targets_map(targets):
+def build_canonical_targets_map(targets, settings):
     """Build a map that maps the canonical representation of a target to its
     original form.
 
     :param targets: A list of targets for which the map should be constructed.
+    :param settings: The settings built by configuration.build_settings().
     :return targets_map: The constructed map.
     """
 
-    target_name = conf.config["prompt"]["target_name"]
+    target_name = settings["prompt"]["target_name"]
     targets_map = {}
 
     for target in targets:
@@ -39,3 +46,667 @@ def build_canonical_targets_map(targets):
         targets_map[canonical_target] = target
 
     return targets_map
+
+
+def extract_lexical_features(text):
+    """Extract the features of a text used by the lexical pre-filter, which
+    are the character trigrams of its words. Trigrams also match different
+    forms of a word (e.g. "security" and "secure").
+
+    :param text: The text.
+    :return features: The list of features (with repetitions).
+    """
+
+    features = []
+    for word in re.findall(r"\w+", text.lower()):
+        padded_word = " " + word + " "
+        for index in range(len(padded_word) - 2):
+            features.append(padded_word[index:index + 3])
+    return features
+
+
+def build_tfidf_matrix(texts, vocabulary, idf):
+    """Build the TF-IDF vectors of texts as rows of a sparse matrix. Features
+    that are not contained in the vocabulary are ignored.
+
+    :param texts: The list of texts.
+    :param vocabulary: The map of features to their column.
+    :param idf: The inverse document frequency of every column.
+    :return matrix: The L2 normalized TF-IDF matrix.
+    """
+
+    indptr = [0]
+    indices = []
+    counts = []
+    for text in texts:
+        text_counts = {}
+        for feature in extract_lexical_features(text):
+            column = vocabulary.get(feature)
+            if column is not None:
+                text_counts[column] = text_counts.get(column, 0) + 1
+        indices.extend(text_counts.keys())
+        counts.extend(text_counts.values())
+        indptr.append(len(indices))
+
+    indices = np.array(indices, dtype=np.int64)
+    counts = np.array(counts, dtype=np.float64)
+    data = (1 + np.log(counts)) * idf[indices]
+    matrix = scipy.sparse.csr_matrix((data, indices, indptr),
+                                     shape=(len(texts), len(vocabulary)))
+
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return scipy.sparse.diags(1 / norms) @ matrix
+
+
+def build_target_index(targets, documents):
+    """Build the TF-IDF index of the targets used by the lexical pre-filter.
+
+    The vocabulary consists of the features of the targets, the document
+    frequencies are counted over the documents and the targets.
+
+    :param targets: The list of targets.
+    :param documents: The list of all documents that are annotated.
+    :return target_index: A map containing the targets, the vocabulary, the
+    inverse document frequencies and the TF-IDF matrix of the targets.
+    """
+
+    vocabulary = {}
+    for target in targets:
+        for feature in extract_lexical_features(target):
+            if feature not in vocabulary:
+                vocabulary[feature] = len(vocabulary)
+
+    document_frequency = np.zeros(len(vocabulary), dtype=np.float64)
+    for text in documents + targets:
+        columns = set()
+        for feature in extract_lexical_features(text):
+            column = vocabulary.get(feature)
+            if column is not None:
+                columns.add(column)
+        document_frequency[list(columns)] += 1
+
+    num_texts = len(documents) + len(targets)
+    idf = np.log((1 + num_texts) / (1 + document_frequency)) + 1
+
+    return {"targets": list(targets),
+            "vocabulary": vocabulary,
+            "idf": idf,
+            "matrix": build_tfidf_matrix(targets, vocabulary, idf)}
+
+
+def shortlist_targets(target_index, documents, shortlist_size,
+                      batch_size=1024):
+    """Select the targets with the most similar TF-IDF vectors for every
+    document. The documents are scored in batches with one sparse matrix
+    product per batch.
+
+    :param target_index: The index built by build_target_index().
+    :param documents: The list of documents.
+    :param shortlist_size: The number of targets kept per document.
+    :param batch_size: The number of documents scored at once.
+    :return shortlists: The list of selected targets for every document. The
+    targets keep the order of the targets list.
+    """
+
+    targets = target_index["targets"]
+    shortlist_size = min(shortlist_size, len(targets))
+    target_matrix_transposed = target_index["matrix"].T.tocsc()
+
+    shortlists = []
+    for start in range(0, len(documents), batch_size):
+        document_matrix = build_tfidf_matrix(
+            documents[start:start + batch_size],
+            target_index["vocabulary"],
+            target_index["idf"])
+        scores = (document_matrix @ target_matrix_transposed).toarray()
+        # The stable sort prefers earlier targets if the scores are equal.
+        selected = np.argsort(-scores, axis=1,
+                              kind="stable")[:, :shortlist_size]
+        selected.sort(axis=1)
+        for row in selected:
+            shortlists.append([targets[column] for column in row])
+
+    return shortlists
+
+
+def normalize_document(document):
+    """Normalize a document for the deduplication, such that documents that
+    only differ in case, punctuation or whitespace are equal.
+
+    :param document: The document.
+    :return document: The words of the document in lower case, separated by
+    single spaces.
+    """
+
+    return " ".join(re.findall(r"\w+", document.lower()))
+
+
+def build_minhash_signatures(documents, shingle_size, num_permutations,
+                             chunk_size=512):
+    """Build the MinHash signatures of the character shingles of documents.
+
+    Every shingle is hashed from the code points of its characters and every
+    permutation is simulated by a random multiply-shift hash function, i.e.
+    the upper 32 bits of a random linear function modulo 2^64. The functions
+    are drawn with a fixed seed, such that the signatures do not differ
+    between runs. The documents are processed in chunks, whose
+    shingles are hashed at once.
+
+    :param documents: The list of normalized documents.
+    :param shingle_size: The number of characters of a shingle. Documents
+    with fewer characters form a single shingle.
+    :param num_permutations: The length of the signatures.
+    :param chunk_size: The number of documents processed at once.
+    :return signatures: The matrix of signatures with one row per document.
+    """
+
+    rng = np.random.default_rng(0)
+    factors = rng.integers(1, 2 ** 63, num_permutations, dtype=np.uint64) | 1
+    offsets = rng.integers(0, 2 ** 63, num_permutations, dtype=np.uint64)
+    # The powers of an odd base combine the code points of a shingle.
+    powers = rng.integers(1, 2 ** 63, shingle_size, dtype=np.uint64) | 1
+
+    signatures = np.empty((len(documents), num_permutations), dtype=np.uint64)
+    for chunk_start in range(0, len(documents), chunk_size):
+        chunk = documents[chunk_start:chunk_start + chunk_size]
+        # Every document is followed by shingle_size zeros, such that no
+        # shingle spans two documents and short documents form one shingle.
+        code_points = np.frombuffer(
+            "".join(document + "\0" * shingle_size
+                    for document in chunk).encode("utf-32-le"),
+            dtype=np.uint32).astype(np.uint64)
+        windows = np.lib.stride_tricks.sliding_window_view(code_points,
+                                                           shingle_size)
+        lengths = np.array([max(1, len(document) - shingle_size + 1)
+                            for document in chunk])
+        document_starts = np.concatenate(
+            ([0], np.cumsum([len(document) + shingle_size
+                             for document in chunk])[:-1]))
+        window_starts = np.repeat(document_starts, lengths)\
+            + np.arange(lengths.sum())\
+            - np.repeat(np.cumsum(lengths) - lengths, lengths)
+
+        # The multiplication overflows on purpose, the upper and lower half
+        # of the result are folded into a 32 bit hash.
+        hashes = (windows[window_starts] * powers).sum(axis=1)
+        hashes = (hashes >> np.uint64(32)) ^ (hashes & np.uint64(2 ** 32 - 1))
+        values = (factors[:, None] * hashes[None, :] + offsets[:, None])\
+            >> np.uint64(32)
+        signatures[chunk_start:chunk_start + len(chunk)] =\
+            np.minimum.reduceat(values, np.cumsum(lengths) - lengths,
+                                axis=1).T
+    return signatures
+
+
+def group_duplicate_documents(documents, near_duplicates=False, threshold=0.8,
+                              shingle_size=5, num_permutations=128,
+                              num_bands=16):
+    """Group documents that are equal after normalization and optionally
+    documents that are near duplicates of each other.
+
+    The first document of every group is its representative. Near duplicates
+    are found with locality-sensitive hashing: documents whose MinHash
+    signatures agree in all rows of a band are candidates, and a candidate
+    representative is chosen if the share of equal signature entries (the
+    estimated Jaccard similarity of the shingles) reaches the threshold.
+    Documents are only compared with representatives, such that the members
+    of a group are similar to the representative and not just to each other.
+
+    :param documents: The list of documents.
+    :param near_duplicates: Whether near duplicates should be grouped.
+    :param threshold: The minimum estimated Jaccard similarity of near
+    duplicates.
+    :param shingle_size: The number of characters of a shingle.
+    :param num_permutations: The length of the MinHash signatures.
+    :param num_bands: The number of bands of the signatures, which must
+    divide num_permutations.
+    :return representatives: The index of the representative of every
+    document, which is the index of the document itself for representatives.
+    """
+
+    normalized_documents = [dp.normalize_document(document)
+                            for document in documents]
+    representatives = []
+    exact_representatives = {}
+    for index in range(len(documents)):
+        representatives.append(exact_representatives.setdefault(
+            normalized_documents[index], index))
+    if not near_duplicates:
+        return representatives
+
+    candidate_indices = [index for index in range(len(documents))
+                         if representatives[index] == index]
+    signatures = dp.build_minhash_signatures(
+        [normalized_documents[index] for index in candidate_indices],
+        shingle_size,
+        num_permutations)
+    # Every band of a signature is reduced to one number. Equal numbers of
+    # different bands are only candidates, which are compared afterwards.
+    rows = num_permutations // num_bands
+    weights = np.random.default_rng(1).integers(1, 2 ** 63, rows,
+                                                dtype=np.uint64) | 1
+    band_keys = (signatures.reshape(len(candidate_indices), num_bands, rows)
+                 * weights).sum(axis=2).tolist()
+
+    buckets = [{} for band in range(num_bands)]
+    representative_rows = {}
+    for row in range(len(candidate_indices)):
+        keys = band_keys[row]
+        candidates = set()
+        for band in range(num_bands):
+            bucket = buckets[band].get(keys[band])
+            if bucket is not None:
+                candidates.update(bucket)
+
+        # The earliest similar representative is chosen.
+        chosen = None
+        for candidate in sorted(candidates):
+            similarity = np.count_nonzero(
+                signatures[representative_rows[candidate]] == signatures[row])\
+                / num_permutations
+            if similarity >= threshold:
+                chosen = candidate
+                break
+
+        index = candidate_indices[row]
+        if chosen is None:
+            representative_rows[index] = row
+            for band in range(num_bands):
+                buckets[band].setdefault(keys[band], []).append(index)
+        else:
+            representatives[index] = chosen
+
+    # Exact duplicates follow their representative into its group.
+    for index in range(len(documents)):
+        representatives[index] = representatives[representatives[index]]
+    return representatives
+
+
+def cluster_target_vectors(vectors, num_clusters, iterations=10):
+    """Cluster the rows of a normalized TF-IDF matrix with spherical k-means.
+
+    The initial centers are chosen deterministically: the first row and then
+    repeatedly the row least similar to all chosen centers.
+
+    :param vectors: The sparse matrix with one row per target.
+    :param num_clusters: The number of clusters (smaller than the number of
+    rows).
+    :param iterations: The number of k-means iterations.
+    :return clusters: The list of clusters, each a list of row numbers. Empty
+    clusters are left out.
+    """
+
+    num_rows = vectors.shape[0]
+    center_rows = [0]
+    similarities = (vectors @ vectors[0].T).toarray().ravel()
+    while len(center_rows) < num_clusters:
+        similarities[center_rows] = np.inf
+        row = int(np.argmin(similarities))
+        center_rows.append(row)
+        similarities = np.maximum(
+            similarities,
+            (vectors @ vectors[row].T).toarray().ravel())
+    centers = vectors[center_rows].toarray()
+
+    assignment = np.zeros(num_rows, dtype=np.int64)
+    for iteration in range(iterations):
+        new_assignment = np.asarray(np.argmax(vectors @ centers.T, axis=1))
+        new_assignment = new_assignment.ravel()
+        if iteration > 0 and np.array_equal(new_assignment, assignment):
+            break
+        assignment = new_assignment
+        membership = scipy.sparse.csr_matrix(
+            (np.ones(num_rows), (assignment, np.arange(num_rows))),
+            shape=(num_clusters, num_rows))
+        sums = (membership @ vectors).toarray()
+        norms = np.linalg.norm(sums, axis=1)
+        # Empty clusters keep their previous center.
+        filled = norms > 0
+        centers[filled] = sums[filled] / norms[filled][:, np.newaxis]
+
+    clusters = []
+    for cluster in range(num_clusters):
+        rows = np.flatnonzero(assignment == cluster).tolist()
+        if len(rows) > 0:
+            clusters.append(rows)
+    return clusters
+
+
+def build_target_tree_node(targets, vectors, group_size):
+    """Build the children of a node of the target tree by clustering the
+    given targets recursively (see build_target_tree()).
+
+    :param targets: The list of targets below the node.
+    :param vectors: The TF-IDF matrix of the targets.
+    :param group_size: The maximum number of children of a node.
+    :return children: The list of child nodes.
+    """
+
+    if len(targets) <= group_size:
+        return [{"label": target, "target": target, "children": None}
+                for target in targets]
+
+    clusters = cluster_target_vectors(vectors, group_size)
+    if len(clusters) < 2:
+        # The targets are lexically indistinguishable, so they are split in
+        # contiguous parts.
+        part_size = -(-len(targets) // group_size)
+        clusters = [list(range(start, min(start + part_size, len(targets))))
+                    for start in range(0, len(targets), part_size)]
+
+    children = []
+    for rows in clusters:
+        if len(rows) == 1:
+            children.append({"label": targets[rows[0]],
+                             "target": targets[rows[0]],
+                             "children": None})
+            continue
+        cluster_vectors = vectors[rows]
+        # The group is represented by its most central target.
+        centroid = np.asarray(cluster_vectors.sum(axis=0)).ravel()
+        central_row = int(np.argmax(cluster_vectors @ centroid))
+        cluster_targets = [targets[row] for row in rows]
+        children.append({"label": cluster_targets[central_row],
+                         "target": cluster_targets[central_row],
+                         "children": build_target_tree_node(cluster_targets,
+                                                            cluster_vectors,
+                                                            group_size)})
+    return children
+
+
+def build_target_tree(targets, group_size):
+    """Build a tree of the targets by clustering their TF-IDF vectors.
+
+    Every group of lexically similar targets is labeled with its most central
+    target, so the LLM chooses between targets in every round of the
+    hierarchical annotation.
+
+    :param targets: The list of targets.
+    :param group_size: The maximum number of children of a node.
+    :return target_tree: The root node. Every node is a map with the label
+    presented to the LLM, the represented target and the list of children
+    (None for leaves).
+    """
+
+    target_index = build_target_index(targets, [])
+    return {"label": None,
+            "target": None,
+            "children": build_target_tree_node(list(targets),
+                                               target_index["matrix"],
+                                               group_size)}
+
+
+def build_taxonomy_tree(taxonomy, targets):
+    """Build a tree of the targets from a taxonomy. Targets that are not
+    contained in the taxonomy are added to the root node. A target (or group)
+    may be the child of multiple groups, but groups must not have the name of
+    a target or of another group.
+
+    :param taxonomy: The map of group names to their children.
+    :param targets: The list of targets.
+    :return target_tree: The root node (see build_target_tree()).
+    """
+
+    # A group and a target (or two groups) with the same label could be
+    # presented to the LLM at the same time, which could not tell them apart.
+    canonical_targets = {dp.build_canonical_target_form(target)
+                         for target in targets}
+    canonical_names = {}
+    for name in taxonomy.keys():
+        canonical_name = dp.build_canonical_target_form(name)
+        if canonical_name in canonical_targets:
+            print(f"The group \"{name}\" in the taxonomy has the name of a "
+                  f"target. Exiting!")
+            sys.exit(1)
+        if canonical_name in canonical_names:
+            print(f"The groups \"{name}\" and "
+                  f"\"{canonical_names[canonical_name]}\" in the taxonomy "
+                  f"have the same name. Exiting!")
+            sys.exit(1)
+        canonical_names[canonical_name] = name
+
+    targets_set = set(targets)
+    child_names = set()
+    for name, children in taxonomy.items():
+        for child in children:
+            if child not in taxonomy and child not in targets_set:
+                print(f"The child \"{child}\" of the group \"{name}\" in "
+                      f"the taxonomy is neither a group nor a target. "
+                      f"Exiting!")
+                sys.exit(1)
+            child_names.add(child)
+
+    covered_targets = set()
+
+    def build_group_node(name, path):
+        if name in path:
+            print(f"The taxonomy contains a cycle at the group \"{name}\". "
+                  f"Exiting!")
+            sys.exit(1)
+        children = []
+        for child in taxonomy[name]:
+            if child in taxonomy:
+                children.append(build_group_node(child, path + [name]))
+            else:
+                covered_targets.add(child)
+                children.append({"label": child, "target": child,
+                                 "children": None})
+        return {"label": name, "target": None, "children": children}
+
+    root_children = []
+    for name in taxonomy.keys():
+        if name not in child_names:
+            root_children.append(build_group_node(name, []))
+    for target in targets:
+        if target not in covered_targets:
+            root_children.append({"label": target, "target": target,
+                                  "children": None})
+    return {"label": None, "target": None, "children": root_children}
+
+
+def deduplicate_tree_nodes(nodes):
+    """Remove the nodes of a target tree whose label equals the label of an
+    earlier node in canonical form, e.g. a target that is the child of
+    multiple groups of a taxonomy, which were all chosen.
+
+    :param nodes: The list of nodes.
+    :return nodes: The list of nodes with unique labels in the given order.
+    """
+
+    unique_nodes = {}
+    for node in nodes:
+        unique_nodes.setdefault(dp.build_canonical_target_form(node["label"]),
+                                node)
+    return list(unique_nodes.values())
+
+
+def collect_tree_labels(node):
+    """Collect the labels of all nodes below a node of a target tree.
+
+    :param node: The node.
+    :return labels: The list of labels.
+    """
+
+    labels = []
+    for child in node["children"]:
+        labels.append(child["label"])
+        if child["children"] is not None:
+            labels.extend(collect_tree_labels(child))
+    return labels
+
+
+# Matches the corpus ids in a raw line of the D3 dataset without parsing it.
+d3_corpusid_pattern = re.compile(rb'"corpusid"\s*:\s*(\d+)')
+
+
+def may_contain_d3_id(line, id_set):
+    """Check cheaply whether a raw line of the D3 dataset may contain a
+    publication with one of the given ids.
+
+    :param line: The line of the .jsonl file (as bytes).
+    :param id_set: The set of wanted corpus ids.
+    :return: False if the line certainly contains none of the ids.
+    """
+
+    corpusids = d3_corpusid_pattern.findall(line)
+    if len(corpusids) == 0:
+        # The id is formatted in an unexpected way, the line must be parsed.
+        return True
+    for corpusid in corpusids:
+        if int(corpusid) in id_set:
+            return True
+    return False
+
+
+def select_d3_publication(line, subjects, id_set=None):
+    """Parse a line of the D3 dataset and return the publication if it should
+    be part of the example dataset.
+
+    :param line: The line of the .jsonl file (as bytes).
+    :param subjects: The list of subjects that are used as targets.
+    :param id_set: The set of wanted corpus ids or None if all ids are
+    wanted.
+    :return publication_metadata: The map representing the publication or
+    None if the publication is not used.
+    """
+
+    if id_set is not None and not may_contain_d3_id(line, id_set):
+        return None
+    publication_metadata = dp.parse_d3_publication(line, subjects)
+    if publication_metadata is None:
+        return None
+    if id_set is not None and publication_metadata["D3 ID"] not in id_set:
+        return None
+    return publication_metadata
+
+
+def select_d3_publications_in_range(task):
+    """Select the publications of the D3 dataset in a byte range of the
+    decompressed .jsonl data.
+
+    :param task: A tuple of the function that yields the lines of a range,
+    its arguments, the list of subjects and the set of wanted ids (or None).
+    :return publications: The list of selected publications in file order.
+    """
+
+    range_reader, range_arguments, subjects, id_set = task
+    publications = []
+    for line in range_reader(*range_arguments):
+        publication_metadata = dp.select_d3_publication(line, subjects,
+                                                        id_set)
+        if publication_metadata is not None:
+            publications.append(publication_metadata)
+    return publications
+
+
+def select_d3_publications_parallel(range_reader, ranges_arguments, subjects,
+                                    id_set, processes):
+    """Select the publications of the decompressed D3 dataset with multiple
+    processes.
+
+    The data is split into line-aligned byte ranges, which are parsed by a
+    pool of processes. The results are merged in the order of the ranges, so
+    the publications are returned in the same order as a sequential pass over
+    the data would return them.
+
+    :param range_reader: The function that yields the lines of a range, e.g.
+    data_fetching.iter_file_range_lines().
+    :param ranges_arguments: The list of the arguments of range_reader for
+    every range in the order of the ranges.
+    :param subjects: The list of subjects that are used as targets.
+    :param id_set: The set of wanted corpus ids or None if all ids are
+    wanted.
+    :param processes: The number of processes.
+    :return publications: The list of selected publications in file order.
+    """
+
+    tasks = [(range_reader, range_arguments, subjects, id_set)
+             for range_arguments in ranges_arguments]
+
+    publications = []
+    with multiprocessing.Pool(processes) as pool:
+        for range_publications in pool.imap(select_d3_publications_in_range,
+                                            tasks):
+            publications.extend(range_publications)
+    return publications
+
+
+def reservoir_sample(items, sample_size, seed):
+    """Draw a uniform random sample from a stream of items, whose length is
+    not known in advance, while keeping only the sample in memory.
+
+    :param items: The iterable of items.
+    :param sample_size: The number of items that should be drawn.
+    :param seed: The seed of the random number generator.
+    :return sample: The list of drawn items.
+    :return num_items: The total number of items in the stream.
+    """
+
+    generator = random.Random(seed)
+    sample = []
+    num_items = 0
+    for item in items:
+        num_items += 1
+        if len(sample) < sample_size:
+            sample.append(item)
+        else:
+            index = generator.randrange(num_items)
+            if index < sample_size:
+                sample[index] = item
+    return sample, num_items
+
+
+def parse_d3_publication(line, subjects):
+    """Parse a line of the papers part of the D3 dataset and extract the
+    publication metadata used by the tool.
+
+    A publication is only used if it has an id, a title, an abstract and at
+    least one of the given subjects among its cso concepts (the dataset fields
+    syntactic, semantic, union and enhanced).
+
+    :param line: The line of the .jsonl file (as string or bytes).
+    :param subjects: The list of subjects that are used as targets.
+    :return publication_metadata: The map representing the publication or
+    None if the publication is not used.
+    """
+
+    line_data = json.loads(line)
+
+    line_corpusid = None
+    line_title = None
+    line_abstract = None
+    line_cso_concepts_set = set()
+
+    if "corpusid" in line_data.keys():
+        line_corpusid = line_data["corpusid"]
+    if "title" in line_data.keys():
+        line_title = line_data["title"]
+    if "abstract" in line_data.keys():
+        line_abstract = line_data["abstract"]
+    if "syntactic" in line_data.keys():
+        for cso_concept in line_data["syntactic"]:
+            line_cso_concepts_set.add(cso_concept)
+    if "semantic" in line_data.keys():
+        for cso_concept in line_data["semantic"]:
+            line_cso_concepts_set.add(cso_concept)
+    if "union" in line_data.keys():
+        for cso_concept in line_data["union"]:
+            line_cso_concepts_set.add(cso_concept)
+    if "enhanced" in line_data.keys():
+        for cso_concept in line_data["enhanced"]:
+            line_cso_concepts_set.add(cso_concept)
+    line_subjects = []
+    for subject in subjects:
+        if subject in line_cso_concepts_set:
+            line_subjects.append(subject)
+
+    if len(line_subjects) > 0 and line_title is not None\
+            and line_abstract is not None\
+            and line_corpusid is not None:
+        publication_metadata = {"D3 ID": line_corpusid,
+                                "title": line_title,
+                                "abstract": line_abstract,
+                                "subjects": line_subjects}
+        return publication_metadata
+    return None
@@ -0,0 +1,204 @@
+import os
+import sys
+import json
+import array
+import shutil
+
+
+import numpy as np
+
+
+import classes.columnar_store as columnar_store
+
+
+def write_publications_json(publications, filename):
+    """Save publications as a JSON array, one publication after another.
+
+    The result equals json.dump(publications, jsonfile, indent=2), but the
+    publications are not needed as a list. Publications of a columnar store
+    are decoded one at a time.
+
+    :param publications: An iterable over the publications.
+    :param filename: The path of the file.
+    """
+
+    with open(filename, "w", encoding="utf-8") as jsonfile:
+        jsonfile.write("[")
+        separator = "\n"
+        for publication in publications:
+            lines = json.dumps(dict(publication), indent=2).split("\n")
+            jsonfile.write(separator + "  " + "\n  ".join(lines))
+            separator = ",\n"
+        if separator != "\n":
+            jsonfile.write("\n")
+        jsonfile.write("]")
+
+
+def get_value_type(value, target_indices):
+    """Determine the column type of a field value of a publication.
+
+    :param value: The value.
+    :param target_indices: The map of targets to their position.
+    :return value_type: "text" for strings, "integer" for integers,
+    "targets" for lists of targets in the order of the targets list and
+    "json" for all other values.
+    """
+
+    if isinstance(value, str):
+        return "text"
+    if isinstance(value, int) and not isinstance(value, bool)\
+            and -2 ** 63 <= value < 2 ** 63:
+        return "integer"
+    if isinstance(value, list) and len(target_indices) > 0:
+        last_index = -1
+        for target in value:
+            if not isinstance(target, str) or target not in target_indices:
+                return "json"
+            # Bitsets keep neither the order nor duplicates of the targets.
+            if target_indices[target] <= last_index:
+                return "json"
+            last_index = target_indices[target]
+        return "targets"
+    return "json"
+
+
+def detect_fields(publications, target_indices):
+    """Determine the fields of the publications and their column types.
+
+    :param publications: An iterable over the publications.
+    :param target_indices: The map of targets to their position.
+    :return count: The number of publications.
+    :return fields: The list of fields in the order of their first
+    occurrence, each a map with the name, the type and whether some
+    publications lack the field.
+    """
+
+    count = 0
+    field_types = {}
+    field_counts = {}
+    for publication in publications:
+        count += 1
+        for name, value in publication.items():
+            value_type = get_value_type(value, target_indices)
+            if name not in field_types:
+                field_types[name] = value_type
+                field_counts[name] = 0
+            elif field_types[name] != value_type:
+                field_types[name] = "json"
+            field_counts[name] += 1
+
+    fields = []
+    for name in field_types:
+        fields.append({"name": name,
+                       "type": field_types[name],
+                       "optional": field_counts[name] < count})
+    return count, fields
+
+
+def write_columnar_store(open_publications, targets, directory):
+    """Save publications in a columnar store (see classes/columnar_store.py).
+
+    Every field of the publications is saved as a column. Texts are
+    concatenated into one UTF-8 file together with an array of their offsets,
+    integers are saved as an array and lists of targets are saved as one
+    bitset over the targets per publication. All other values are saved as
+    JSON texts. The publications are read twice, once to determine the
+    columns and once to write them, such that they do not need to fit into
+    memory.
+
+    :param open_publications: A function without arguments returning an
+    iterator over the publications.
+    :param targets: The list of targets, over which lists of targets are
+    saved as bitsets.
+    :param directory: The path of the directory of the store, which must not
+    exist.
+    """
+
+    if os.path.exists(directory):
+        print(f"Error: The path {directory} already exists. Please move it "
+              f"in order to create a new columnar store. Exiting!")
+        sys.exit(1)
+
+    target_indices = {}
+    for target in targets:
+        target_indices.setdefault(target, len(target_indices))
+    count, fields = detect_fields(open_publications(), target_indices)
+
+    # The store is written into a temporary directory, such that an
+    # interrupted run does not leave an incomplete store.
+    temporary_directory = directory + ".tmp"
+    if os.path.exists(temporary_directory):
+        shutil.rmtree(temporary_directory)
+    os.makedirs(temporary_directory, 0o775)
+
+    def get_path(index, suffix):
+        return os.path.join(temporary_directory, f"field_{index}.{suffix}")
+
+    columns = []
+    for index in range(len(fields)):
+        field = fields[index]
+        column = {"present": None}
+        if field["optional"]:
+            column["present"] = np.lib.format.open_memmap(
+                get_path(index, "present.npy"), mode="w+", dtype=np.bool_,
+                shape=(count,))
+        if field["type"] == "integer":
+            column["values"] = np.lib.format.open_memmap(
+                get_path(index, "values.npy"), mode="w+", dtype=np.int64,
+                shape=(count,))
+        elif field["type"] == "targets":
+            column["bits"] = np.lib.format.open_memmap(
+                get_path(index, "bits.npy"), mode="w+", dtype=np.uint8,
+                shape=(count, (len(target_indices) + 7) // 8))
+        else:
+            column["offsets"] = array.array("q", [0])
+            column["blob"] = open(get_path(index, "blob"), "wb")
+        columns.append(column)
+
+    position = 0
+    for publication in open_publications():
+        for index in range(len(fields)):
+            field = fields[index]
+            column = columns[index]
+            present = field["name"] in publication
+            if column["present"] is not None:
+                column["present"][position] = present
+
+            if field["type"] == "integer":
+                if present:
+                    column["values"][position] = publication[field["name"]]
+            elif field["type"] == "targets":
+                if present:
+                    bits = np.zeros(len(target_indices), dtype=np.uint8)
+                    for target in publication[field["name"]]:
+                        bits[target_indices[target]] = 1
+                    column["bits"][position] = np.packbits(bits)
+            else:
+                if present:
+                    value = publication[field["name"]]
+                    if field["type"] != "text":
+                        value = json.dumps(value, ensure_ascii=False)
+                    column["blob"].write(value.encode("utf-8"))
+                column["offsets"].append(column["blob"].tell())
+        position += 1
+
+    for index in range(len(fields)):
+        column = columns[index]
+        for name in ["present", "values", "bits"]:
+            if name in column and column[name] is not None:
+                column[name].flush()
+        if "blob" in column:
+            column["blob"].close()
+            np.save(get_path(index, "offsets.npy"),
+                    np.frombuffer(column["offsets"], dtype=np.int64))
+    del columns
+
+    manifest = {"version": 1,
+                "count": count,
+                "targets": list(target_indices),
+                "fields": fields}
+    manifest_path = os.path.join(temporary_directory,
+                                 columnar_store.columnar_store.manifest_name)
+    with open(manifest_path, "w", encoding="utf-8") as jsonfile:
+        json.dump(manifest, jsonfile, indent=2)
+    os.replace(temporary_directory, directory)
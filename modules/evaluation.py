@@ -1,3 +1,13 @@
+import itertools
+
+
+import numpy as np
+import scipy.sparse as sparse
+
+
+import modules.data_loading as dl
+
+
 def build_targets_count_stats(annotated_metadata,
                               publication_annotation_index):
     """Compute statistics about the number of targets in the annotated data
@@ -86,3 +96,523 @@ def build_matching_targets_count_stats(annotated_metadata,
     avg_value = value_sum / publication_count
 
     return avg_value, min_value, max_value
+
+
+def build_shortlist_recall(publications, shortlists,
+                           publication_evaluation_data_index):
+    """Count how many targets of the evaluation data are contained in the
+    shortlists of the lexical pre-filter. Targets that are not in a shortlist
+    cannot be annotated by the LLM.
+
+    :param publications: The list of publications.
+    :param shortlists: The list of selected targets for every publication.
+    :param publication_evaluation_data_index: The index name of the evaluation
+    data in the publications.
+    :return found_count: The number of targets of the evaluation data that are
+    contained in the shortlists.
+    :return total_count: The number of targets of the evaluation data.
+    """
+
+    found_count = 0
+    total_count = 0
+    for publication, shortlist in zip(publications, shortlists):
+        shortlist_set = set(shortlist)
+        for target in publication[publication_evaluation_data_index]:
+            if target in shortlist_set:
+                found_count += 1
+            total_count += 1
+
+    return found_count, total_count
+
+
+def build_target_matrix(target_lists, target_indices):
+    """Encode lists of targets as a sparse matrix with one row per list and one
+    column per target, which contains a 1 for every target in a list.
+
+    :param target_lists: The list of target lists.
+    :param target_indices: The map of targets to their column. Targets, that
+    are not contained in the map, are added to it.
+    :return matrix: The sparse matrix.
+    """
+
+    all_targets = list(itertools.chain.from_iterable(target_lists))
+    indices = list(map(target_indices.get, all_targets))
+    if None in indices:
+        for target in all_targets:
+            target_indices.setdefault(target, len(target_indices))
+        indices = list(map(target_indices.get, all_targets))
+    indptr = np.zeros(len(target_lists) + 1, dtype=np.int64)
+    np.cumsum(list(map(len, target_lists)), out=indptr[1:])
+
+    matrix = sparse.csr_matrix((np.ones(len(indices), dtype=np.int64),
+                                np.array(indices, dtype=np.int64),
+                                indptr),
+                               shape=(len(target_lists),
+                                      len(target_indices)))
+    # A target that is listed more than once only counts once.
+    matrix.sum_duplicates()
+    matrix.data[:] = 1
+    return matrix
+
+
+def add_count_stats(count_stats, counts):
+    """Add the counts of a chunk of publications to the sum, the minimum and
+    the maximum of all counts.
+
+    :param count_stats: The list of the sum, the minimum and the maximum.
+    :param counts: The array of counts.
+    """
+
+    count_stats[0] += int(counts.sum())
+    if count_stats[1] is None:
+        count_stats[1] = int(counts.min())
+        count_stats[2] = int(counts.max())
+    else:
+        count_stats[1] = min(count_stats[1], int(counts.min()))
+        count_stats[2] = max(count_stats[2], int(counts.max()))
+
+
+def resize_vector(vector, size):
+    """Pad a vector of counts with zeros up to the given size."""
+
+    if len(vector) >= size:
+        return vector
+    return np.concatenate([vector, np.zeros(size - len(vector),
+                                            dtype=vector.dtype)])
+
+
+def add_chunk_statistics(statistics, annotation_lists, evaluation_lists):
+    """Add a chunk of publications to the statistics of
+    build_annotation_statistics().
+
+    :param statistics: The map containing the statistics.
+    :param annotation_lists: The annotated targets of every publication.
+    :param evaluation_lists: The targets of the evaluation data of every
+    publication.
+    """
+
+    target_indices = statistics["target_indices"]
+    annotated = build_target_matrix(annotation_lists, target_indices)
+    expected = build_target_matrix(evaluation_lists, target_indices)
+    num_targets = len(target_indices)
+    annotated.resize((len(annotation_lists), num_targets))
+
+    correct = annotated.multiply(expected).tocsr()
+    missed = (expected - correct).tocsr()
+    wrong = (annotated - correct).tocsr()
+
+    statistics["documents"] += len(annotation_lists)
+    add_count_stats(statistics["targets_count"], np.diff(annotated.indptr))
+    add_count_stats(statistics["matching_targets_count"],
+                    np.diff(correct.indptr))
+
+    for name, matrix in [("true_positives", correct),
+                         ("false_negatives", missed),
+                         ("false_positives", wrong)]:
+        counts = resize_vector(statistics[name], num_targets)
+        counts += np.asarray(matrix.sum(axis=0)).ravel()
+        statistics[name] = counts
+
+    # A missed target of the evaluation data counts as confused with every
+    # target that was wrongly annotated for the same publication.
+    confusion_matrix = statistics["confusion_matrix"]
+    confusion_matrix.resize((num_targets, num_targets))
+    statistics["confusion_matrix"] = (confusion_matrix
+                                      + missed.T.tocsr() @ wrong).tocsr()
+
+
+def build_annotation_statistics(publications, targets,
+                                publication_annotation_index,
+                                publication_evaluation_data_index,
+                                chunk_size=4096):
+    """Compute the statistics of the annotated publications in a single pass.
+
+    The publications are processed in chunks. The annotations and the
+    evaluation data of a chunk are encoded as sparse matrices over the
+    targets, such that the counts are computed with matrix operations. Only
+    the current chunk and the counts per target are kept in memory, so the
+    publications may be read from a stream (see
+    data_loading.iter_annotated_metadata()).
+
+    The confusion matrix has one row and column per target. Its diagonal
+    contains the number of correct annotations of a target. An entry in row i
+    and column j counts the publications, for which target i of the
+    evaluation data was missed and target j was annotated wrongly instead.
+
+    :param publications: An iterable over the annotated publications.
+    :param targets: The list of targets. Targets in the annotations or the
+    evaluation data, that are not contained in the list, are appended.
+    :param publication_annotation_index: The index name of the annotated data
+    in the publications.
+    :param publication_evaluation_data_index: The index name of the evaluation
+    data in the publications.
+    :param chunk_size: The number of publications processed at once.
+    :return statistics: A map containing the number of publications, the sum,
+    the minimum and the maximum of the number of annotated and of correctly
+    annotated targets per publication, the true positives, false positives
+    and false negatives per target, the confusion matrix and the map of
+    targets to their index.
+    """
+
+    target_indices = {}
+    for target in targets:
+        target_indices.setdefault(target, len(target_indices))
+    num_targets = len(target_indices)
+    statistics = {"documents": 0,
+                  "targets_count": [0, None, None],
+                  "matching_targets_count": [0, None, None],
+                  "true_positives": np.zeros(num_targets, dtype=np.int64),
+                  "false_positives": np.zeros(num_targets, dtype=np.int64),
+                  "false_negatives": np.zeros(num_targets, dtype=np.int64),
+                  "confusion_matrix": sparse.csr_matrix(
+                      (num_targets, num_targets), dtype=np.int64),
+                  "target_indices": target_indices}
+
+    annotation_lists = []
+    evaluation_lists = []
+    for publication in publications:
+        annotation_lists.append(publication[publication_annotation_index])
+        evaluation_lists.append(
+            publication[publication_evaluation_data_index])
+        if len(annotation_lists) >= chunk_size:
+            add_chunk_statistics(statistics, annotation_lists,
+                                 evaluation_lists)
+            annotation_lists = []
+            evaluation_lists = []
+    if len(annotation_lists) > 0:
+        add_chunk_statistics(statistics, annotation_lists, evaluation_lists)
+
+    num_targets = len(target_indices)
+    for name in ["true_positives", "false_positives", "false_negatives"]:
+        statistics[name] = resize_vector(statistics[name], num_targets)
+    confusion_matrix = statistics["confusion_matrix"]
+    confusion_matrix.resize((num_targets, num_targets))
+    # A target is never missed and annotated wrongly for the same publication,
+    # so the diagonal is still empty.
+    confusion_matrix = confusion_matrix + sparse.diags(
+        statistics["true_positives"], format="csr", dtype=np.int64)
+    confusion_matrix.eliminate_zeros()
+    statistics["confusion_matrix"] = confusion_matrix
+    return statistics
+
+
+def compute_f1(precision, recall):
+    """Compute the F1 score (the harmonic mean) of precision and recall."""
+
+    denominator = precision + recall
+    return np.divide(2 * precision * recall, denominator,
+                     out=np.zeros_like(denominator, dtype=np.float64),
+                     where=denominator > 0)
+
+
+def build_precision_recall(statistics):
+    """Compute precision, recall and F1 score from the statistics of
+    build_annotation_statistics().
+
+    The micro average is computed over all annotations. The macro average is
+    the mean over all targets, that are contained in the annotations or the
+    evaluation data. A target without annotations has a precision of 0 and a
+    target without evaluation data has a recall of 0.
+
+    :param statistics: The map containing the statistics.
+    :return scores: A map containing the micro and macro averages as well as
+    the precision, recall and F1 score of every target.
+    """
+
+    true_positives = statistics["true_positives"].astype(np.float64)
+    annotated = true_positives + statistics["false_positives"]
+    expected = true_positives + statistics["false_negatives"]
+
+    precision = np.divide(true_positives, annotated,
+                          out=np.zeros_like(true_positives),
+                          where=annotated > 0)
+    recall = np.divide(true_positives, expected,
+                       out=np.zeros_like(true_positives),
+                       where=expected > 0)
+    f1 = compute_f1(precision, recall)
+
+    micro_precision = np.float64(0)
+    if annotated.sum() > 0:
+        micro_precision = true_positives.sum() / annotated.sum()
+    micro_recall = np.float64(0)
+    if expected.sum() > 0:
+        micro_recall = true_positives.sum() / expected.sum()
+
+    scores = {"micro": {"precision": float(micro_precision),
+                        "recall": float(micro_recall),
+                        "f1": float(compute_f1(micro_precision,
+                                               micro_recall))},
+              "macro": {"precision": 0.0, "recall": 0.0, "f1": 0.0},
+              "precision": precision,
+              "recall": recall,
+              "f1": f1}
+    present = (annotated + expected) > 0
+    if present.any():
+        scores["macro"] = {"precision": float(precision[present].mean()),
+                           "recall": float(recall[present].mean()),
+                           "f1": float(f1[present].mean())}
+    return scores
+
+
+def find_top_confusions(statistics, count):
+    """Find the most frequent confusions in the confusion matrix of
+    build_annotation_statistics().
+
+    :param statistics: The map containing the statistics.
+    :param count: The number of confusions.
+    :return confusions: A list of tuples of the missed target, the wrongly
+    annotated target and the number of publications, ordered by the number of
+    publications.
+    """
+
+    targets = list(statistics["target_indices"])
+    confusion_matrix = statistics["confusion_matrix"].tocoo()
+    off_diagonal = confusion_matrix.row != confusion_matrix.col
+    rows = confusion_matrix.row[off_diagonal]
+    columns = confusion_matrix.col[off_diagonal]
+    values = confusion_matrix.data[off_diagonal]
+    # Equal counts are ordered by the position of the targets.
+    order = np.lexsort((columns, rows, -values))[:count]
+    return [(targets[rows[index]], targets[columns[index]],
+             int(values[index])) for index in order]
+
+
+def build_document_counts(publications, publication_annotation_index,
+                          publication_evaluation_data_index,
+                          publication_id_index, chunk_size=4096):
+    """Count the correct and wrong annotations of every publication.
+
+    :param publications: An iterable over the annotated publications.
+    :param publication_annotation_index: The index name of the annotated data
+    in the publications.
+    :param publication_evaluation_data_index: The index name of the evaluation
+    data in the publications.
+    :param publication_id_index: The index name of the id in the
+    publications.
+    :param chunk_size: The number of publications processed at once.
+    :return ids: The list of publication ids.
+    :return counts: An array with one row per publication, which contains the
+    number of correctly annotated targets, wrongly annotated targets and
+    missed targets of the evaluation data.
+    """
+
+    ids = []
+    target_indices = {}
+    count_chunks = []
+    annotation_lists = []
+    evaluation_lists = []
+    for publication in itertools.chain(publications, [None]):
+        if publication is not None:
+            ids.append(dl.get_publication_id(publication, len(ids),
+                                             publication_id_index))
+            annotation_lists.append(publication[publication_annotation_index])
+            evaluation_lists.append(
+                publication[publication_evaluation_data_index])
+            if len(annotation_lists) < chunk_size:
+                continue
+        if len(annotation_lists) == 0:
+            break
+        annotated = build_target_matrix(annotation_lists, target_indices)
+        expected = build_target_matrix(evaluation_lists, target_indices)
+        annotated.resize(expected.shape)
+        correct = np.diff(annotated.multiply(expected).tocsr().indptr)
+        count_chunks.append(np.stack(
+            [correct,
+             np.diff(annotated.indptr) - correct,
+             np.diff(expected.indptr) - correct], axis=1))
+        annotation_lists = []
+        evaluation_lists = []
+
+    if len(count_chunks) == 0:
+        return ids, np.zeros((0, 3), dtype=np.int64)
+    return ids, np.concatenate(count_chunks)
+
+
+def align_document_counts(runs):
+    """Align the counts of multiple annotation runs by the publication id.
+
+    :param runs: The list of runs, each a tuple of the list of publication ids
+    and the counts of build_document_counts().
+    :return ids: The ids of the publications contained in all runs, in the
+    order of the first run.
+    :return counts: An array of the shape (publications, runs, 3) containing
+    the counts of every publication and run.
+    """
+
+    positions_list = []
+    for ids, run_counts in runs:
+        positions_list.append({publication_id: position for position,
+                               publication_id in enumerate(ids)})
+
+    ids = [publication_id for publication_id in runs[0][0]
+           if all(publication_id in positions
+                  for positions in positions_list)]
+    counts = np.zeros((len(ids), len(runs), 3), dtype=np.int64)
+    for run_index in range(len(runs)):
+        positions = positions_list[run_index]
+        rows = np.array([positions[publication_id] for publication_id in ids],
+                        dtype=np.int64)
+        if len(rows) > 0:
+            counts[:, run_index, :] = runs[run_index][1][rows]
+    return ids, counts
+
+
+def compute_run_scores(sums, num_documents):
+    """Compute the accuracy and the F1 score from summed counts.
+
+    The accuracy is the share of publications with at least one correctly
+    annotated target. The F1 score is the micro average over all annotations.
+
+    :param sums: An array, whose last axis contains the number of publications
+    with a correct target, the correctly annotated targets, the wrongly
+    annotated targets and the missed targets.
+    :param num_documents: The number of publications.
+    :return accuracy: The array of accuracies.
+    :return f1: The array of F1 scores.
+    """
+
+    accuracy = sums[..., 0] / max(1, num_documents)
+    denominator = 2 * sums[..., 1] + sums[..., 2] + sums[..., 3]
+    f1 = np.divide(2 * sums[..., 1], denominator,
+                   out=np.zeros(denominator.shape, dtype=np.float64),
+                   where=denominator > 0)
+    return accuracy, f1
+
+
+def build_run_statistics(counts):
+    """Build the per-publication statistics summed up by compute_run_scores().
+
+    :param counts: The aligned counts of align_document_counts().
+    :return statistics: An array of the shape (publications, runs, 4).
+    """
+
+    has_correct = (counts[..., :1] > 0).astype(np.int64)
+    return np.concatenate([has_correct, counts], axis=2).astype(np.float64)
+
+
+def compress_run_statistics(statistics):
+    """Group the publications by their statistics in all runs.
+
+    Publications with equal statistics are interchangeable for the resampling,
+    so the resampling only needs to draw how many publications of every group
+    are chosen. Usually, there are only a few groups.
+
+    :param statistics: The statistics of build_run_statistics().
+    :return patterns: An array of the shape (groups, runs x statistics)
+    containing the statistics of every group.
+    :return pattern_counts: The array of the number of publications of every
+    group.
+    """
+
+    num_documents, num_runs, num_statistics = statistics.shape
+    return np.unique(statistics.reshape(num_documents,
+                                        num_runs * num_statistics),
+                     axis=0, return_counts=True)
+
+
+def build_replicate_batches(num_replicates, num_groups, max_batch_items):
+    """Split the replicates of a resampling into batches, such that a batch
+    of weight matrices has a bounded size.
+
+    :param num_replicates: The number of replicates.
+    :param num_groups: The number of groups of publications.
+    :param max_batch_items: The maximum number of weights in a batch.
+    :return batch_sizes: The list of batch sizes.
+    """
+
+    batch_size = max(1, max_batch_items // max(1, num_groups))
+    batch_sizes = []
+    for start in range(0, num_replicates, batch_size):
+        batch_sizes.append(min(batch_size, num_replicates - start))
+    return batch_sizes
+
+
+def bootstrap_score_differences(statistics, num_replicates, rng,
+                                max_batch_items=10000000):
+    """Resample the publications with replacement and compute the difference
+    of the scores of every run to the first run for every replicate.
+
+    A replicate is represented by the number of publications drawn from every
+    group of compress_run_statistics(), which follows a multinomial
+    distribution. The summed statistics of all replicates of a batch are
+    computed by a single product of the (replicates, groups) weight matrix
+    with the (groups, runs x statistics) matrix.
+
+    :param statistics: The statistics of build_run_statistics().
+    :param num_replicates: The number of bootstrap replicates.
+    :param rng: The numpy random number generator.
+    :param max_batch_items: The maximum number of weights in a batch.
+    :return accuracy_differences: An array of the shape (replicates, runs)
+    containing the accuracy differences.
+    :return f1_differences: An array of the shape (replicates, runs)
+    containing the F1 score differences.
+    """
+
+    num_documents, num_runs, num_statistics = statistics.shape
+    patterns, pattern_counts = compress_run_statistics(statistics)
+    probabilities = pattern_counts / num_documents
+    accuracy_batches = []
+    f1_batches = []
+    for batch_size in build_replicate_batches(num_replicates,
+                                              len(pattern_counts),
+                                              max_batch_items):
+        weights = rng.multinomial(num_documents, probabilities, batch_size)
+        sums = (weights.astype(np.float64) @ patterns).reshape(
+            batch_size, num_runs, num_statistics)
+        accuracy, f1 = compute_run_scores(sums, num_documents)
+        accuracy_batches.append(accuracy - accuracy[:, :1])
+        f1_batches.append(f1 - f1[:, :1])
+    return np.concatenate(accuracy_batches), np.concatenate(f1_batches)
+
+
+def permutation_test(statistics, num_permutations, rng,
+                     max_batch_items=10000000):
+    """Test the differences of the scores of every run to the first run with
+    a paired permutation test (approximate randomization).
+
+    Every permutation swaps the annotations of the two runs for a random half
+    of the publications, i.e. the number of swapped publications of every
+    group of compress_run_statistics() follows a binomial distribution. The
+    p-value is the share of permutations, whose absolute score difference is
+    at least as large as the observed one.
+
+    :param statistics: The statistics of build_run_statistics().
+    :param num_permutations: The number of permutations.
+    :param rng: The numpy random number generator.
+    :param max_batch_items: The maximum number of swap counts in a batch.
+    :return accuracy_p_values: The array of p-values for every run.
+    :return f1_p_values: The array of p-values for every run.
+    """
+
+    num_documents, num_runs, num_statistics = statistics.shape
+    totals = statistics.sum(axis=0)
+    observed_accuracy, observed_f1 = compute_run_scores(totals, num_documents)
+    observed_accuracy = np.abs(observed_accuracy - observed_accuracy[0])
+    observed_f1 = np.abs(observed_f1 - observed_f1[0])
+    # The differences of the statistics of every run to the first run.
+    patterns, pattern_counts = compress_run_statistics(
+        statistics - statistics[:, :1, :])
+
+    accuracy_exceedances = np.zeros(num_runs, dtype=np.int64)
+    f1_exceedances = np.zeros(num_runs, dtype=np.int64)
+    # Tolerance against rounding errors of equal differences.
+    tolerance = 1e-12
+    for batch_size in build_replicate_batches(num_permutations,
+                                              len(pattern_counts),
+                                              max_batch_items):
+        swaps = rng.binomial(pattern_counts, 0.5,
+                             (batch_size, len(pattern_counts)))
+        swapped = (swaps.astype(np.float64) @ patterns).reshape(
+            batch_size, num_runs, num_statistics)
+        first_accuracy, first_f1 = compute_run_scores(
+            totals[0] + swapped, num_documents)
+        other_accuracy, other_f1 = compute_run_scores(
+            totals - swapped, num_documents)
+        accuracy_exceedances += (np.abs(other_accuracy - first_accuracy)
+                                 >= observed_accuracy - tolerance).sum(axis=0)
+        f1_exceedances += (np.abs(other_f1 - first_f1)
+                           >= observed_f1 - tolerance).sum(axis=0)
+
+    accuracy_p_values = (accuracy_exceedances + 1) / (num_permutations + 1)
+    f1_p_values = (f1_exceedances + 1) / (num_permutations + 1)
+    return accuracy_p_values, f1_p_values
@@ -0,0 +1,89 @@
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+import modules.prompt_engineering as pe
+import classes.fake_model as fake_model
+
+
+# The fake backend that answers the requests of all handler threads.
+server_model = None
+
+
+class fake_request_handler(BaseHTTPRequestHandler):
+    """Handler for the chat completions endpoint of an OpenAI-compatible
+    server, which answers with the fake backend."""
+
+    protocol_version = "HTTP/1.1"
+    # The headers and the body of a response are sent without waiting for
+    # the acknowledgement of the previous packet.
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        if not self.path.endswith("/chat/completions"):
+            self.send_json(404, {"error": {"message": "Not found"}})
+            return
+
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            request = json.loads(self.rfile.read(length))
+            messages = request["messages"]
+        except (ValueError, KeyError) as error:
+            self.send_json(400, {"error": {"message": str(error)}})
+            return
+
+        content = server_model.respond(messages,
+                                       request.get("max_tokens") or 200)
+        stop = request.get("stop") or []
+        if isinstance(stop, str):
+            stop = [stop]
+        for sequence in stop:
+            if sequence in content:
+                content = content[:content.index(sequence)]
+
+        prompt_tokens = 0
+        for message in messages:
+            prompt_tokens += pe.estimate_tokens(message["content"])
+
+        self.send_json(200, {
+            "object": "chat.completion",
+            "model": request.get("model", "fake"),
+            "choices": [{"index": 0,
+                         "message": {"role": "assistant",
+                                     "content": content},
+                         "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens,
+                      "completion_tokens": pe.estimate_tokens(content)}})
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # The requests are not logged, as every prompt list is one request.
+        pass
+
+
+def serve(port, settings):
+    """Serve the fake backend as an OpenAI-compatible chat completions
+    endpoint on localhost until the process is interrupted.
+
+    :param port: The port to listen on.
+    :param settings: The settings built by configuration.build_settings().
+    """
+
+    global server_model
+
+    server_model = fake_model.fake_model(settings)
+    server = ThreadingHTTPServer(("127.0.0.1", port), fake_request_handler)
+    print(f"Serving the fake backend at http://127.0.0.1:{port}/v1. Press "
+          f"Ctrl+C to stop.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
@@ -0,0 +1,116 @@
+import os
+import json
+import functools
+
+
+import modules.configuration as conf
+import classes.run_metrics as run_metrics
+
+
+# The metrics of the hot path of this process, which are collected by the
+# annotation functions and the backends. Annotation workers send them to the
+# main process together with every annotated block.
+collector = run_metrics.run_metrics()
+
+
+def timed(phase):
+    """Create a decorator, which adds the duration of every call of the
+    decorated function to a phase of the collector.
+
+    :param phase: The name of the phase.
+    :return decorator: The decorator.
+    """
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with collector.timer(phase):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def build_prometheus_text(report):
+    """Format a report of run_metrics.build_report() in the text format of
+    Prometheus, which can be read by the textfile collector of the node
+    exporter.
+
+    :param report: The map containing the summary of the metrics.
+    :return text: The metrics in the Prometheus text format.
+    """
+
+    lines = ["# TYPE keywordextractor_phase_seconds_total counter"]
+    for phase, timer in report["timers"].items():
+        lines.append(f"keywordextractor_phase_seconds_total"
+                     f"{{phase=\"{phase}\"}} {timer['seconds']}")
+    lines.append("# TYPE keywordextractor_phase_calls_total counter")
+    for phase, timer in report["timers"].items():
+        lines.append(f"keywordextractor_phase_calls_total"
+                     f"{{phase=\"{phase}\"}} {timer['count']}")
+
+    for name, value in sorted(report["counters"].items()):
+        lines.append(f"# TYPE keywordextractor_{name}_total counter")
+        lines.append(f"keywordextractor_{name}_total {value}")
+
+    for name in ["generated_tokens_per_second", "tokens_per_second"]:
+        if name in report:
+            lines.append(f"# TYPE keywordextractor_{name} gauge")
+            lines.append(f"keywordextractor_{name} {report[name]}")
+
+    for name, summary in report["histograms"].items():
+        lines.append(f"# TYPE keywordextractor_{name} summary")
+        for percentile, quantile in [(50, "0.5"), (95, "0.95"),
+                                     (99, "0.99")]:
+            if f"p{percentile}" in summary:
+                lines.append(f"keywordextractor_{name}"
+                             f"{{quantile=\"{quantile}\"}} "
+                             f"{summary[f'p{percentile}']}")
+        lines.append(f"keywordextractor_{name}_sum {summary['sum']}")
+        lines.append(f"keywordextractor_{name}_count {summary['count']}")
+
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics(metrics, metrics_file):
+    """Write the summary of the metrics to the configured file in the
+    configured format. The file is replaced atomically, such that a reader
+    never sees a partially written file.
+
+    :param metrics: The run_metrics object.
+    :param metrics_file: The absolute path of the file.
+    """
+
+    metrics_format = conf.config["metrics"]["metrics_format"]
+
+    report = metrics.build_report()
+    metrics_dir = os.path.dirname(metrics_file)
+    if not os.path.isdir(metrics_dir):
+        os.makedirs(metrics_dir, 0o775)
+    temporary_file = metrics_file + ".tmp"
+    with open(temporary_file, "w", encoding="utf-8") as outputfile:
+        if metrics_format == "prometheus":
+            outputfile.write(build_prometheus_text(report))
+        else:
+            json.dump(report, outputfile, indent=2)
+    os.replace(temporary_file, metrics_file)
+
+
+def print_summary(metrics):
+    """Print the durations of the phases and the quantiles of the document
+    latency.
+
+    :param metrics: The run_metrics object.
+    """
+
+    report = metrics.build_report()
+    for phase, timer in report["timers"].items():
+        print(f"The phase {phase} took {timer['seconds']:.3f} seconds in "
+              f"{timer['count']} calls.")
+    if "document_seconds" in report["histograms"]:
+        summary = report["histograms"]["document_seconds"]
+        print(f"Latency per document: p50 {summary['p50']:.3f} s, p95 "
+              f"{summary['p95']:.3f} s, p99 {summary['p99']:.3f} s.")
+    if "generated_tokens_per_second" in report:
+        print(f"The model generated "
+              f"{report['generated_tokens_per_second']:.1f} tokens per "
+              f"second.")
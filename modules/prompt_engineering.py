@@ -1,8 +1,19 @@
+import re
 import sys
 
 
-import modules.configuration as conf
 import modules.data_processing as dp
+import modules.metrics as metrics
+import classes.prompt_plan as prompt_plan
+
+
+# The prompt plans and the splits of targets into chat sessions built in
+# this process, see get_prompt_plan() and split_targets_per_chat(). Both are
+# cleared when they exceed max_memoized_entries, since refinement rounds
+# create a new list of targets for most documents.
+prompt_plans = {}
+chat_splits = {}
+max_memoized_entries = 10000
 
 
 def concatenate_targets_to_string_list(targets, count):
@@ -13,30 +24,39 @@ def concatenate_targets_to_string_list(targets, count):
     :param count: How many targets should be concatenated per list item.
     """
 
-    targets_split = [targets[i:i+count] for i in range(0, len(targets), count)]
+    return [", ".join(targets[i:i+count])
+            for i in range(0, len(targets), count)]
+
 
-    targets_string_list = []
-    for split in targets_split:
-        split_string = ""
-        for target in split:
-            split_string += target + ", "
-        split_string = split_string[:-2]
-        targets_string_list.append(split_string)
+def build_targets_prompt(targets_string, first, settings):
+    """Build a prompt that adds targets to the targets_list.
 
-    return targets_string_list
+    :param targets_string: The concatenated targets.
+    :param first: Whether the prompt adds the first targets of a chat.
+    :param settings: The settings built by configuration.build_settings().
+    """
 
+    target_name = settings["prompt"]["target_name"]
 
-def build_query_prompt_list(document, targets):
-    """Build a sequence of prompts to annotate a given document.
+    if first:
+        return "Here are some " + target_name + "s that should be added to "\
+               + "the targets_list: " + targets_string + ". Please use the "\
+               + "exact spelling that I provide to you."
+    return "Here are some additional " + target_name + "s I want you to add "\
+           + "to the targets_list: " + targets_string + ". Please use the "\
+           + "exact spelling that I provide to you."
+
+
+def build_targets_prompt_list(targets, settings):
+    """Build the sequence of prompts that present the possible targets to the
+    LLM (the targets_list). These prompts are the same for every document.
 
-    :param document: The document that should be annotated.
     :param targets: A list of possible targets used in the annotation.
+    :param settings: The settings built by configuration.build_settings().
     """
 
-    document_name = conf.config["prompt"]["document_name"]
-    target_name = conf.config["prompt"]["target_name"]
-    num_targets = int(conf.config["prompt"]["num_targets"])
-    targets_per_prompt = int(conf.config["prompt"]["targets_per_prompt"])
+    target_name = settings["prompt"]["target_name"]
+    targets_per_prompt = settings["prompt"]["targets_per_prompt"]
 
     targets_string_list = concatenate_targets_to_string_list(
         targets,
@@ -48,98 +68,506 @@ def build_query_prompt_list(document, targets):
              + "following. We call this list targets_list."
     prompt_list.append(prompt)
 
-    prompt = "Here are some " + target_name + "s that should be added to the "\
-             + "targets_list: " + targets_string_list[0] + ". Please use the "\
-             + "exact spelling that I provide to you."
-    prompt_list.append(prompt)
-    for i in range(1, len(targets_string_list)):
-        prompt = "Here are some additional " + target_name + "s I want you "\
-                 + "to add to the targets_list: " + targets_string_list[i]\
-                 + ". Please use the exact spelling that I provide to you."
-        prompt_list.append(prompt)
-
-    prompt = "We now want to annotate a " + document_name + " with the "\
-             + target_name + "s provided in the targets_list.\n"
-    prompt += "Given the following " + document_name + ": " + document + "\n"
+    for i in range(len(targets_string_list)):
+        prompt_list.append(build_targets_prompt(targets_string_list[i],
+                                                i == 0, settings))
+
+    return prompt_list
+
+
+def build_query_prompt_template(settings):
+    """Build the head and the tail of the final prompt, which asks for the
+    annotation of a document with the targets of the targets_list. The
+    document is inserted between them.
+
+    :param settings: The settings built by configuration.build_settings().
+    :return query_template: The head and the tail of the prompt.
+    """
+
+    document_name = settings["prompt"]["document_name"]
+    target_name = settings["prompt"]["target_name"]
+    num_targets = settings["prompt"]["num_targets"]
+
+    head = "We now want to annotate a " + document_name + " with the "\
+           + target_name + "s provided in the targets_list.\n"
+    head += "Given the following " + document_name + ": "
     if num_targets == 1:
-        prompt += "Please assign 1 suitable " + target_name + " from the "\
-                  + "targets_list to the " + document_name + ".\n"\
-                  + "This " + target_name + " should be contained in the "\
-                  + "targets_list we created earlier and use the exact "\
-                  + "spelling of the " + target_name + " in the targets_list."\
-                  + "\n"\
-                  + "Please respond only with the 1 " + target_name\
-                  + " without any further text."
+        tail = "\nPlease assign 1 suitable " + target_name + " from the "\
+               + "targets_list to the " + document_name + ".\n"\
+               + "This " + target_name + " should be contained in the "\
+               + "targets_list we created earlier and use the exact "\
+               + "spelling of the " + target_name + " in the targets_list."\
+               + "\n"\
+               + "Please respond only with the 1 " + target_name\
+               + " without any further text."
     else:
-        prompt += "Please assign up to " + str(num_targets) + " suitable "\
-                  + target_name + "s from the targets_list to the "\
-                  + document_name + ".\n"\
-                  + "These " + target_name + "s should be contained in the "\
-                  + "targets_list we created earlier and use the exact "\
-                  + "spelling of the " + target_name + " in the targets_list."\
-                  + "\n"\
-                  + "Please respond only with the " + str(num_targets) + " "\
-                  + target_name + "s separated by comma and without any "\
-                  + "further text."
-    prompt_list.append(prompt)
+        tail = "\nPlease assign up to " + str(num_targets) + " suitable "\
+               + target_name + "s from the targets_list to the "\
+               + document_name + ".\n"\
+               + "These " + target_name + "s should be contained in the "\
+               + "targets_list we created earlier and use the exact "\
+               + "spelling of the " + target_name + " in the targets_list."\
+               + "\n"\
+               + "Please respond only with the " + str(num_targets) + " "\
+               + target_name + "s separated by comma and without any "\
+               + "further text."
+
+    return head, tail
+
+
+def build_batch_query_prompt_template(settings):
+    """Build the head and the tail of the final prompt of a batch of
+    documents. The prompt starts with "We now want to annotate " and the
+    number of documents, which are followed by the head, the numbered
+    documents and the tail.
+
+    :param settings: The settings built by configuration.build_settings().
+    :return batch_template: The head and the tail of the prompt.
+    """
 
-    return prompt_list
+    document_name = settings["prompt"]["document_name"]
+    target_name = settings["prompt"]["target_name"]
+    num_targets = settings["prompt"]["num_targets"]
+
+    head = " " + document_name + "s with the " + target_name + "s provided "\
+           + "in the targets_list.\n"
+    head += "Given the following numbered " + document_name + "s:\n"
+    if num_targets == 1:
+        tail = "Please assign 1 suitable " + target_name + " from the "\
+               + "targets_list to every " + document_name + ".\n"\
+               + "This " + target_name + " should be contained in the "\
+               + "targets_list we created earlier and use the exact "\
+               + "spelling of the " + target_name + " in the targets_list."\
+               + "\n"\
+               + "Please respond with one line per " + document_name\
+               + ", which contains the number of the " + document_name\
+               + ", a colon and the 1 " + target_name + " (e.g. \"1: "\
+               + target_name + "\"), without any further text."
+    else:
+        tail = "Please assign up to " + str(num_targets) + " suitable "\
+               + target_name + "s from the targets_list to every "\
+               + document_name + ".\n"\
+               + "These " + target_name + "s should be contained in the "\
+               + "targets_list we created earlier and use the exact "\
+               + "spelling of the " + target_name + " in the targets_list."\
+               + "\n"\
+               + "Please respond with one line per " + document_name\
+               + ", which contains the number of the " + document_name\
+               + ", a colon and the " + str(num_targets) + " "\
+               + target_name + "s separated by comma (e.g. \"1: "\
+               + target_name + ", " + target_name + "\"), without any "\
+               + "further text."
+
+    return head, tail
+
+
+def get_prompt_plan(targets, settings):
+    """Return the prompt plan of a chat session that presents the given
+    targets. The plan is built once per list of targets and prompt settings
+    and reused afterwards.
+
+    The plan depends on the order of the targets, as they are presented in
+    this order.
+
+    :param targets: The list of targets presented in the chat session.
+    :param settings: The settings built by configuration.build_settings().
+    :return plan: The prompt plan (see classes/prompt_plan.py).
+    """
+
+    key = (tuple(targets), tuple(settings["prompt"].items()))
+    plan = prompt_plans.get(key)
+    if plan is None:
+        plan = prompt_plan.prompt_plan(
+            targets,
+            build_targets_prompt_list(targets, settings),
+            build_query_prompt_template(settings),
+            build_batch_query_prompt_template(settings))
+        if len(prompt_plans) >= max_memoized_entries:
+            prompt_plans.clear()
+        prompt_plans[key] = plan
+    return plan
+
+
+def build_query_prompt(document, settings):
+    """Build the final prompt, which asks for the annotation of a given
+    document with the targets of the targets_list.
+
+    :param document: The document that should be annotated.
+    :param settings: The settings built by configuration.build_settings().
+    """
+
+    return get_prompt_plan([], settings).build_query_prompt(document)
+
+
+@metrics.timed("prompt_build")
+def build_query_prompt_list(document, targets, settings):
+    """Build a sequence of prompts to annotate a given document.
+
+    :param document: The document that should be annotated.
+    :param targets: A list of possible targets used in the annotation.
+    :param settings: The settings built by configuration.build_settings().
+    """
+
+    plan = get_prompt_plan(targets, settings)
+    return plan.build_query_prompt_list(document)
+
+
+@metrics.timed("prompt_build")
+def build_batch_query_prompt_list(documents, targets, settings):
+    """Build a sequence of prompts to annotate multiple documents at once.
+    The documents are numbered in the final prompt and the LLM is asked to
+    answer with one numbered line per document (see parse_batch_result()).
+
+    :param documents: The list of documents that should be annotated.
+    :param targets: A list of possible targets used in the annotation.
+    :param settings: The settings built by configuration.build_settings().
+    """
+
+    plan = get_prompt_plan(targets, settings)
+    return plan.build_batch_query_prompt_list(documents)
+
+
+def split_targets_per_chat(targets, documents, settings):
+    """Split the targets into the parts that are presented to the LLM in
+    separate chat sessions.
 
+    If a fraction of the context window is configured, every chat gets as
+    many targets as fit into this fraction next to the longest of the given
+    documents. The configured number of targets per prompt and prompts per
+    chat are upper limits in any case.
 
-def build_query_prompt_lists(document, targets):
-    targets_per_prompt = int(conf.config["prompt"]["targets_per_prompt"])
-    prompts_per_chat = int(conf.config["prompt"]["prompts_per_chat"])
+    The split only depends on the documents through the estimated tokens of
+    the longest one, so it is memoized per list of targets and number of
+    tokens.
+
+    :param targets: The targets list.
+    :param documents: The documents that are annotated in the chat sessions.
+    :param settings: The settings built by configuration.build_settings().
+    :return targets_per_chat_list: A list of target lists, one per chat.
+    """
+
+    targets_per_prompt = settings["prompt"]["targets_per_prompt"]
+    prompts_per_chat = settings["prompt"]["prompts_per_chat"]
+    context_fraction = settings["prompt"]["context_fraction"]
+    n_ctx = settings["gpt4all"]["n_ctx"]
+    intermediate_max_tokens = settings["gpt4all"]["intermediate_max_tokens"]
+    final_max_tokens = settings["gpt4all"]["final_max_tokens"]
     targets_per_chat = targets_per_prompt * prompts_per_chat
 
-    targets_per_chat_list = [targets[i:i+targets_per_chat] for i in
-                             range(0, len(targets), targets_per_chat)]
+    if context_fraction == 0 or len(targets) == 0:
+        return [targets[i:i+targets_per_chat] for i in
+                range(0, len(targets), targets_per_chat)]
+
+    longest_document = ""
+    for document in documents:
+        if len(document) > len(longest_document):
+            longest_document = document
+
+    # The first prompt of a chat, the final prompt and its response do not
+    # depend on the number of targets in the chat.
+    base_plan = get_prompt_plan([], settings)
+    fixed_tokens = estimate_prompt_tokens(base_plan.preamble[0],
+                                          intermediate_max_tokens)\
+        + estimate_prompt_tokens(
+            base_plan.build_query_prompt(longest_document),
+            compute_final_max_tokens(targets, settings))
+
+    key = (tuple(targets), fixed_tokens, tuple(settings["prompt"].items()),
+           n_ctx, intermediate_max_tokens, final_max_tokens)
+    targets_per_chat_list = chat_splits.get(key)
+    if targets_per_chat_list is not None:
+        return [list(chat) for chat in targets_per_chat_list]
+
+    available_tokens = int(n_ctx * context_fraction)
+    targets_per_chat_list = []
+    chat = []
+    chat_tokens = fixed_tokens
+    prompt_tokens = 0
+    for target in targets:
+        if len(chat) == targets_per_chat:
+            targets_per_chat_list.append(chat)
+            chat = []
+            chat_tokens = fixed_tokens
+
+        # The tokens of the prompt that the target is added to are estimated
+        # again, as a whole.
+        prompt_targets = chat[len(chat) - len(chat) % targets_per_prompt:]
+        if len(prompt_targets) == 0:
+            prompt_tokens = 0
+        new_prompt_tokens = estimate_prompt_tokens(
+            build_targets_prompt(", ".join(prompt_targets + [target]),
+                                 len(chat) < targets_per_prompt, settings),
+            intermediate_max_tokens)
+        if len(chat) > 0 and chat_tokens - prompt_tokens + new_prompt_tokens\
+                > available_tokens:
+            targets_per_chat_list.append(chat)
+            chat = []
+            chat_tokens = fixed_tokens
+            prompt_tokens = 0
+            new_prompt_tokens = estimate_prompt_tokens(
+                build_targets_prompt(target, True, settings),
+                intermediate_max_tokens)
+
+        chat.append(target)
+        chat_tokens += new_prompt_tokens - prompt_tokens
+        prompt_tokens = new_prompt_tokens
+    targets_per_chat_list.append(chat)
+
+    if len(chat_splits) >= max_memoized_entries:
+        chat_splits.clear()
+    chat_splits[key] = tuple(tuple(chat) for chat in targets_per_chat_list)
+    return targets_per_chat_list
+
+
+@metrics.timed("prompt_build")
+def build_query_prompt_lists(document, targets, settings):
+    targets_per_chat_list = split_targets_per_chat(targets, [document],
+                                                   settings)
 
     prompt_lists = []
     for targets_list in targets_per_chat_list:
-        prompt_lists.append(build_query_prompt_list(document, targets_list))
+        plan = get_prompt_plan(targets_list, settings)
+        prompt_lists.append(plan.build_query_prompt_list(document))
 
     return prompt_lists
 
 
-def process_query_prompt_lists(model, prompt_lists, targets_map):
-    debug_mode = int(conf.config["general"]["debug"])
+def compute_final_max_tokens(targets_map, settings):
+    """Compute the maximum number of tokens the LLM may generate in response
+    to the final annotation prompt.
+
+    If no limit is configured, the limit is derived from the number of targets
+    that should be annotated and the length of the longest target. Every token
+    covers at least one character, so the number of characters of the longest
+    possible answer is an upper bound for its number of tokens.
+
+    :param targets_map: The map of canonical targets to their original form
+    (or a list of targets).
+    :param settings: The settings built by configuration.build_settings().
+    :return final_max_tokens: The maximum number of tokens.
+    """
+
+    num_targets = settings["prompt"]["num_targets"]
+    final_max_tokens = settings["gpt4all"]["final_max_tokens"]
+
+    if final_max_tokens > 0:
+        return final_max_tokens
+
+    longest_target_length = 0
+    for target in targets_map:
+        if len(target) > longest_target_length:
+            longest_target_length = len(target)
+
+    # Every target is followed by a separator (", ") or the end of the line.
+    return num_targets * (longest_target_length + 2)
+
+
+def estimate_tokens(text):
+    """Estimate the number of tokens of a text.
+
+    gpt4all does not expose the tokenizer of the model. English text has
+    about four characters per token, so three characters per token give a
+    conservative estimate.
+
+    :param text: The text.
+    :return num_tokens: The estimated number of tokens.
+    """
+
+    return len(text) // 3 + 1
+
+
+def estimate_prompt_tokens(prompt, max_tokens):
+    """Estimate the number of tokens a prompt and its response occupy in the
+    context window of the LLM.
+
+    :param prompt: The prompt.
+    :param max_tokens: The maximum number of tokens of the response.
+    :return num_tokens: The estimated number of tokens.
+    """
+
+    # The chat template adds a few tokens around every prompt and response.
+    template_tokens = 8
+    return estimate_tokens(prompt) + max_tokens + 2 * template_tokens
+
+
+def compute_batch_max_tokens(num_documents, targets_map, settings):
+    """Compute the maximum number of tokens the LLM may generate in response
+    to the final prompt of a batch of documents.
+
+    :param num_documents: The number of documents in the batch.
+    :param targets_map: The map of canonical targets to their original form.
+    :param settings: The settings built by configuration.build_settings().
+    :return batch_max_tokens: The maximum number of tokens.
+    """
+
+    # Every line starts with the number of the document and a colon.
+    line_prefix_tokens = 4
+    final_max_tokens = compute_final_max_tokens(targets_map, settings)
+    return num_documents * (final_max_tokens + line_prefix_tokens)
+
+
+def build_document_batches(documents, targets, targets_map, settings):
+    """Split the documents into the batches that are annotated with one
+    prompt.
+
+    Consecutive documents are added to a batch as long as the prompts of the
+    largest chat session and the expected response fit into the context
+    window of the LLM and the configured number of documents per prompt is
+    not exceeded. A document, which does not fit together with others, forms
+    a batch of its own.
+
+    :param documents: The list of documents that should be annotated.
+    :param targets: The list of possible targets.
+    :param targets_map: The map of canonical targets to their original form.
+    :param settings: The settings built by configuration.build_settings().
+    :return batches: A list of batches, each a list of document indices.
+    """
+
+    documents_per_prompt = settings["prompt"]["documents_per_prompt"]
+    n_ctx = settings["gpt4all"]["n_ctx"]
+    intermediate_max_tokens = settings["gpt4all"]["intermediate_max_tokens"]
+
+    if documents_per_prompt == 1:
+        return [[index] for index in range(len(documents))]
+
+    fixed_tokens = 0
+    for targets_list in split_targets_per_chat(targets, documents, settings):
+        prompt_list = build_batch_query_prompt_list([], targets_list,
+                                                    settings)
+        chat_tokens = 0
+        for index in range(len(prompt_list) - 1):
+            chat_tokens += estimate_prompt_tokens(prompt_list[index],
+                                                  intermediate_max_tokens)
+        chat_tokens += estimate_prompt_tokens(
+            prompt_list[-1],
+            compute_batch_max_tokens(0, targets_map, settings))
+        fixed_tokens = max(fixed_tokens, chat_tokens)
+    available_tokens = n_ctx - fixed_tokens
+
+    batches = []
+    batch = []
+    batch_tokens = 0
+    for index in range(len(documents)):
+        document_tokens = estimate_tokens(str(len(batch) + 1) + ". "
+                                          + documents[index] + "\n")\
+                          + compute_batch_max_tokens(1, targets_map, settings)
+        batch_full = documents_per_prompt > 0\
+            and len(batch) >= documents_per_prompt
+        if len(batch) > 0 and (batch_full or batch_tokens + document_tokens
+                               > available_tokens):
+            batches.append(batch)
+            batch = []
+            batch_tokens = 0
+        batch.append(index)
+        batch_tokens += document_tokens
+    if len(batch) > 0:
+        batches.append(batch)
+
+    return batches
+
+
+def process_batch_query_prompt_list(model, documents, targets, targets_map,
+                                    settings):
+    """Annotate a batch of documents with a single prompt list.
+
+    Documents, whose answer is missing in the response or contains no known
+    target, are annotated again with a prompt list of their own.
+
+    :param model: The model that is used to evaluate the prompt lists.
+    :param documents: The list of documents that should be annotated.
+    :param targets: The list of possible targets presented in one chat.
+    :param targets_map: The map of canonical targets to their original form.
+    :param settings: The settings built by configuration.build_settings().
+    :return annotated_targets_lists: The list of annotated targets for every
+    document in the order of the given documents.
+    """
+
+    debug_mode = settings["general"]["debug"]
+
+    if len(documents) == 1:
+        prompt_list = build_query_prompt_list(documents[0], targets, settings)
+        return [process_query_prompt_lists(model, [prompt_list], targets_map,
+                                           settings)]
+
+    prompt_list = build_batch_query_prompt_list(documents, targets, settings)
+    if debug_mode == 1:
+        print(f"Running a prompt list for {len(documents)} documents.")
+    metrics.collector.increment("prompt_lists")
+    result = model.eval_prompt_list(prompt_list,
+                                    compute_batch_max_tokens(len(documents),
+                                                             targets_map,
+                                                             settings),
+                                    len(documents))
+    if debug_mode == 1:
+        print("Obtained the following result:")
+        print(result)
+    annotated_targets_lists = parse_batch_result(result, len(documents),
+                                                 targets_map, settings)
+
+    for index in range(len(documents)):
+        if annotated_targets_lists[index] is not None:
+            continue
+        if debug_mode == 1:
+            print(f"The answer for document {index + 1} is missing or "
+                  f"invalid. Querying the document on its own.")
+        prompt_list = build_query_prompt_list(documents[index], targets,
+                                              settings)
+        annotated_targets_lists[index] = process_query_prompt_lists(
+            model,
+            [prompt_list],
+            targets_map,
+            settings)
+
+    return annotated_targets_lists
+
+
+def process_query_prompt_lists(model, prompt_lists, targets_map, settings):
+    debug_mode = settings["general"]["debug"]
+    final_max_tokens = compute_final_max_tokens(targets_map, settings)
     annotated_targets = []
     for i in range(len(prompt_lists)):
         if debug_mode == 1:
             print(f"Running prompt list {i+1}/{len(prompt_lists)}.")
         prompt_list = prompt_lists[i]
-        result = model.eval_prompt_list(prompt_list)
+        metrics.collector.increment("prompt_lists")
+        result = model.eval_prompt_list(prompt_list, final_max_tokens)
         if debug_mode == 1:
             print("Obtained the following result:")
             print(result)
-        parsed_result = parse_result(result, targets_map)
+        parsed_result = parse_result(result, targets_map, settings)
         if debug_mode == 1:
             print("Extracted the following targets:")
             print(parsed_result)
         for target in parsed_result:
             annotated_targets.append(target)
-    annotated_targets = list(set(annotated_targets))
+    # Remove duplicates but keep the order, so the result does not depend on
+    # the string hashing of the running process.
+    annotated_targets = list(dict.fromkeys(annotated_targets))
     return annotated_targets
 
 
-def parse_result(result, targets_set):
+@metrics.timed("parse")
+def parse_result(result, targets_set, settings):
     """ Parse the answer to the annotation query generated by the LLM and
     extract the annotated targets.
 
     :param result: The query response generated by an LLM.
     :param targets_set: A set of possible target values in canonical form.
+    :param settings: The settings built by configuration.build_settings().
     """
 
-    target_name = conf.config["prompt"]["target_name"]
+    target_name = settings["prompt"]["target_name"]
+    quiet = settings["general"]["quiet"]
 
     tokens = result.split(",")
 
-    if len(tokens) == 1:
-        print(f"Extracted {len(tokens)} {target_name} candidate from the LLM "
-              f"response.")
-    else:
-        print(f"Extracted {len(tokens)} {target_name} candidates from the LLM "
-              f"response.")
+    if quiet != 1:
+        if len(tokens) == 1:
+            print(f"Extracted {len(tokens)} {target_name} candidate from the "
+                  f"LLM response.")
+        else:
+            print(f"Extracted {len(tokens)} {target_name} candidates from the "
+                  f"LLM response.")
 
     for index in range(len(tokens)):
         tokens[index] = dp.build_canonical_target_form(tokens[index])
@@ -149,11 +577,50 @@ def parse_result(result, targets_set):
         if token in targets_set.keys():
             final_tokens.append(targets_set[token])
 
-    if len(final_tokens) == 1:
-        print(f"{len(final_tokens)} {target_name} candidate was found in the "
-              f"given {target_name}s.")
-    else:
-        print(f"{len(final_tokens)} {target_name} candidates were found in "
-              f"the given {target_name}s.")
+    if quiet != 1:
+        if len(final_tokens) == 1:
+            print(f"{len(final_tokens)} {target_name} candidate was found in "
+                  f"the given {target_name}s.")
+        else:
+            print(f"{len(final_tokens)} {target_name} candidates were found "
+                  f"in the given {target_name}s.")
 
     return final_tokens
+
+
+@metrics.timed("parse")
+def parse_batch_result(result, num_documents, targets_set, settings):
+    """Parse the answer to a batch annotation query generated by the LLM and
+    extract the annotated targets of every document.
+
+    Every line of the answer should start with the number of a document
+    followed by a colon (or a period or parenthesis) and the targets of this
+    document. Lines without a valid document number are ignored. If a
+    document is answered more than once, the first valid answer is used.
+
+    :param result: The query response generated by an LLM.
+    :param num_documents: The number of documents in the batch.
+    :param targets_set: A set of possible target values in canonical form.
+    :param settings: The settings built by configuration.build_settings().
+    :return annotated_targets_lists: The list of annotated targets for every
+    document or None if the answer for the document is missing or contains
+    no known target.
+    """
+
+    annotated_targets_lists = [None] * num_documents
+
+    for line in result.splitlines():
+        match = re.match(r"^\s*(\d+)\s*[:.)]\s*(.*)$", line)
+        if match is None:
+            continue
+        index = int(match.group(1)) - 1
+        if index < 0 or index >= num_documents:
+            continue
+        if annotated_targets_lists[index] is not None:
+            continue
+        annotated_targets = parse_result(match.group(2), targets_set,
+                                         settings)
+        if len(annotated_targets) > 0:
+            annotated_targets_lists[index] = annotated_targets
+
+    return annotated_targets_lists
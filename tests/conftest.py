@@ -0,0 +1,9 @@
+import os
+import sys
+
+
+# The configuration is read relative to the started script (see
+# modules/configuration.py), which is pytest and not the tool here.
+tooldir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.argv[0] = os.path.join(tooldir, "keywordextractor.py")
+sys.path.insert(0, tooldir)
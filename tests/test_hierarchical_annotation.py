@@ -0,0 +1,87 @@
+import pytest
+
+
+import modules.configuration as conf
+import modules.data_processing as dp
+import modules.annotation as an
+import modules.prompt_engineering as pe
+import classes.fake_model as fake_model
+
+
+class choose_all_model:
+    """Model that answers with all labels presented in the chat."""
+
+    concurrency = 1
+
+    def __init__(self):
+        self.prompt_lists = []
+
+    def eval_prompt_list(self, prompt_list, final_max_tokens=200,
+                         num_lines=1):
+        self.prompt_lists.append(prompt_list)
+        labels = []
+        for prompt in prompt_list[:-1]:
+            match = fake_model.fake_model.targets_pattern.search(prompt)
+            if match is not None:
+                labels.append(match.group(1))
+        return ", ".join(labels)
+
+
+@pytest.fixture
+def settings():
+    snapshot = conf.get_snapshot()
+    conf.set_option("general", "quiet", "1")
+    conf.set_option("prompt", "num_targets", "2")
+    conf.set_option("prompt", "targets_per_prompt", "10")
+    conf.set_option("prompt", "context_fraction", "0")
+    yield conf.settings
+    conf.load_snapshot(snapshot)
+
+
+def test_shared_child_is_presented_once(settings):
+    taxonomy = {"Science": ["Physics", "Biology"],
+                "Applied": ["Physics", "Engineering"]}
+    targets = ["Physics", "Biology", "Engineering", "Chemistry"]
+    target_tree = dp.build_taxonomy_tree(taxonomy, targets)
+    model = choose_all_model()
+
+    annotated_targets, cost = an.annotate_document_hierarchically(
+        model, "A document", target_tree, settings)
+
+    assert annotated_targets == ["Physics", "Biology"]
+    assert cost == {"rounds": 2, "calls": 2}
+    assert "Physics, Biology, Engineering, Chemistry" in\
+        model.prompt_lists[1][1]
+
+
+def test_max_rounds_builds_no_prompts_for_skipped_round(settings,
+                                                        monkeypatch):
+    conf.set_option("annotation", "max_rounds", "1")
+    built_prompt_lists = []
+    build_query_prompt_lists = pe.build_query_prompt_lists
+
+    def counting_build_query_prompt_lists(document, targets, settings):
+        built_prompt_lists.append(targets)
+        return build_query_prompt_lists(document, targets, settings)
+
+    monkeypatch.setattr(pe, "build_query_prompt_lists",
+                        counting_build_query_prompt_lists)
+    taxonomy = {"Science": ["Physics", "Biology"],
+                "Applied": ["Physics", "Engineering"]}
+    target_tree = dp.build_taxonomy_tree(taxonomy, ["Physics", "Biology",
+                                                    "Engineering"])
+    model = choose_all_model()
+
+    annotated_targets, cost = an.annotate_document_hierarchically(
+        model, "A document", target_tree, conf.settings)
+
+    assert cost == {"rounds": 1, "calls": 1}
+    assert len(model.prompt_lists) == 1
+    assert len(built_prompt_lists) == 1
+    assert annotated_targets == ["Physics", "Biology"]
+
+
+def test_group_with_the_name_of_a_target_is_rejected():
+    with pytest.raises(SystemExit):
+        dp.build_taxonomy_tree({"physics": ["Biology"]},
+                               ["Physics", "Biology"])
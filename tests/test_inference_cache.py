@@ -0,0 +1,26 @@
+import modules.configuration as conf
+import classes.fake_model as fake_model
+import classes.inference_cache as inference_cache
+
+
+def test_access_times_are_written_per_block(tmp_path):
+    cache_file = str(tmp_path / "cache.sqlite")
+    cache = inference_cache.inference_cache(
+        fake_model.fake_model(conf.settings), cache_file, conf.settings)
+    prompt_list = ["Here are some topics that should be added to the "
+                   "targets_list: Physics. Please use the exact spelling "
+                   "that I provide to you.",
+                   "Given the following title: A document"]
+    cache.eval_prompt_list(prompt_list)
+    (first_access,) = cache.connection.execute(
+        "SELECT last_access FROM responses").fetchone()
+
+    cache.eval_prompt_list(prompt_list)
+    assert cache.connection.execute(
+        "SELECT last_access FROM responses").fetchone() == (first_access,)
+
+    assert cache.take_counters() == {"cache_hits": 1, "cache_misses": 1}
+    (last_access,) = cache.connection.execute(
+        "SELECT last_access FROM responses").fetchone()
+    assert last_access > first_access
+    cache.close()
@@ -0,0 +1,31 @@
+import pytest
+
+import classes.run_metrics as run_metrics
+
+
+def test_histograms_are_bounded_and_merged():
+    worker_metrics = run_metrics.run_metrics()
+    for value in range(1, 10001):
+        worker_metrics.observe("prompt_tokens", value)
+    metrics = run_metrics.run_metrics()
+    metrics.observe("prompt_tokens", 0)
+    metrics.merge(worker_metrics.take_snapshot())
+
+    histogram = metrics.histograms["prompt_tokens"]
+    assert len(histogram["buckets"]) <= 14 * run_metrics.BUCKETS_PER_DOUBLING
+    summary = metrics.build_report()["histograms"]["prompt_tokens"]
+    assert summary["count"] == 10001
+    assert summary["sum"] == 10000 * 10001 // 2
+    assert summary["min"] == 0
+    assert summary["max"] == 10000
+    for percentile in [50, 95, 99]:
+        exact = percentile * 100
+        assert exact <= summary[f"p{percentile}"] <= exact * 1.045
+    assert worker_metrics.build_report()["histograms"] == {}
+
+
+def test_single_value_is_exact():
+    metrics = run_metrics.run_metrics()
+    metrics.observe("document_seconds", 0.123)
+    summary = metrics.build_report()["histograms"]["document_seconds"]
+    assert summary["p50"] == summary["p99"] == pytest.approx(0.123)